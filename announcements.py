@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+"""
+announcements.py -- Udacity conference server-side Python App Engine
+    cached announcement & featured speaker banners
+
+Kept apart from conference.py so the task, cron & warmup handlers in
+main.py don't have to import the whole Endpoints API.
+
+"""
+
+from datetime import date
+
+from google.appengine.ext import ndb
+
+from cache import TwoTierCache
+from models import Conference
+from models import FeaturedSpeaker
+
+MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
+MEMCACHE_FEATURED_SPEAKER_KEY = "FEATURED_SPEAKER_"  # + websafeConferenceKey
+FEATURED_SPEAKER_ID = "featured"
+CONFIRMATION_EMAIL_QUEUE = "confirmation-email"
+
+ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
+                    'are nearly sold out: %s')
+
+FEATURED_SPEAKER_TPL = ('Join Featured Speaker {} for the following sessions: {}')
+
+# number of upcoming conferences whose featured speaker is primed on warmup
+WARMUP_CONFERENCES = 20
+
+# the hourly cron rewrites the announcement, so a minute per instance is fine
+ANNOUNCEMENT_CACHE = TwoTierCache('announcements', '', local_seconds=60,
+                                  stale_seconds=60)
+FEATURED_SPEAKER_CACHE = TwoTierCache(
+    'featured_speakers', MEMCACHE_FEATURED_SPEAKER_KEY, local_seconds=30,
+    max_items=2000, stale_seconds=30)
+
+
+def _buildAnnouncement():
+    """Return the announcement for nearly sold out conferences, or ""."""
+    confs = Conference.query(ndb.AND(
+        Conference.seatsAvailable <= 5,
+        Conference.seatsAvailable > 0)
+    ).fetch(projection=[Conference.name])
+
+    if confs:
+        return ANNOUNCEMENT_TPL % (', '.join(conf.name for conf in confs))
+    return ""
+
+
+def cacheAnnouncement():
+    """Create Announcement & assign to the cache; used by
+    memcache cron job & putAnnouncement().
+    """
+    announcement = _buildAnnouncement()
+    # "" is cached too, so a miss means evicted rather than no announcement
+    ANNOUNCEMENT_CACHE.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
+    return announcement
+
+
+def getAnnouncement():
+    """Return the cached announcement, rebuilding it on a miss."""
+    return ANNOUNCEMENT_CACHE.get(MEMCACHE_ANNOUNCEMENTS_KEY,
+                                  _buildAnnouncement)
+
+
+def setFeaturedSpeaker(wsck, speaker_name, session_names):
+    """Format the FeaturedSpeaker text string for a conference, store it
+    and pass it to the cache."""
+    featuredSpeaker = FEATURED_SPEAKER_TPL.format(speaker_name, session_names)
+    FeaturedSpeaker(
+        key=ndb.Key(FeaturedSpeaker, FEATURED_SPEAKER_ID,
+                    parent=ndb.Key(urlsafe=wsck)),
+        speakerName=speaker_name,
+        message=featuredSpeaker
+    ).put()
+    FEATURED_SPEAKER_CACHE.set(wsck, featuredSpeaker)
+    return featuredSpeaker
+
+
+def _loadFeaturedSpeakers(wscks):
+    """Read the FeaturedSpeaker entities of wscks in one batch."""
+    keys = [ndb.Key(FeaturedSpeaker, FEATURED_SPEAKER_ID,
+                    parent=ndb.Key(urlsafe=wsck)) for wsck in wscks]
+    # "" for conferences without one, so they are cached too
+    return dict((wsck, fs.message if fs else "")
+                for wsck, fs in zip(wscks, ndb.get_multi(keys)))
+
+
+def getFeaturedSpeakers(wscks):
+    """Return a dict of featured speaker text per websafeConferenceKey,
+    reading the cache first and the datastore for any misses."""
+    return FEATURED_SPEAKER_CACHE.get_multi(wscks, _loadFeaturedSpeakers)
+
+
+def primeFeaturedSpeakers():
+    """Load the featured speakers of the next upcoming conferences into
+    the cache; used by warmup."""
+    conf_keys = Conference.query(Conference.startDate >= date.today()).order(
+        Conference.startDate).fetch(WARMUP_CONFERENCES, keys_only=True)
+    return getFeaturedSpeakers([key.urlsafe() for key in conf_keys])
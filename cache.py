@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+
+"""
+cache.py -- Udacity conference server-side Python App Engine
+    two-tier cache: bounded in-instance LRU with TTL in front of memcache
+
+Only for values that may be a little stale on an instance (announcements,
+featured speakers, facet counts); anything that has to be read live, such
+as ETag versions or seat counters, stays on memcache directly.
+
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from google.appengine.api import memcache
+
+LOCK_PREFIX = 'LOCK_'
+LOCK_SECONDS = 10
+LOCK_POLLS = 5
+LOCK_POLL_SECONDS = 0.05
+
+# every TwoTierCache by name, for stats()
+CACHES = {}
+
+
+class TwoTierCache(object):
+    """Read-through cache with an LRU per instance in front of memcache.
+
+    Values are looked up locally, then in memcache, then (on a memcache
+    miss) produced by a loader. Only one request across all instances runs
+    the loader for a key at a time; others wait briefly for its result or
+    serve a stale local copy. With stale_seconds, a locally expired value
+    is still served for that long while one thread refreshes it.
+    None is never cached; it always means a miss.
+    """
+
+    def __init__(self, name, key_prefix, local_seconds=60, max_items=1000,
+                 memcache_seconds=0, stale_seconds=0):
+        self.name = name
+        self.key_prefix = key_prefix
+        self.local_seconds = local_seconds
+        self.max_items = max_items
+        self.memcache_seconds = memcache_seconds
+        self.stale_seconds = stale_seconds
+        self._entries = OrderedDict()  # key -> (value, expires, stale_until)
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._stats = dict.fromkeys(
+            ('local_hits', 'stale_hits', 'memcache_hits', 'loads', 'misses'), 0)
+        CACHES[name] = self
+
+    # - - - local tier - - - - - - - - - - - - - - - - - - - - -
+
+    def _localGet(self, key, now):
+        """Return (value, fresh) from the LRU, or (None, False)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None, False
+            value, expires, stale_until = entry
+            if now >= stale_until:
+                del self._entries[key]
+                return None, False
+            # move to the most recently used end
+            del self._entries[key]
+            self._entries[key] = entry
+            return value, now < expires
+
+    def _localSet(self, items, now):
+        with self._lock:
+            for key, value in items.items():
+                self._entries.pop(key, None)
+                self._entries[key] = (value, now + self.local_seconds,
+                                      now + self.local_seconds + self.stale_seconds)
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+
+    def _count(self, stat, n=1):
+        with self._lock:
+            self._stats[stat] += n
+
+    # - - - public API - - - - - - - - - - - - - - - - - - - - -
+
+    def get(self, key, loader=None):
+        """Return the value for key, using loader() to produce it on a miss."""
+        multi_loader = None
+        if loader:
+            multi_loader = lambda keys: dict((k, loader()) for k in keys)
+        return self.get_multi([key], multi_loader).get(key)
+
+    def get_multi(self, keys, loader=None):
+        """Return {key: value} for keys, calling loader(missing keys) once
+        for those in neither tier; loader returns a dict."""
+        now = time.time()
+        result = {}
+        stale = {}
+        wanted = []
+        for key in keys:
+            if key in result or key in wanted:
+                continue
+            value, fresh = self._localGet(key, now)
+            if fresh:
+                result[key] = value
+                self._count('local_hits')
+                continue
+            if value is not None:
+                # stale: serve it unless this thread is the one to refresh it
+                with self._lock:
+                    refreshing = key in self._refreshing
+                    if not refreshing:
+                        self._refreshing.add(key)
+                if refreshing:
+                    result[key] = value
+                    self._count('stale_hits')
+                    continue
+                stale[key] = value
+            wanted.append(key)
+
+        try:
+            if wanted:
+                result.update(self._fetch(wanted, stale, loader, now))
+        finally:
+            if stale:
+                with self._lock:
+                    self._refreshing.difference_update(stale)
+        return result
+
+    def _fetch(self, keys, stale, loader, now):
+        """Read keys from memcache, loading whatever memcache misses."""
+        found = memcache.get_multi(keys, key_prefix=self.key_prefix)
+        self._count('memcache_hits', len(found))
+        missing = [key for key in keys if key not in found]
+        if missing and loader:
+            found.update(self._load(missing, stale, loader))
+        self._count('misses', len([key for key in keys if key not in found]))
+        fresh = dict((key, value) for key, value in found.items()
+                     if value is not None)
+        self._localSet(fresh, now)
+        for key in keys:
+            if key not in found and key in stale:
+                found[key] = stale[key]
+        return found
+
+    def _load(self, keys, stale, loader):
+        """Run loader for keys this request holds the memcache lock for;
+        wait for (or serve stale values of) keys another request is loading."""
+        mine = [key for key in keys if memcache.add(
+            LOCK_PREFIX + self.key_prefix + key, 1, time=LOCK_SECONDS)]
+        others = [key for key in keys if key not in mine]
+        found = {}
+        if mine:
+            try:
+                loaded = loader(mine)
+                self._count('loads', len(mine))
+                loaded = dict((key, value) for key, value in loaded.items()
+                              if value is not None)
+                # add, not set, so a concurrent set() by a writer wins
+                memcache.add_multi(loaded, key_prefix=self.key_prefix,
+                                   time=self.memcache_seconds)
+                found.update(loaded)
+            finally:
+                memcache.delete_multi(
+                    [LOCK_PREFIX + self.key_prefix + key for key in mine])
+        waiting = [key for key in others if key not in stale]
+        for _ in range(LOCK_POLLS if waiting else 0):
+            time.sleep(LOCK_POLL_SECONDS)
+            found.update(memcache.get_multi(waiting, key_prefix=self.key_prefix))
+            waiting = [key for key in waiting if key not in found]
+            if not waiting:
+                break
+        if waiting:
+            # the other loader is slow or died; load these ourselves
+            loaded = loader(waiting)
+            self._count('loads', len(waiting))
+            found.update(loaded)
+        return found
+
+    def set(self, key, value):
+        """Write key to both tiers (other instances see it once their local
+        copy expires)."""
+        self.set_multi({key: value})
+
+    def set_multi(self, items):
+        memcache.set_multi(items, key_prefix=self.key_prefix,
+                           time=self.memcache_seconds)
+        self._localSet(items, time.time())
+
+    def delete(self, key):
+        """Drop key from memcache and this instance's LRU."""
+        memcache.delete(self.key_prefix + key)
+        self.invalidateLocal(key)
+
+    def invalidateLocal(self, key):
+        """Drop key from this instance's LRU only."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        """Return hit counts and ratios per tier for this instance."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['local_items'] = len(self._entries)
+        lookups = (stats['local_hits'] + stats['stale_hits'] +
+                   stats['memcache_hits'] + stats['loads'] + stats['misses'])
+        for tier in ('local_hits', 'stale_hits', 'memcache_hits'):
+            stats[tier.replace('hits', 'ratio')] = (
+                float(stats[tier]) / lookups if lookups else 0.0)
+        return stats
+
+
+def stats():
+    """Return stats() of every cache on this instance, by name."""
+    return dict((name, cache.stats()) for name, cache in CACHES.items())
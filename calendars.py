@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+
+"""
+calendars.py -- Udacity conference server-side Python App Engine
+    iCalendar (.ics) feeds of a conference's sessions & a user's wishlist
+
+Calendar clients poll feeds constantly. Each feed's ETag is built from
+the same memcache version tokens as the API's ETags, so an unchanged
+feed costs no datastore reads for conferences, and for wishlists two
+gets: the WishlistFeed a token names, then its user's Profile.
+A changed feed is rendered once per version and its body cached.
+Sessions are read a page at a time, the next page fetched while the
+current one renders, and the feed is written out batch by batch.
+
+Wishlist feeds can't use the user's OAuth credentials, so their URLs
+carry a token: a random ID made for the user's Profile (the id of a
+WishlistFeed naming the user), signed with CALENDAR_FEED_SECRET. While
+the secret is still settings.py's placeholder no token is accepted.
+
+"""
+
+import hashlib
+import hmac
+import uuid
+import zlib
+from datetime import datetime
+from datetime import timedelta
+
+from google.appengine.api import app_identity
+from google.appengine.ext import ndb
+
+from cache import TwoTierCache
+from models import Profile
+from models import Session
+from models import Speaker
+from models import WishlistFeed
+from settings import CALENDAR_FEED_SECRET
+from versions import VERSION_CONFERENCE
+from versions import VERSION_PROFILE
+from versions import VERSION_SESSIONS
+from versions import VERSION_SPEAKERS
+
+MEMCACHE_CALENDAR_KEY = "CALENDAR_"  # + conference:wsck or wishlist:user ID
+CALENDAR_BATCH_SIZE = 200
+CALENDAR_PRODID = '-//Conference Central//Sessions//EN'
+WISHLIST_FEED_URL = '/calendar/wishlist/%s.ics'  # % feedToken(feed ID)
+# settings.py as shipped; anyone could sign tokens with it
+PLACEHOLDER_SECRET = 'replace with a long random string'
+TOKEN_SIGNATURE_LENGTH = 32
+ICS_LINE_OCTETS = 75
+
+# (ETag, zlib-compressed body) per feed; a body is only served for the
+# ETag it was rendered for, so a stale local copy is just a miss
+FEED_CACHE = TwoTierCache('calendar_feeds', MEMCACHE_CALENDAR_KEY,
+                          local_seconds=300, max_items=50)
+
+
+# - - - wishlist tokens - - - - - - - - - - - - - - - - - - - -
+
+def feedsEnabled():
+    """Return whether CALENDAR_FEED_SECRET has been set."""
+    return bool(CALENDAR_FEED_SECRET) and (
+        CALENDAR_FEED_SECRET != PLACEHOLDER_SECRET)
+
+
+def _sign(payload):
+    return hmac.new(CALENDAR_FEED_SECRET, payload,
+                    hashlib.sha256).hexdigest()[:TOKEN_SIGNATURE_LENGTH]
+
+
+def feedToken(feed_id):
+    """Return the token for the wishlist feed with feed_id."""
+    return '%s.%s' % (feed_id, _sign(feed_id))
+
+
+def feedIdFromToken(token):
+    """Return the feed ID a feedToken() was made for, or None if it
+    wasn't made with CALENDAR_FEED_SECRET (or that is unset)."""
+    if not feedsEnabled():
+        return None
+    try:
+        feed_id, _, signature = token.encode('ascii').partition('.')
+    except UnicodeError:
+        return None  # not one of ours; feedToken() only makes ASCII
+    expected = _sign(feed_id)
+    # constant time, so the signature can't be guessed byte by byte
+    if len(signature) != len(expected) or sum(
+            ord(a) ^ ord(b) for a, b in zip(signature, expected)):
+        return None
+    return feed_id or None
+
+
+@ndb.transactional(xg=True)
+def _feedId(user_id):
+    """Return the ID of the user's wishlist feed, making one the first
+    time."""
+    prof = ndb.Key(Profile, user_id).get()
+    if not prof.calendarFeedId:
+        prof.calendarFeedId = uuid.uuid4().hex
+        ndb.put_multi([prof, WishlistFeed(id=prof.calendarFeedId,
+                                          userId=user_id)])
+    return prof.calendarFeedId
+
+
+def wishlistFeedUrl(user_id):
+    """Return the absolute URL of the wishlist feed of user_id, who must
+    have a Profile, or None if feeds are off."""
+    if not feedsEnabled():
+        return None
+    return 'https://%s%s' % (app_identity.get_default_version_hostname(),
+                             WISHLIST_FEED_URL % feedToken(_feedId(user_id)))
+
+
+# - - - versions & cache - - - - - - - - - - - - - - - - - - - -
+
+def conferenceVersions(wsck):
+    """Return the version names a conference feed's ETag is built from."""
+    return [VERSION_CONFERENCE % wsck, VERSION_SESSIONS % wsck,
+            VERSION_SPEAKERS]
+
+
+def wishlistVersions(prof):
+    """Return the version names a wishlist feed's ETag is built from."""
+    wscks = sorted(set(ndb.Key(urlsafe=wssk).parent().urlsafe()
+                       for wssk in prof.sessionKeysWishlist))
+    names = [VERSION_PROFILE % prof.key.id(), VERSION_SPEAKERS]
+    for wsck in wscks:
+        names += [VERSION_CONFERENCE % wsck, VERSION_SESSIONS % wsck]
+    return names
+
+
+def getCachedFeed(feed, etag):
+    """Return the cached body of feed if it was rendered for etag."""
+    cached = FEED_CACHE.get(feed)
+    if cached and cached[0] == etag:
+        return zlib.decompress(cached[1])
+    return None
+
+
+def cacheFeed(feed, etag, body):
+    """Cache the body of feed rendered for etag."""
+    try:
+        FEED_CACHE.set(feed, (etag, zlib.compress(body)))
+    except ValueError:
+        pass  # too big for memcache even compressed; render every time
+
+
+# - - - rendering - - - - - - - - - - - - - - - - - - - - - - -
+
+def _escape(text):
+    """Escape a TEXT value (RFC 5545 3.3.11)."""
+    return (text.replace('\\', '\\\\').replace(';', '\\;')
+            .replace(',', '\\,').replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def _line(name, value):
+    """Return a content line folded to ICS_LINE_OCTETS octets, without
+    splitting a UTF-8 sequence."""
+    data = (u'%s:%s' % (name, value)).encode('utf-8')
+    parts = []
+    limit = ICS_LINE_OCTETS
+    while len(data) > limit:
+        cut = limit
+        while cut > 0 and (ord(data[cut]) & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(data[:cut])
+        data = data[cut:]
+        limit = ICS_LINE_OCTETS - 1  # continuation lines start with a space
+    parts.append(data)
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def _header(name):
+    return ''.join([
+        _line('BEGIN', 'VCALENDAR'),
+        _line('VERSION', '2.0'),
+        _line('PRODID', CALENDAR_PRODID),
+        _line('CALSCALE', 'GREGORIAN'),
+        _line('X-WR-CALNAME', _escape(name)),
+    ])
+
+
+def _footer():
+    return _line('END', 'VCALENDAR')
+
+
+def _event(sesh, conf, speaker, stamp, host):
+    """Return the VEVENT of a Session, or '' if it has no date.
+
+    Sessions have no time zone, so times are floating (local to
+    wherever the conference is), and one without a start time is an
+    all-day event.
+    """
+    if not sesh.date:
+        return ''
+    lines = [_line('BEGIN', 'VEVENT'),
+             _line('UID', '%s@%s' % (sesh.key.urlsafe(), host)),
+             _line('DTSTAMP', stamp)]
+    if sesh.startTime:
+        start = datetime.combine(sesh.date, sesh.startTime)
+        lines.append(_line('DTSTART', start.strftime('%Y%m%dT%H%M%S')))
+        if sesh.duration:
+            end = start + timedelta(minutes=sesh.duration)
+            lines.append(_line('DTEND', end.strftime('%Y%m%dT%H%M%S')))
+    else:
+        lines.append(_line('DTSTART;VALUE=DATE', sesh.date.strftime('%Y%m%d')))
+    lines.append(_line('SUMMARY', _escape(sesh.name)))
+    description = [sesh.highlights or '']
+    if speaker:
+        description.append('Speaker: %s' % speaker.name)
+    if conf:
+        description.append('Conference: %s' % conf.name)
+        if conf.city:
+            lines.append(_line('LOCATION', _escape(conf.city)))
+    lines.append(_line('DESCRIPTION',
+                       _escape('\n'.join(d for d in description if d))))
+    lines.append(_line('END', 'VEVENT'))
+    return ''.join(lines)
+
+
+def _events(sessions, confs):
+    """Return the VEVENTs of a batch of Sessions, fetching their
+    speakers (and any conference not in confs) in one batch."""
+    sessions = [sesh for sesh in sessions if sesh]
+    speaker_keys = list(set(ndb.Key(Speaker, sesh.speakerId)
+                            for sesh in sessions if sesh.speakerId))
+    conf_keys = list(set(sesh.key.parent() for sesh in sessions) -
+                     set(confs))
+    entities = ndb.get_multi(speaker_keys + conf_keys)
+    speakers = dict((speaker.key.id(), speaker)
+                    for speaker in entities[:len(speaker_keys)] if speaker)
+    confs.update((conf.key, conf)
+                 for conf in entities[len(speaker_keys):] if conf)
+    stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+    host = app_identity.get_application_id()
+    return ''.join(_event(sesh, confs.get(sesh.key.parent()),
+                          speakers.get(sesh.speakerId), stamp, host)
+                   for sesh in sessions)
+
+
+def renderConference(conf):
+    """Yield the feed of a Conference's sessions in chunks."""
+    yield _header(conf.name)
+    confs = {conf.key: conf}
+    query = Session.query(ancestor=conf.key)
+    page = query.fetch_page_async(CALENDAR_BATCH_SIZE)
+    while page:
+        sessions, cursor, more = page.get_result()
+        # start reading the next page before rendering this one
+        page = (query.fetch_page_async(CALENDAR_BATCH_SIZE, start_cursor=cursor)
+                if more and cursor else None)
+        yield _events(sessions, confs)
+    yield _footer()
+
+
+def renderWishlist(prof):
+    """Yield the feed of a Profile's wishlisted sessions in chunks."""
+    yield _header('%s - Wishlist' % (prof.displayName or 'Conference Central'))
+    keys = [ndb.Key(urlsafe=wssk) for wssk in prof.sessionKeysWishlist]
+    confs = {}
+    for start in range(0, len(keys), CALENDAR_BATCH_SIZE):
+        yield _events(ndb.get_multi(keys[start:start + CALENDAR_BATCH_SIZE]),
+                      confs)
+    yield _footer()
+
+
+def getConference(wsck):
+    """Return the Conference with websafe key wsck, or None."""
+    try:
+        key = ndb.Key(urlsafe=wsck)
+    except Exception:
+        return None
+    return key.get() if key.kind() == 'Conference' else None
+
+
+def getProfile(token):
+    """Return the Profile a wishlist feed token is for, or None."""
+    feed_id = feedIdFromToken(token)
+    feed = ndb.Key(WishlistFeed, feed_id).get() if feed_id else None
+    return ndb.Key(Profile, feed.userId).get() if feed else None
@@ -10,18 +10,27 @@ created by wesc on 2014 apr 21
 
 """
 
+import bisect
+import heapq
+import math
+import time
+from collections import OrderedDict
 from datetime import datetime
+from datetime import timedelta
 
 import endpoints
 from protorpc import messages
 from protorpc import message_types
 from protorpc import remote
 
+from google.appengine.api import datastore_errors
 from google.appengine.api import memcache
 from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
 
 from models import ConflictException
+from models import RateLimitedException
 from models import Profile
 from models import ProfileMiniForm
 from models import ProfileForm
@@ -29,38 +38,103 @@ from models import BooleanMessage
 from models import Conference
 from models import ConferenceForm
 from models import ConferenceForms
+from models import ConferenceDetailForm
+from models import ConferenceResultForm
+from models import ConferenceResultForms
+from models import RegistrationForm
+from models import RegistrationStatus
+from models import GroupRegistrationForm
+from models import GroupRegistrationResultForm
+from models import GroupRegistrationResultForms
+from models import WaitlistPositionForm
+from models import ConferenceFacetsForm
+from models import FacetCountForm
+from models import SeatAvailabilityForm
+from models import SeatAvailabilityForms
 from models import ConferenceQueryForm
 from models import ConferenceQueryForms
 from models import TeeShirtSize
 from models import StringMessage
+from models import SyncForm
+from models import TombstoneForm
 from models import Session
 from models import SessionForm
 from models import SessionForms
+from models import SessionResultForm
+from models import SessionResultForms
+from models import SessionRecommendations
+from models import SpeakerSession
 from models import Speaker
 from models import SpeakerForm
 from models import SpeakerForms
+from models import SpeakerRoster
+from models import SpeakerRosterEntry
+from models import FeaturedSpeakerForm
+from models import FeaturedSpeakerForms
 from models import TypeOfSession
+from models import AgendaConflictForm
+from models import AgendaBlockForm
+from models import WishlistAgendaForm
 
 from utils import getUserId
 
+from announcements import CONFIRMATION_EMAIL_QUEUE
+from announcements import getAnnouncement
+from announcements import getFeaturedSpeakers
+from calendars import wishlistFeedUrl
+
+from facets import applyFacetDelta
+from facets import conferenceFacets
+from facets import getFacets
+from facets import uncountFacets
+from deletion import deletionKey
+from deletion import startDeletion
+from waitlist import MEMCACHE_SEATS_KEY
+from waitlist import SEATS_CACHE_SECONDS
+from waitlist import joinWaitlist
+from waitlist import leaveWaitlist
+from waitlist import queuePromotion
+from waitlist import waitlistPosition
+from registration import profilesByEmail
+from registration import registerUsers
+from sync import SYNC_PAGE_SIZE
+from sync import SyncState
+
 from settings import WEB_CLIENT_ID
 from settings import ANDROID_CLIENT_ID
 from settings import IOS_CLIENT_ID
 from settings import ANDROID_AUDIENCE
-
+from settings import RATE_LIMITS
+from versions import VERSION_CONFERENCE
+from versions import VERSION_CONFERENCES
+from versions import VERSION_PROFILE
+from versions import VERSION_SESSIONS
+from versions import VERSION_SPEAKERS
+from versions import bumpVersions
+from versions import versionTag
+
+import json
 import logging
 
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
-MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
-MEMCACHE_FEATURED_SPEAKER_KEY = "FEATURED_SPEAKER"
+MEMCACHE_WISHLIST_INDEX_KEY = "WISHLIST_INDEX_"  # + user ID
+MEMCACHE_RATE_LIMIT_KEY = "RATE_LIMIT_"  # + method:user ID
+RATE_LIMIT_CAS_RETRIES = 3
+
+# how long after a write queryConferences goes without an ETag; global
+# queries usually catch up with writes within a few seconds
+QUERY_ETAG_SETTLE_SECONDS = 10
 
-ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
-                    'are nearly sold out: %s')
+SPEAKER_ROSTER_ID = "roster"  # SpeakerRoster child of each Conference
+
+# most websafe keys getConferences & getSessions accept per call
+MAX_BATCH_KEYS = 100
+SPEAKER_SESSIONS_PAGE_SIZE = 50
+RECOMMENDED_SESSIONS_LIMIT = 10
 
-FEATURED_SPEAKER_TPL = ('Join Featured Speaker {} for the following sessions: {}')
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 DEFAULTS = {
@@ -91,6 +165,19 @@ CONF_GET_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
 )
 
+# reads with ETags; ifNoneMatch is the etag of the copy the client has
+# (the If-None-Match header is honoured too, where it reaches the API)
+ETAG_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    ifNoneMatch=messages.StringField(1),
+)
+
+CONF_ETAG_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    ifNoneMatch=messages.StringField(2),
+)
+
 CONF_POST_REQUEST = endpoints.ResourceContainer(
     ConferenceForm,
     websafeConferenceKey=messages.StringField(1),
@@ -101,6 +188,12 @@ SESH_GET_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
 )
 
+SESH_ETAG_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    ifNoneMatch=messages.StringField(2),
+)
+
 SESH_GET_REQUEST_TYPE = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
@@ -110,6 +203,8 @@ SESH_GET_REQUEST_TYPE = endpoints.ResourceContainer(
 SESH_GET_REQUEST_SPEAKER = endpoints.ResourceContainer(
     message_types.VoidMessage,
     email=messages.StringField(1),
+    pageToken=messages.StringField(2),
+    limit=messages.IntegerField(3, variant=messages.Variant.INT32),
 )
 
 SESH_POST_REQUEST = endpoints.ResourceContainer(
@@ -131,6 +226,28 @@ SPEAKER_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
 )
+
+CONF_KEYS_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1, repeated=True),
+)
+
+SESH_KEYS_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeSessionKey=messages.StringField(1, repeated=True),
+)
+
+RECOMMEND_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    limit=messages.IntegerField(1, variant=messages.Variant.INT32),
+)
+
+SYNC_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    since=messages.StringField(1),
+    pageToken=messages.StringField(2),
+    limit=messages.IntegerField(3, variant=messages.Variant.INT32),
+)
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 
@@ -140,6 +257,78 @@ SPEAKER_GET_REQUEST = endpoints.ResourceContainer(
 class ConferenceApi(remote.Service):
     """Conference API v0.1"""
 
+# - - - ETags - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def _checkETag(self, request, names, salt='', settle_seconds=0):
+        """Return (the ETag for the given version names, whether the
+        client's copy has it). Endpoints turns 304s into 404s, so a match
+        is answered with a 200 carrying only etag & notModified.
+
+        The ETag is None (and never matches) while a version is younger
+        than settle_seconds; see versionTag().
+        """
+        etag = versionTag(names, salt, settle_seconds)
+        if_none_match = (request.ifNoneMatch or
+                         self.request_state.headers.get('If-None-Match'))
+        return etag, bool(etag and if_none_match and etag in
+                          [t.strip() for t in if_none_match.split(',')])
+
+    def _admit(self, method):
+        """Take a token from the current user's bucket for method, raising
+        RateLimitedException (a 503 whose message says when to retry)
+        when the bucket is empty.
+
+        Buckets are (tokens, timestamp) pairs in memcache updated with
+        compare-and-set; if memcache keeps failing the request is let
+        through rather than locking users out.
+        """
+        capacity, rate = RATE_LIMITS[method]
+        mc_key = MEMCACHE_RATE_LIMIT_KEY + '%s:%s' % (method, self._getUserId())
+        # an untouched bucket is full again after this long
+        expiry = int(math.ceil(capacity / rate))
+        client = memcache.Client()
+        for _ in range(RATE_LIMIT_CAS_RETRIES):
+            now = time.time()
+            bucket = client.gets(mc_key)
+            if bucket is None:
+                if client.add(mc_key, (capacity - 1, now), time=expiry):
+                    return
+                continue
+            tokens, stamp = bucket
+            tokens = min(capacity, tokens + (now - stamp) * rate)
+            if tokens < 1:
+                raise RateLimitedException(
+                    'Too many %s requests; retry in %d seconds.' % (
+                        method, math.ceil((1 - tokens) / rate)))
+            if client.cas(mc_key, (tokens - 1, now), time=expiry):
+                return
+        logging.warning('Rate limiter gave up on %s; admitting request', mc_key)
+
+    def _getUserId(self):
+        """Return the current user's ID, raising if not logged in."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        return getUserId(user)
+
+    def _parseKeys(self, websafe_keys, kind):
+        """Return {websafe key: Key} for the keys of kind in websafe_keys,
+        leaving out malformed ones and keys of another kind or app."""
+        if len(websafe_keys) > MAX_BATCH_KEYS:
+            raise endpoints.BadRequestException(
+                'At most %d keys per call' % MAX_BATCH_KEYS)
+        app = ndb.Key(kind, 1).app()
+        keys = {}
+        for websafe_key in set(websafe_keys):
+            try:
+                key = ndb.Key(urlsafe=websafe_key)
+            except Exception:
+                # the decoder raises several unrelated types on bad input
+                continue
+            if key.kind() == kind and key.app() == app and key.id():
+                keys[websafe_key] = key
+        return keys
+
 # - - - Conference objects - - - - - - - - - - - - - - - - -
 
     def _copyConferenceToForm(self, conf, displayName):
@@ -159,6 +348,7 @@ class ConferenceApi(remote.Service):
         cf.check_initialized()
         return cf
 
+    @ndb.tasklet
     def _createConferenceObject(self, request):
         """Create or update Conference object, returning ConferenceForm/request."""
         # preload necessary data items
@@ -174,6 +364,8 @@ class ConferenceApi(remote.Service):
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
         del data['websafeKey']
         del data['organizerDisplayName']
+        del data['etag']
+        del data['notModified']
 
         # add default values for those missing (both data model & outbound Message)
         for df in DEFAULTS:
@@ -193,25 +385,35 @@ class ConferenceApi(remote.Service):
         # set seatsAvailable to be same as maxAttendees on creation
         if data["maxAttendees"] > 0:
             data["seatsAvailable"] = data["maxAttendees"]
-        # generate Profile Key based on user ID and Conference
-        # ID based on Profile key get Conference key from ID
+        # generate Profile Key based on user ID; the Conference ID is
+        # assigned by the put itself, saving an allocate_ids round trip
         p_key = ndb.Key(Profile, user_id)
-        c_id = Conference.allocate_ids(size=1, parent=p_key)[0]
-        c_key = ndb.Key(Conference, c_id, parent=p_key)
-        data['key'] = c_key
         data['organizerUserId'] = request.organizerUserId = user_id
 
-        # create Conference, send email to organizer confirming
-        # creation of Conference & return (modified) ConferenceForm
-        Conference(**data).put()
-        taskqueue.add(params={'email': user.email(),
-                      'conferenceInfo': repr(request)},
-                      url='/tasks/send_confirmation_email'
-                      )
-        return request
-
-    @ndb.transactional()
+        # create Conference, then queue an email to the organizer confirming
+        # creation of Conference & return (modified) ConferenceForm. The
+        # enqueue waits for the put, so a failed put sends no confirmation.
+        # Confirmations go to a pull queue drained in batches by a cron job.
+        conf = Conference(parent=p_key, **data)
+        yield conf.put_async()
+        # the email and the facet counts (city, topics and month) only
+        # need the put, so are issued together; ndb can't wait on a
+        # taskqueue RPC as part of a tuple, so they are waited on in turn
+        email_rpc = taskqueue.Queue(CONFIRMATION_EMAIL_QUEUE).add_async(
+            taskqueue.Task(
+                payload=json.dumps({'email': user.email(),
+                                    'websafeConferenceKey': conf.key.urlsafe(),
+                                    'conferenceInfo': repr(request)}),
+                method='PULL'))
+        facets_fut = applyFacetDelta([], conferenceFacets(conf))
+        yield email_rpc
+        yield facets_fut
+        raise ndb.Return(request)
+
+    @ndb.transactional_tasklet()
     def _updateConferenceObject(self, request):
+        """Update Conference object, returning (ConferenceForm, old facets,
+        new facets)."""
         user = endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
@@ -220,8 +422,10 @@ class ConferenceApi(remote.Service):
         # copy ConferenceForm/ProtoRPC Message into dict
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
 
-        # update existing conference
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        # update existing conference; the organizer Profile is the
+        # Conference's parent so fetch both at once
+        c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        conf, prof = yield c_key.get_async(), c_key.parent().get_async()
         # check that conference exists
         if not conf:
             raise endpoints.NotFoundException(
@@ -231,6 +435,7 @@ class ConferenceApi(remote.Service):
         if user_id != conf.organizerUserId:
             raise endpoints.ForbiddenException(
                 'Only the owner can update the conference.')
+        old_facets = conferenceFacets(conf)
 
         # Not getting all the fields, so don't create a new object; just
         # copy relevant fields from ConferenceForm to Conference object
@@ -245,53 +450,211 @@ class ConferenceApi(remote.Service):
                         conf.month = data.month
                 # write to Conference object
                 setattr(conf, field.name, data)
-        conf.put()
-        prof = ndb.Key(Profile, user_id).get()
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        yield conf.put_async()
+        raise ndb.Return((
+            self._copyConferenceToForm(conf, getattr(prof, 'displayName')),
+            old_facets, conferenceFacets(conf)))
 
     @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
                       http_method='POST', name='createConference')
     def createConference(self, request):
         """Create new conference."""
-        return self._createConferenceObject(request)
+        cf = self._createConferenceObject(request).get_result()
+        bumpVersions(VERSION_CONFERENCES)
+        return cf
 
     @endpoints.method(CONF_POST_REQUEST, ConferenceForm,
                       path='conference/{websafeConferenceKey}',
                       http_method='PUT', name='updateConference')
     def updateConference(self, request):
         """Update conference w/provided fields & return w/updated info."""
-        return self._updateConferenceObject(request)
+        cf, old_facets, new_facets = self._updateConferenceObject(
+            request).get_result()
+        # facet counters are sharded root entities, so they are moved
+        # once the conference update has committed
+        applyFacetDelta(old_facets, new_facets).get_result()
+        # maxAttendees/seatsAvailable may have changed; any new seats go
+        # to the waitlist
+        memcache.delete(MEMCACHE_SEATS_KEY + request.websafeConferenceKey)
+        queuePromotion(request.websafeConferenceKey)
+        bumpVersions(
+            VERSION_CONFERENCES,
+            VERSION_CONFERENCE % request.websafeConferenceKey)
+        return cf
 
-    @endpoints.method(CONF_GET_REQUEST, ConferenceForm,
+    @ndb.transactional(xg=True)
+    def _deleteConferenceObject(self, wsck):
+        """Swap a Conference for its deletion marker, returning whether
+        this call did (False if it is already being deleted)."""
+        user_id = self._getUserId()
+        c_key = ndb.Key(urlsafe=wsck)
+        conf, marker = ndb.get_multi([c_key, deletionKey(c_key)])
+        if not conf:
+            if marker:
+                return False
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wsck)
+
+        # check that user is owner
+        if user_id != conf.organizerUserId:
+            raise endpoints.ForbiddenException(
+                'Only the owner can delete the conference.')
+        startDeletion(conf)
+        return True
+
+    @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
+                      path='conference/{websafeConferenceKey}/delete',
+                      http_method='POST', name='deleteConference')
+    def deleteConference(self, request):
+        """Delete a conference; its sessions & registrations are removed
+        by a chain of tasks after this returns."""
+        wsck = request.websafeConferenceKey
+        deleted = self._deleteConferenceObject(wsck)
+        # the facet IDs left on the marker are uncounted once each, so
+        # a repeated call finishes what an earlier one didn't (as does
+        # the deletion's first task)
+        uncountFacets(deletionKey(ndb.Key(urlsafe=wsck)))
+        if deleted:
+            memcache.delete(MEMCACHE_SEATS_KEY + wsck)
+            bumpVersions(VERSION_CONFERENCES, VERSION_CONFERENCE % wsck)
+        return BooleanMessage(data=True)
+
+    @endpoints.method(message_types.VoidMessage, ConferenceFacetsForm,
+                      path='conferenceFacets',
+                      http_method='GET', name='getConferenceFacets')
+    def getConferenceFacets(self, request):
+        """Return the number of conferences per city, topic and month."""
+        facets = getFacets()
+        return ConferenceFacetsForm(**dict(
+            (facet, [FacetCountForm(value=value, count=count)
+                     for value, count in sorted(counts.items())])
+            for facet, counts in facets.items()))
+
+    @endpoints.method(CONF_ETAG_GET_REQUEST, ConferenceForm,
                       path='conference/{websafeConferenceKey}',
                       http_method='GET', name='getConference')
     def getConference(self, request):
         """Return requested conference (by websafeConferenceKey)."""
-        # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        wsck = request.websafeConferenceKey
+        # the organizer's display name is part of the response
+        etag, not_modified = self._checkETag(request, [
+            VERSION_CONFERENCE % wsck,
+            VERSION_PROFILE % ndb.Key(urlsafe=wsck).parent().id()])
+        if not_modified:
+            return ConferenceForm(etag=etag, notModified=True)
+        cf = self._getConferenceAsync(wsck).get_result()
+        cf.etag = etag
+        return cf
+
+    @ndb.tasklet
+    def _getConferenceAsync(self, wsck):
+        """Fetch a Conference and its organizer Profile in parallel."""
+        # the organizer Profile is the Conference's parent, so both
+        # keys are known up front; bail if the conference is not found
+        c_key = ndb.Key(urlsafe=wsck)
+        conf, prof = yield c_key.get_async(), c_key.parent().get_async()
         if not conf:
             raise endpoints.NotFoundException(
-                'No conference found with key: %s' % request.websafeConferenceKey)
-        prof = conf.key.parent().get()
+                'No conference found with key: %s' % wsck)
         # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        raise ndb.Return(
+            self._copyConferenceToForm(conf, getattr(prof, 'displayName')))
+
+    @endpoints.method(CONF_KEYS_GET_REQUEST, ConferenceResultForms,
+                      path='conferencesByKey',
+                      http_method='GET', name='getConferences')
+    def getConferences(self, request):
+        """Return many conferences by key, in request order, with
+        found=False for keys that don't resolve."""
+        wscks = request.websafeConferenceKey
+        keys = self._parseKeys(wscks, 'Conference')
+        # the organizers are the Conferences' parents, so one batch
+        # fetches both
+        organisers = list(set(key.parent() for key in keys.values()))
+        entities = ndb.get_multi(keys.values() + organisers)
+        names = dict((prof.key.id(), prof.displayName)
+                     for prof in entities[len(keys):] if prof)
+        forms = dict((wsck, self._copyConferenceToForm(
+                          conf, names.get(conf.organizerUserId)))
+                     for wsck, conf in zip(keys.keys(), entities) if conf)
+        return ConferenceResultForms(
+            items=[ConferenceResultForm(websafeConferenceKey=wsck,
+                                        found=wsck in forms,
+                                        conference=forms.get(wsck))
+                   for wsck in wscks]
+        )
 
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    @endpoints.method(CONF_GET_REQUEST, ConferenceDetailForm,
+                      path='conference/{websafeConferenceKey}/detail',
+                      http_method='GET', name='getConferenceDetail')
+    def getConferenceDetail(self, request):
+        """Return a conference with its sessions, speakers, featured speaker
+        and the caller's registration and wishlist state."""
+        return self._getConferenceDetailAsync(
+            request.websafeConferenceKey).get_result()
+
+    @ndb.tasklet
+    def _getConferenceDetailAsync(self, wsck):
+        """Fetch everything for the conference detail page in two batches."""
+        c_key = ndb.Key(urlsafe=wsck)
+        # the Conference, its organizer, its sessions and the caller's
+        # Profile (if logged in) are independent; fetch them together
+        futures = [c_key.get_async(),
+                   c_key.parent().get_async(),
+                   Session.query(ancestor=c_key).order(Session.name).fetch_async()]
+        user = endpoints.get_current_user()
+        if user:
+            futures.append(ndb.Key(Profile, getUserId(user)).get_async())
+        # memcache is read while the datastore RPCs are in flight
+        featured = getFeaturedSpeakers([wsck])[wsck]
+        results = yield futures
+        conf, organizer, sessions = results[:3]
+        prof = results[3] if user else None
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wsck)
+
+        # second batch: every speaker of the conference's sessions
+        speaker_ids = set(sesh.speakerId for sesh in sessions if sesh.speakerId)
+        speakers = yield ndb.get_multi_async(
+            [ndb.Key(Speaker, sid) for sid in speaker_ids])
+        speakers = [speaker for speaker in speakers if speaker]
+        by_id = dict((speaker.key.id(), speaker) for speaker in speakers)
+
+        session_keys = set(sesh.key.urlsafe() for sesh in sessions)
+        raise ndb.Return(ConferenceDetailForm(
+            conference=self._copyConferenceToForm(
+                conf, getattr(organizer, 'displayName', None)),
+            sessions=[self._copySessionToForm(sesh, by_id.get(sesh.speakerId))
+                      for sesh in sessions],
+            speakers=[self._copySpeakerToForm(speaker) for speaker in speakers],
+            isRegistered=bool(prof) and wsck in prof.conferenceKeysToAttend,
+            sessionKeysWishlist=[wssk for wssk in getattr(prof, 'sessionKeysWishlist', [])
+                                 if wssk in session_keys],
+            featuredSpeaker=featured
+        ))
+
+    @endpoints.method(ETAG_GET_REQUEST, ConferenceForms,
                       path='getConferencesCreated',
                       http_method='POST', name='getConferencesCreated')
     def getConferencesCreated(self, request):
         """Return conferences created by user."""
         # make sure user is authed
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
-        # create ancestor query for all key matches for this user
-        confs = Conference.query(ancestor=ndb.Key(Profile, user_id))
-        prof = ndb.Key(Profile, user_id).get()
+        user_id = self._getUserId()
+        etag, not_modified = self._checkETag(
+            request, [VERSION_CONFERENCES, VERSION_PROFILE % user_id])
+        if not_modified:
+            return ConferenceForms(etag=etag, notModified=True)
+        # create ancestor query for all key matches for this user and
+        # run it alongside the Profile get
+        p_key = ndb.Key(Profile, user_id)
+        confs_fut = Conference.query(ancestor=p_key).fetch_async()
+        prof = p_key.get()
+        confs = confs_fut.get_result()
         # return set of ConferenceForm objects per Conference
         return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, getattr(prof, 'displayName')) for conf in confs]
+            items=[self._copyConferenceToForm(conf, getattr(prof, 'displayName')) for conf in confs],
+            etag=etag
         )
 
     def _getQuery(self, request):
@@ -346,7 +709,16 @@ class ConferenceApi(remote.Service):
                       name='queryConferences')
     def queryConferences(self, request):
         """Query for conferences."""
-        conferences = self._getQuery(request)
+        # the filters are part of what identifies the response; the query
+        # is global, so eventually consistent: no ETag until a write has
+        # had time to show up in it, lest a stale list get a lasting one
+        etag, not_modified = self._checkETag(
+            request, [VERSION_CONFERENCES],
+            salt=repr(sorted(self._formatFilters(request.filters)[1])),
+            settle_seconds=QUERY_ETAG_SETTLE_SECONDS)
+        if not_modified:
+            return ConferenceForms(etag=etag, notModified=True)
+        conferences = self._getQuery(request).fetch()
 
         # need to fetch organiser displayName from profiles
         # get all keys and use get_multi for speed
@@ -360,7 +732,8 @@ class ConferenceApi(remote.Service):
 
         # return individual ConferenceForm object per Conference
         return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, names[conf.organizerUserId]) for conf in conferences]
+            items=[self._copyConferenceToForm(conf, names[conf.organizerUserId]) for conf in conferences],
+            etag=etag
         )
 
 
@@ -382,6 +755,11 @@ class ConferenceApi(remote.Service):
 
     def _getProfileFromUser(self):
         """Return user Profile from datastore, creating new one if non-existent."""
+        return self._getProfileFromUserAsync().get_result()
+
+    @ndb.tasklet
+    def _getProfileFromUserAsync(self):
+        """Tasklet version of _getProfileFromUser()."""
         # make sure user is authed
         user = endpoints.get_current_user()
         if not user:
@@ -390,7 +768,7 @@ class ConferenceApi(remote.Service):
         # get Profile from datastore
         user_id = getUserId(user)
         p_key = ndb.Key(Profile, user_id)
-        profile = p_key.get()
+        profile = yield p_key.get_async()
         # create new Profile if not there
         if not profile:
             profile = Profile(
@@ -399,9 +777,9 @@ class ConferenceApi(remote.Service):
                 mainEmail=user.email(),
                 teeShirtSize=str(TeeShirtSize.NOT_SPECIFIED),
             )
-            profile.put()
+            yield profile.put_async()
 
-        return profile      # return Profile
+        raise ndb.Return(profile)      # return Profile
 
     def _doProfile(self, save_request=None):
         """Get user Profile and return to user, possibly updating it first."""
@@ -420,15 +798,24 @@ class ConferenceApi(remote.Service):
                         # else:
                         #    setattr(prof, field, val)
             prof.put()
+            # display names also appear on conference listings
+            bumpVersions(VERSION_PROFILE % prof.key.id(),
+                         VERSION_CONFERENCES)
 
         # return ProfileForm
         return self._copyProfileToForm(prof)
 
-    @endpoints.method(message_types.VoidMessage, ProfileForm,
+    @endpoints.method(ETAG_GET_REQUEST, ProfileForm,
                       path='profile', http_method='GET', name='getProfile')
     def getProfile(self, request):
         """Return user profile."""
-        return self._doProfile()
+        etag, not_modified = self._checkETag(
+            request, [VERSION_PROFILE % self._getUserId()])
+        if not_modified:
+            return ProfileForm(etag=etag, notModified=True)
+        pf = self._doProfile()
+        pf.etag = etag
+        return pf
 
     @endpoints.method(ProfileMiniForm, ProfileForm,
                       path='profile', http_method='POST', name='saveProfile')
@@ -441,7 +828,8 @@ class ConferenceApi(remote.Service):
 
     @ndb.transactional(xg=True)
     def _conferenceRegistration(self, request, reg=True):
-        """Register or unregister user for selected conference."""
+        """Register or unregister user for selected conference; returns
+        None when registering for a full conference."""
         retval = None
         prof = self._getProfileFromUser()  # get user Profile
 
@@ -460,10 +848,11 @@ class ConferenceApi(remote.Service):
                 raise ConflictException(
                     "You have already registered for this conference")
 
-            # check if seats avail
-            if conf.seatsAvailable <= 0:
-                raise ConflictException(
-                    "There are no seats available.")
+            # check if seats avail; if not the caller waitlists the user.
+            # seats freed while others wait are theirs, so a conference
+            # with a waitlist is full
+            if conf.seatsAvailable <= 0 or conf.waitlisted:
+                return None
 
             # register user, take away one seat
             prof.conferenceKeysToAttend.append(wsck)
@@ -483,89 +872,178 @@ class ConferenceApi(remote.Service):
                 retval = False
 
         # write things back to the datastore & return
-        prof.put()
-        conf.put()
+        ndb.put_multi([prof, conf])
         return BooleanMessage(data=retval)
 
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    @endpoints.method(ETAG_GET_REQUEST, ConferenceForms,
                       path='conferences/attending',
                       http_method='GET', name='getConferencesToAttend')
     def getConferencesToAttend(self, request):
         """Get list of conferences that user has registered for."""
-        prof = self._getProfileFromUser()  # get user Profile
+        etag, not_modified = self._checkETag(
+            request, [VERSION_CONFERENCES, VERSION_PROFILE % self._getUserId()])
+        if not_modified:
+            return ConferenceForms(etag=etag, notModified=True)
+        cfs = self._getConferencesToAttendAsync().get_result()
+        cfs.etag = etag
+        return cfs
+
+    @ndb.tasklet
+    def _getConferencesToAttendAsync(self):
+        """Fetch the user's conferences and their organizers in one batch."""
+        prof = yield self._getProfileFromUserAsync()  # get user Profile
         conf_keys = [ndb.Key(urlsafe=wsck) for wsck in prof.conferenceKeysToAttend]
-        conferences = ndb.get_multi(conf_keys)
 
-        # get organizers
-        organisers = [ndb.Key(Profile, conf.organizerUserId) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
+        # organizer Profile keys are the Conference keys' parents, so the
+        # conferences and their organizers can be fetched together
+        organisers = list(set(key.parent() for key in conf_keys))
+        entities = yield ndb.get_multi_async(conf_keys + organisers)
+        conferences = entities[:len(conf_keys)]
 
         # put display names in a dict for easier fetching
         names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        for profile in entities[len(conf_keys):]:
+            if profile:
+                names[profile.key.id()] = profile.displayName
 
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, names[conf.organizerUserId]) for conf in conferences]
-        )
+        raise ndb.Return(ConferenceForms(
+            items=[self._copyConferenceToForm(conf, names.get(conf.organizerUserId))
+                   for conf in conferences if conf]
+        ))
 
-    @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
+    @endpoints.method(CONF_GET_REQUEST, RegistrationForm,
                       path='conference/{websafeConferenceKey}',
                       http_method='POST', name='registerForConference')
     def registerForConference(self, request):
-        """Register user for selected conference."""
-        return self._conferenceRegistration(request)
+        """Register user for selected conference, or put them on its
+        waitlist if it is full."""
+        self._admit('registerForConference')
+        wsck = request.websafeConferenceKey
+        retval = self._conferenceRegistration(request)
+        if retval is None:
+            # the waitlist is its own entity group, so joining it doesn't
+            # contend with registrations on the conference
+            user_id = self._getUserId()
+            joinWaitlist(wsck, user_id)
+            # in case a seat was freed before the user joined
+            queuePromotion(wsck)
+            return RegistrationForm(data=False,
+                                    waitlistPosition=waitlistPosition(wsck, user_id))
+        memcache.decr(MEMCACHE_SEATS_KEY + wsck)
+        self._bumpRegistrationVersions(wsck)
+        return RegistrationForm(data=retval.data)
 
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
                       path='conference/{websafeConferenceKey}',
                       http_method='DELETE', name='unregisterFromConference')
     def unregisterFromConference(self, request):
-        """Unregister user for selected conference."""
-        return self._conferenceRegistration(request, reg=False)
+        """Unregister user for selected conference, or take them off its
+        waitlist."""
+        self._admit('unregisterFromConference')
+        wsck = request.websafeConferenceKey
+        retval = self._conferenceRegistration(request, reg=False)
+        if retval.data:
+            memcache.incr(MEMCACHE_SEATS_KEY + wsck)
+            # hand the freed seat to the waitlist in the background
+            queuePromotion(wsck)
+            self._bumpRegistrationVersions(wsck)
+        else:
+            retval.data = leaveWaitlist(wsck, self._getUserId())
+        return retval
+
+    @endpoints.method(GroupRegistrationForm, GroupRegistrationResultForms,
+                      path='registerGroup',
+                      http_method='POST', name='registerGroup')
+    def registerGroup(self, request):
+        """Register the users with the given emails for every given
+        conference the caller organizes, all or none of them per
+        conference; a full conference doesn't waitlist them."""
+        self._admit('registerGroup')
+        user_id = self._getUserId()
+        emails = list(OrderedDict.fromkeys(request.email))
+        wscks = list(OrderedDict.fromkeys(request.websafeConferenceKey))
+        if len(emails) > MAX_BATCH_KEYS:
+            raise endpoints.BadRequestException(
+                'At most %d emails per call' % MAX_BATCH_KEYS)
+        keys = self._parseKeys(wscks, 'Conference')
+        # conferences are children of their organizer's Profile, so this
+        # needs no datastore read; it also keeps them to one entity group
+        owned = set(wsck for wsck, key in keys.items()
+                    if key.parent() == ndb.Key(Profile, user_id))
+        user_ids = profilesByEmail(emails)
+        statuses = registerUsers([wsck for wsck in wscks if wsck in owned],
+                                 list(set(user_ids.values())))
+
+        def status(email, wsck):
+            if wsck not in keys:
+                return RegistrationStatus.NO_CONFERENCE
+            if wsck not in owned:
+                return RegistrationStatus.FORBIDDEN
+            if email not in user_ids:
+                return RegistrationStatus.NO_PROFILE
+            return statuses[user_ids[email], wsck]
+        return GroupRegistrationResultForms(
+            items=[GroupRegistrationResultForm(email=email,
+                                               websafeConferenceKey=wsck,
+                                               status=status(email, wsck))
+                   for email in emails for wsck in wscks]
+        )
 
+    @endpoints.method(CONF_GET_REQUEST, WaitlistPositionForm,
+                      path='conference/{websafeConferenceKey}/waitlist',
+                      http_method='GET', name='getWaitlistPosition')
+    def getWaitlistPosition(self, request):
+        """Return the user's place on a conference's waitlist."""
+        wsck = request.websafeConferenceKey
+        return WaitlistPositionForm(
+            websafeConferenceKey=wsck,
+            position=waitlistPosition(wsck, self._getUserId()))
+
+    @endpoints.method(CONF_KEYS_GET_REQUEST, SeatAvailabilityForms,
+                      path='seatAvailability',
+                      http_method='GET', name='getSeatAvailability')
+    def getSeatAvailability(self, request):
+        """Return live seatsAvailable for many conferences in one call."""
+        wscks = request.websafeConferenceKey
+        # keys that don't resolve to a conference get no seatsAvailable
+        keys = self._parseKeys(wscks, 'Conference')
+        seats = memcache.get_multi(keys.keys(), key_prefix=MEMCACHE_SEATS_KEY)
+        missing = [wsck for wsck in keys if wsck not in seats]
+        if missing:
+            confs = ndb.get_multi([keys[wsck] for wsck in missing])
+            found = dict((wsck, conf.seatsAvailable)
+                         for wsck, conf in zip(missing, confs) if conf)
+            # add, not set, so counters a register/unregister just
+            # created are not overwritten
+            memcache.add_multi(found, key_prefix=MEMCACHE_SEATS_KEY,
+                               time=SEATS_CACHE_SECONDS)
+            seats.update(found)
+        return SeatAvailabilityForms(
+            items=[SeatAvailabilityForm(websafeConferenceKey=wsck,
+                                        seatsAvailable=seats.get(wsck))
+                   for wsck in wscks]
+        )
 
-# - - - Announcements - - - - - - - - - - - - - - - - - - - -
+    def _bumpRegistrationVersions(self, wsck):
+        """Invalidate ETags affected by a (un)registration."""
+        bumpVersions(VERSION_CONFERENCES,
+                     VERSION_CONFERENCE % wsck,
+                     VERSION_PROFILE % self._getUserId())
 
-    @staticmethod
-    def _cacheAnnouncement():
-        """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
-        """
-        confs = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5,
-            Conference.seatsAvailable > 0)
-        ).fetch(projection=[Conference.name])
-
-        if confs:
-            # If there are almost sold out conferences,
-            # format announcement and set it in memcache
-            announcement = ANNOUNCEMENT_TPL % (
-                ', '.join(conf.name for conf in confs))
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
-        else:
-            # If there are no sold out conferences,
-            # delete the memcache announcements entry
-            announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
 
-        return announcement
+# - - - Announcements - - - - - - - - - - - - - - - - - - - -
 
     @endpoints.method(message_types.VoidMessage, StringMessage,
                       path='conference/announcement/get',
                       http_method='GET', name='getAnnouncement')
     def getAnnouncement(self, request):
-        """Return Announcement from memcache."""
-        # TODO 1
-        # return an existing announcement from Memcache or an empty string.
-        announcement = memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY)
-        if not announcement:
-            announcement = ""
-        return StringMessage(data=announcement)
+        """Return Announcement from the cache."""
+        return StringMessage(data=getAnnouncement())
 
 # - - - Sessions - - - - - - - - - - - - - - - - - - - -
 
-    def _copySessionToForm(self, sesh):
+    def _copySessionToForm(self, sesh, speaker=None):
         """Copy relevant fields from Session to SessionForm."""
         sf = SessionForm()
         for field in sf.all_fields():
@@ -577,30 +1055,54 @@ class ConferenceApi(remote.Service):
                     setattr(sf, field.name, getattr(sesh, field.name))
             elif field.name == "websafeKey":
                 setattr(sf, field.name, sesh.key.urlsafe())
-        # query speaker by the speaker_id and add values to form
-        if sesh.speakerId:
+        # query speaker by the speaker_id (unless the caller already has
+        # it) and add values to form
+        if sesh.speakerId and not speaker:
             speaker = Speaker.get_by_id(sesh.speakerId)
+        if speaker:
             sf.speaker_name = speaker.name
             sf.speaker_email = speaker.email
             sf.speaker_gender = speaker.gender
         sf.check_initialized()
         return sf
 
+    def _copySessionsToForms(self, sessions):
+        """Copy Sessions to a SessionForms, fetching speakers in one batch."""
+        sessions = [sesh for sesh in sessions if sesh]
+        speaker_ids = set(sesh.speakerId for sesh in sessions if sesh.speakerId)
+        speakers = ndb.get_multi([ndb.Key(Speaker, sid) for sid in speaker_ids])
+        by_id = dict((speaker.key.id(), speaker) for speaker in speakers if speaker)
+        return SessionForms(
+            items=[self._copySessionToForm(sesh, by_id.get(sesh.speakerId))
+                   for sesh in sessions]
+        )
+
+    @ndb.tasklet
     def _createSessionObject(self, request):
         """Create Session object, returning SessionForm/request."""
         user = endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
         user_id = getUserId(user)
-        # check to see that the current user is the conference organizer
-        conf_key = ndb.Key(urlsafe=request.websafeConferenceKey)
-        if conf_key.parent().get().mainEmail != user_id:
-            raise endpoints.UnauthorizedException(
-                'Only the organizer of the conference can create sessions')
 
         if not request.name:
             raise endpoints.BadRequestException("Session 'name' field required")
 
+        # the organizer check and the speaker lookup are independent,
+        # so start both RPCs before waiting on either
+        conf_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        organizer_fut = conf_key.parent().get_async()
+        speaker_fut = None
+        if request.speaker_email:
+            speaker_fut = Speaker.query(
+                Speaker.email == request.speaker_email).get_async()
+
+        # check to see that the current user is the conference organizer
+        organizer = yield organizer_fut
+        if organizer.mainEmail != user_id:
+            raise endpoints.UnauthorizedException(
+                'Only the organizer of the conference can create sessions')
+
         # copy SessionForm/ProtoRPC Message into dictionary
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
         # delete the unneeded values
@@ -609,6 +1111,8 @@ class ConferenceApi(remote.Service):
         del data['speaker_name']
         del data['speaker_email']
         del data['speaker_gender']
+        del data['conferenceName']
+        del data['conferenceKey']
 
         # Format date and startTime, ie. 2015-08-18 and 16:00
         if data['date']:
@@ -617,68 +1121,107 @@ class ConferenceApi(remote.Service):
             data['startTime'] = datetime.strptime(data['startTime'][:10], "%H:%M").time()
 
         # if speaker email was submitted, get or create a speaker
-        if request.speaker_email:
+        speaker = None
+        puts = []
+        if speaker_fut:
             # check to see if this speaker exists
-            speaker = Speaker.query(Speaker.email == request.speaker_email).get()
+            speaker = yield speaker_fut
             # if so, use this speaker's values
             if speaker:
-                # Update speaker from request
+                # Update speaker from request; written alongside the session
                 speaker.name = request.speaker_name
                 speaker.gender = request.speaker_gender
-                speaker.put()
-                speaker_key = speaker.key
+                puts.append(speaker)
             else:
-                # create the speaker
-                speaker_data = {
-                    'name': request.speaker_name,
-                    'email': request.speaker_email,
-                    'gender': request.speaker_gender
-                }
-                speaker_key = Speaker(**speaker_data).put()
-            data['speakerId'] = speaker_key.id()
-
-        sesh_id = Session.allocate_ids(size=1, parent=conf_key)[0]
-        sesh_key = ndb.Key(Session, sesh_id, parent=conf_key)
-        data['key'] = sesh_key
-
-        Session(**data).put()
+                # create the speaker; the session needs its id
+                speaker = Speaker(
+                    name=request.speaker_name,
+                    email=request.speaker_email,
+                    gender=request.speaker_gender
+                )
+                yield speaker.put_async()
+            data['speakerId'] = speaker.key.id()
+
+        # the Session ID is allocated up front so its SpeakerSession row
+        # can be written in the same transaction as it and the roster
+        # (alongside the speaker update)
+        first, _ = yield Session.allocate_ids_async(1, parent=conf_key)
+        sesh = Session(id=first, parent=conf_key, **data)
+        _, speaker_sessions = yield (
+            ndb.put_multi_async(puts),
+            self._putSessionAndRoster(sesh, request.speaker_email))
 
         # check to see if we should create a featured speaker
-        if speaker:
-            # get all sessions for this conference with this speaker
-            sessions = Session.query(Session.speakerId == data['speakerId'], ancestor=conf_key)
+        if speaker_sessions > 1:
+            # this speaker is speaking in more than one session for this
+            # conference, so pass his name and session names to the task queue
+            sessions = yield Session.query(
+                Session.speakerId == data['speakerId'],
+                ancestor=conf_key).fetch_async()
             # create a comma-delimited string of session names
             session_names = ', '.join(session.name for session in sessions)
-            # if this speaker is speaking in more than one session for this
-            # conference then pass his name and session names to the task queue
-            if sessions.count() > 1:
-                taskqueue.add(
-                    params={'speaker_name': speaker.name,
-                            'session_names': session_names},
-                    url='/tasks/set_featured_speaker'
-                )
-        return self._copySessionToForm(sesh_key.get())
+            yield taskqueue.Queue().add_async(taskqueue.Task(
+                params={'websafeConferenceKey': conf_key.urlsafe(),
+                        'speaker_name': speaker.name,
+                        'session_names': session_names},
+                url='/tasks/set_featured_speaker'
+            ))
+        raise ndb.Return(self._copySessionToForm(sesh, speaker))
 
     @endpoints.method(SESH_POST_REQUEST, SessionForm,
                       path='session/{websafeConferenceKey}',
                       http_method='POST', name='createSession')
     def createSession(self, request):
         """Create a Session with a conference as its parent"""
-        return self._createSessionObject(request)
+        self._admit('createSession')
+        sf = self._createSessionObject(request).get_result()
+        # an existing speaker's details may have been updated as well
+        bumpVersions(VERSION_SESSIONS % request.websafeConferenceKey,
+                     *([VERSION_SPEAKERS] if request.speaker_email else []))
+        return sf
 
-    @endpoints.method(SESH_GET_REQUEST, SessionForms,
+    @endpoints.method(SESH_ETAG_GET_REQUEST, SessionForms,
                       path='sessions/{websafeConferenceKey}',
                       http_method='GET', name='getConferenceSessions')
     def getConferenceSessions(self, request):
         """Given a conference, return all sessions"""
         # websafeConferenceKey
-        conf_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        wsck = request.websafeConferenceKey
+        etag, not_modified = self._checkETag(
+            request, [VERSION_SESSIONS % wsck, VERSION_SPEAKERS])
+        if not_modified:
+            return SessionForms(etag=etag, notModified=True)
+        conf_key = ndb.Key(urlsafe=wsck)
         # create ancestor query for all key matches for this conference
         sessions = Session.query(ancestor=conf_key).order(Session.name)
 
         # return set of SessionForm objects per Conference
-        return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
+        sfs = self._copySessionsToForms(sessions)
+        sfs.etag = etag
+        return sfs
+
+    @endpoints.method(SESH_KEYS_GET_REQUEST, SessionResultForms,
+                      path='sessionsByKey',
+                      http_method='GET', name='getSessions')
+    def getSessions(self, request):
+        """Return many sessions by key, in request order, with
+        found=False for keys that don't resolve."""
+        wssks = request.websafeSessionKey
+        keys = self._parseKeys(wssks, 'Session')
+        sessions = dict((wssk, sesh) for wssk, sesh in
+                        zip(keys.keys(), ndb.get_multi(keys.values())) if sesh)
+        # then every speaker of those sessions in one more batch
+        speaker_ids = set(sesh.speakerId for sesh in sessions.values()
+                          if sesh.speakerId)
+        speakers = ndb.get_multi([ndb.Key(Speaker, sid) for sid in speaker_ids])
+        by_id = dict((speaker.key.id(), speaker) for speaker in speakers if speaker)
+        forms = dict((wssk, self._copySessionToForm(sesh, by_id.get(sesh.speakerId)))
+                     for wssk, sesh in sessions.items())
+        return SessionResultForms(
+            items=[SessionResultForm(websafeSessionKey=wssk,
+                                     found=wssk in forms,
+                                     session=forms.get(wssk))
+                   for wssk in wssks]
         )
 
     @endpoints.method(SESH_GET_REQUEST_TYPE, SessionForms,
@@ -695,27 +1238,61 @@ class ConferenceApi(remote.Service):
         ).order(Session.name)
 
         # return set of SessionForm objects per Conference
-        return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
-        )
+        return self._copySessionsToForms(sessions)
 
     @endpoints.method(SESH_GET_REQUEST_SPEAKER, SessionForms,
                       path='sessions/speaker/{email}',
                       http_method='GET', name='getSesionsBySpeaker')
     def getSessionsBySpeaker(self, request):
-        """Given a speaker's email, return all sessions given by this particular speaker, across all conferences"""
-        # get speaker by email
-        speaker = Speaker.query(Speaker.email == request.email).get()
-        if speaker:
-            # get sessions by speakerID
-            sessions = Session.query(Session.speakerId == speaker.key.id())
-        else:
-            raise endpoints.NotFoundException(
-                'No speaker found with email address: %s' % request.email)
-
-        # return set of SessionForm objects per speaker
+        """Given a speaker's email, return the sessions given by this
+        particular speaker across all conferences, by date and start time,
+        a page at a time"""
+        # a negative limit would make fetch_page fail; clamp to 1..100
+        limit = max(1, min(request.limit or SPEAKER_SESSIONS_PAGE_SIZE,
+                           MAX_BATCH_KEYS))
+        # the rows createSession keeps under the email are one entity
+        # group, so this is a strongly consistent ancestor query; a
+        # garbled pageToken is only rejected once the query runs
+        try:
+            rows, next_cursor, more = SpeakerSession.query(
+                ancestor=SpeakerSession.parentKey(request.email)
+            ).order(SpeakerSession.date, SpeakerSession.startTime).fetch_page(
+                limit, start_cursor=Cursor(urlsafe=request.pageToken or None))
+        except datastore_errors.BadValueError:
+            raise endpoints.BadRequestException(
+                'Invalid pageToken: %s' % request.pageToken)
+        if not rows and not request.pageToken:
+            # tell an unknown speaker apart from one without sessions
+            if not Speaker.query(Speaker.email == request.email).get(keys_only=True):
+                raise endpoints.NotFoundException(
+                    'No speaker found with email address: %s' % request.email)
+
+        # the sessions, their conferences and the speaker in one batch
+        session_keys = [row.session for row in rows]
+        conf_keys = list(set(key.parent() for key in session_keys))
+        speaker_keys = list(set(ndb.Key(Speaker, row.speakerId) for row in rows))
+        entities = ndb.get_multi(session_keys + conf_keys + speaker_keys)
+        sessions = entities[:len(session_keys)]
+        confs = dict((conf.key, conf) for conf in
+                     entities[len(session_keys):len(session_keys) + len(conf_keys)]
+                     if conf)
+        speakers = dict((speaker.key.id(), speaker) for speaker in
+                        entities[len(session_keys) + len(conf_keys):] if speaker)
+
+        # return a page of SessionForm objects for the speaker
+        items = []
+        for sesh in sessions:
+            if not sesh:
+                continue
+            sf = self._copySessionToForm(sesh, speakers.get(sesh.speakerId))
+            conf = confs.get(sesh.key.parent())
+            if conf:
+                sf.conferenceName = conf.name
+                sf.conferenceKey = conf.key.urlsafe()
+            items.append(sf)
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
+            items=items,
+            nextPageToken=next_cursor.urlsafe() if more and next_cursor else None
         )
 
     @endpoints.method(SESH_GET_REQUEST, SessionForms,
@@ -730,7 +1307,7 @@ class ConferenceApi(remote.Service):
             # we only want sessions that are not WORKSHOPs from this conference
             Session.typeOfSession != TypeOfSession.WORKSHOP,
             ancestor=conf_key
-        )
+        ).fetch()
         sessions_to_exclude = []
         # loop over the list of non-WORKSHOP sessions from this conference
         for session in sessions:
@@ -738,9 +1315,8 @@ class ConferenceApi(remote.Service):
             if session.startTime > datetime.strptime('19:00', "%H:%M").time():
                 sessions_to_exclude.append(session.key.id())
         # return set of SessionForm objects that are not in our excude list
-        return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions if session.key.id() not in sessions_to_exclude]
-        )
+        return self._copySessionsToForms(
+            session for session in sessions if session.key.id() not in sessions_to_exclude)
 
 # - - - Wishlist - - - - - - - - - - - - - - - - - - - -
     def _sessionWishlist(self, request, add=True):
@@ -780,13 +1356,90 @@ class ConferenceApi(remote.Service):
 
         # Write profile back to the datastore & return
         prof.put()
+        if retval:
+            self._updateWishlistIndex(prof, sesh, wssk, add)
+            bumpVersions(VERSION_PROFILE % prof.key.id())
         return BooleanMessage(data=retval)
 
+    @staticmethod
+    def _sessionInterval(sesh, wssk):
+        """Return the (start, end, websafeKey) interval of a Session, or
+        None if it has no date or startTime."""
+        if not (sesh.date and sesh.startTime):
+            return None
+        start = datetime.combine(sesh.date, sesh.startTime)
+        return (start, start + timedelta(minutes=sesh.duration or 0), wssk)
+
+    def _getWishlistIndex(self, prof):
+        """Return the user's wishlist intervals sorted by start time, from
+        memcache unless the cached index is missing or out of step."""
+        mc_key = MEMCACHE_WISHLIST_INDEX_KEY + prof.key.id()
+        index = memcache.get(mc_key)
+        if index is None or set(index['keys']) != set(prof.sessionKeysWishlist):
+            wsskeys = list(prof.sessionKeysWishlist)
+            sessions = ndb.get_multi([ndb.Key(urlsafe=wssk) for wssk in wsskeys])
+            intervals = [self._sessionInterval(sesh, wssk)
+                         for sesh, wssk in zip(sessions, wsskeys) if sesh]
+            index = {
+                'keys': wsskeys,
+                'intervals': sorted(i for i in intervals if i),
+            }
+            memcache.set(mc_key, index)
+        return index['intervals']
+
+    def _updateWishlistIndex(self, prof, sesh, wssk, add):
+        """Apply one wishlist add/remove to the cached index, if cached."""
+        mc_key = MEMCACHE_WISHLIST_INDEX_KEY + prof.key.id()
+        index = memcache.get(mc_key)
+        if index is None:
+            return
+        interval = self._sessionInterval(sesh, wssk)
+        intervals = index['intervals']
+        if add:
+            index['keys'].append(wssk)
+            if interval:
+                bisect.insort(intervals, interval)
+        else:
+            if wssk in index['keys']:
+                index['keys'].remove(wssk)
+            if interval:
+                i = bisect.bisect_left(intervals, interval)
+                if i < len(intervals) and intervals[i] == interval:
+                    del intervals[i]
+        memcache.set(mc_key, index)
+
+    @staticmethod
+    def _buildAgenda(intervals):
+        """Sweep sorted intervals, returning (conflicts, timeline).
+
+        conflicts holds (earlier key, later key, overlap start, overlap end)
+        for every overlapping pair; timeline holds [start, end, keys] blocks
+        of merged back-to-back or overlapping sessions. Sessions without a
+        duration take up no time, so conflict with nothing.
+        """
+        conflicts = []
+        timeline = []
+        active = []  # heap of (end, websafeKey) for sessions still running
+        for start, end, wssk in intervals:
+            while active and active[0][0] <= start:
+                heapq.heappop(active)
+            if end > start:
+                for other_end, other in active:
+                    conflicts.append((other, wssk, start, min(end, other_end)))
+                heapq.heappush(active, (end, wssk))
+            if timeline and start <= timeline[-1][1]:
+                timeline[-1][1] = max(timeline[-1][1], end)
+                timeline[-1][2].append(wssk)
+            else:
+                timeline.append([start, end, [wssk]])
+        return conflicts, timeline
+
     @endpoints.method(WISHLIST_REQUEST, BooleanMessage,
                       path='wishlist/{websafeSessionKey}',
                       http_method='POST', name='addSessionToWishlist')
     def addSessionToWishlist(self, request):
         """Given a session key, add it to a user's wishlist"""
+        self._admit('addSessionToWishlist')
         return self._sessionWishlist(request, add=True)
 
     @endpoints.method(WISHLIST_REQUEST, BooleanMessage,
@@ -794,6 +1447,7 @@ class ConferenceApi(remote.Service):
                       http_method='DELETE', name='removeSessionFromWishlist')
     def removeSessionFromWishlist(self, request):
         """Given a session key, remove it from a user's wishlist"""
+        self._admit('removeSessionFromWishlist')
         return self._sessionWishlist(request, add=False)
 
     @endpoints.method(message_types.VoidMessage, SessionForms,
@@ -808,8 +1462,38 @@ class ConferenceApi(remote.Service):
         sesh_keys = [ndb.Key(urlsafe=wssk) for wssk in prof.sessionKeysWishlist]
         sessions = ndb.get_multi(sesh_keys)
 
-        return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
+        return self._copySessionsToForms(sessions)
+
+    @endpoints.method(message_types.VoidMessage, StringMessage,
+                      path='wishlistCalendar',
+                      http_method='GET', name='getWishlistCalendarUrl')
+    def getWishlistCalendarUrl(self, request):
+        """Return the URL of the iCalendar feed of the user's wishlist,
+        for subscribing to it from a calendar app"""
+        # the feed ID is kept on the Profile
+        prof = self._getProfileFromUser()
+        url = wishlistFeedUrl(prof.key.id())
+        if not url:
+            raise endpoints.InternalServerErrorException(
+                'Wishlist calendar feeds are not configured.')
+        return StringMessage(data=url)
+
+    @endpoints.method(message_types.VoidMessage, WishlistAgendaForm,
+                      path='wishlistAgenda',
+                      http_method='GET', name='getWishlistAgenda')
+    def getWishlistAgenda(self, request):
+        """Return overlapping sessions and a merged timeline of the user's wishlist."""
+        prof = self._getProfileFromUser()  # get user Profile
+        conflicts, timeline = self._buildAgenda(self._getWishlistIndex(prof))
+        return WishlistAgendaForm(
+            conflicts=[AgendaConflictForm(websafeSessionKey=first,
+                                          conflictingSessionKey=second,
+                                          overlapStart=str(start),
+                                          overlapEnd=str(end))
+                       for first, second, start, end in conflicts],
+            timeline=[AgendaBlockForm(start=str(start), end=str(end),
+                                      websafeSessionKeys=wsskeys)
+                      for start, end, wsskeys in timeline]
         )
 
     @endpoints.method(WISHLIST_REQUEST_CONF, SessionForms,
@@ -824,32 +1508,45 @@ class ConferenceApi(remote.Service):
         # get the websafe conference key
         wsck = request.websafeConferenceKey
         conf_key = ndb.Key(urlsafe=wsck)
-        sessions = []
+        sesh_keys = []
         # loop over the websafe session keys from the user's profile
         for wssk in prof.sessionKeysWishlist:
             # get the session key
             sesh_key = ndb.Key(urlsafe=wssk)
-            # get the parent conference key from the session key
-            this_conf_key = sesh_key.parent()
-            sesh = sesh_key.get()
             # if the session's parent matches the requested conference
-            if conf_key.id() == this_conf_key.id():
-                # add the session to our list of sessions
-                sessions.append(sesh)
+            if conf_key.id() == sesh_key.parent().id():
+                # add the session key to our list; fetched in one batch below
+                sesh_keys.append(sesh_key)
+        sessions = ndb.get_multi(sesh_keys)
 
         # return set of SessionForm objects per conference
-        return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
-        )
+        return self._copySessionsToForms(sessions)
+
+    @endpoints.method(RECOMMEND_GET_REQUEST, SessionForms,
+                      path='recommendedSessions',
+                      http_method='GET', name='getRecommendedSessions')
+    def getRecommendedSessions(self, request):
+        """Return the sessions most often wishlisted together with the
+        user's wishlist & registered conferences, best first"""
+        prof = self._getProfileFromUser()  # get user Profile
+        limit = min(request.limit or RECOMMENDED_SESSIONS_LIMIT, MAX_BATCH_KEYS)
+        # one batch get of the neighbours the cron job stored per item
+        # (see recommendations.py); scores of a session add up across items
+        recs = ndb.get_multi([ndb.Key(SessionRecommendations, item) for item in
+                              prof.sessionKeysWishlist + prof.conferenceKeysToAttend])
+        scores = {}
+        for rec in recs:
+            if rec:
+                for wssk, score in zip(rec.sessions, rec.scores):
+                    scores[wssk] = scores.get(wssk, 0.0) + score
+        for wssk in prof.sessionKeysWishlist:
+            scores.pop(wssk, None)
+        best = heapq.nlargest(limit, scores, key=scores.get)
+        # deleted sessions come back as None and are skipped
+        sessions = ndb.get_multi([ndb.Key(urlsafe=wssk) for wssk in best])
+        return self._copySessionsToForms(sessions)
 
 # - - - Speaker - - - - - - - - - - - - - - - - - - - -
-    @staticmethod
-    def _setFeaturedSpeaker(speaker_name, session_names):
-        """Format the FeaturedSpeaker text string and pass to memcache."""
-        featuredSpeaker = FEATURED_SPEAKER_TPL.format(speaker_name, session_names)
-        memcache.set(MEMCACHE_FEATURED_SPEAKER_KEY, featuredSpeaker)
-        return featuredSpeaker
-
     def _createSpeakerObject(self, request):
         """Create a Speaker object, returning SpeakerForm/request."""
         user = endpoints.get_current_user()
@@ -864,6 +1561,8 @@ class ConferenceApi(remote.Service):
 
         # copy SessionForm/ProtoRPC Message into dict
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
+        del data['sessionCount']
+        del data['websafeKey']
 
         Speaker(**data).put()
         return request
@@ -874,9 +1573,69 @@ class ConferenceApi(remote.Service):
         for field in sf.all_fields():
             if hasattr(speaker, field.name):
                 setattr(sf, field.name, getattr(speaker, field.name))
+            elif field.name == "websafeKey":
+                setattr(sf, field.name, speaker.key.urlsafe())
         sf.check_initialized()
         return sf
 
+    @ndb.tasklet
+    def _getRosterAsync(self, conf_key):
+        """Return (SpeakerRoster, built) for a Conference, building the
+        roster from its sessions if it predates rosters. Call inside a
+        transaction so no session is created while it is being built."""
+        roster_key = ndb.Key(SpeakerRoster, SPEAKER_ROSTER_ID, parent=conf_key)
+        roster = yield roster_key.get_async()
+        if roster:
+            raise ndb.Return((roster, False))
+        counts = {}
+        order = []
+        sessions = yield Session.query(ancestor=conf_key).fetch_async()
+        for sesh in sessions:
+            if sesh.speakerId:
+                if sesh.speakerId not in counts:
+                    order.append(sesh.speakerId)
+                counts[sesh.speakerId] = counts.get(sesh.speakerId, 0) + 1
+        raise ndb.Return((SpeakerRoster(key=roster_key, speakers=[
+            SpeakerRosterEntry(speakerId=sid, sessions=counts[sid])
+            for sid in order]), True))
+
+    @ndb.transactional_tasklet(xg=True)
+    def _putSessionAndRoster(self, sesh, speaker_email=None):
+        """Put a new Session, count it on its conference's roster and list
+        it under its speaker's email, returning the speaker's number of
+        sessions in the conference (0 if none)."""
+        # the conference may have been deleted since the organizer check
+        conf = yield sesh.key.parent().get_async()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % sesh.key.parent().urlsafe())
+        roster, built = yield self._getRosterAsync(sesh.key.parent())
+        count = 0
+        if sesh.speakerId:
+            for entry in roster.speakers:
+                if entry.speakerId == sesh.speakerId:
+                    break
+            else:
+                entry = SpeakerRosterEntry(speakerId=sesh.speakerId)
+                roster.speakers.append(entry)
+            entry.sessions += 1
+            count = entry.sessions
+        puts = [sesh]
+        if count or built:
+            puts.append(roster)
+        if count and speaker_email:
+            puts.append(SpeakerSession.forSession(sesh, speaker_email))
+        yield ndb.put_multi_async(puts)
+        raise ndb.Return(count)
+
+    @ndb.transactional_tasklet
+    def _buildRosterAsync(self, conf_key):
+        """Return a Conference's SpeakerRoster, saving it if just built."""
+        roster, built = yield self._getRosterAsync(conf_key)
+        if built:
+            yield roster.put_async()
+        raise ndb.Return(roster)
+
     @endpoints.method(SpeakerForm, SpeakerForm,
                       path='createSpeaker',
                       http_method='POST', name='createSpeaker')
@@ -899,26 +1658,26 @@ class ConferenceApi(remote.Service):
                       path='speaker/{websafeConferenceKey}',
                       http_method='GET', name='getSpeakersByConf')
     def getSpeakersByConf(self, request):
-        """Given a conference, return all speakers of the conference's sessions."""
+        """Given a conference, return all speakers of the conference's
+        sessions with their number of sessions there."""
         # websafeConferenceKey
         conf_key = ndb.Key(urlsafe=request.websafeConferenceKey)
-        # create a session ancestor query for all conference key matches for the requested conference
-        sessions = Session.query(ancestor=conf_key).fetch()
-        speakerIds = []
-        # loop over the list of sessions from this conference
-        for session in sessions:
-            # if this speaker is not in our list, add him to it
-            if session.speakerId not in speakerIds:
-                speakerIds.append(session.speakerId)
-        # get a list of keys from our speakerIds list
-        keys = [ndb.Key(Speaker, this_id) for this_id in speakerIds]
-        # use our keys to get our speakers
-        speakers = ndb.get_multi(keys)
-
-        # return set of SessionForm objects per Conference
-        return SpeakerForms(
-            items=[self._copySpeakerToForm(speaker) for speaker in speakers]
-        )
+        # the roster kept by createSession lists the speakers, so the
+        # sessions themselves are never read
+        roster = ndb.Key(SpeakerRoster, SPEAKER_ROSTER_ID, parent=conf_key).get()
+        if not roster:
+            roster = self._buildRosterAsync(conf_key).get_result()
+        speakers = ndb.get_multi(
+            [ndb.Key(Speaker, entry.speakerId) for entry in roster.speakers])
+
+        # return set of SpeakerForm objects per Conference
+        items = []
+        for entry, speaker in zip(roster.speakers, speakers):
+            if speaker:
+                sf = self._copySpeakerToForm(speaker)
+                sf.sessionCount = entry.sessions
+                items.append(sf)
+        return SpeakerForms(items=items)
 
     @endpoints.method(SpeakerForm, SpeakerForms,
                       path='speaker',
@@ -942,15 +1701,88 @@ class ConferenceApi(remote.Service):
             items=[self._copySpeakerToForm(speaker) for speaker in speakers]
         )
 
-    @endpoints.method(message_types.VoidMessage, StringMessage,
-                      path='speaker/featured/get',
+    @endpoints.method(CONF_GET_REQUEST, StringMessage,
+                      path='speaker/featured/{websafeConferenceKey}',
                       http_method='GET', name='getFeaturedSpeaker')
     def getFeaturedSpeaker(self, request):
-        """Return Featured Speaker from memcache."""
-        featuredSpeaker = memcache.get(MEMCACHE_FEATURED_SPEAKER_KEY)
-        if not featuredSpeaker:
-            featuredSpeaker = ""
-        return StringMessage(data=featuredSpeaker)
+        """Return Featured Speaker of a conference."""
+        wsck = request.websafeConferenceKey
+        if not self._parseKeys([wsck], 'Conference'):
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wsck)
+        return StringMessage(data=getFeaturedSpeakers([wsck])[wsck])
+
+    @endpoints.method(CONF_KEYS_GET_REQUEST, FeaturedSpeakerForms,
+                      path='featuredSpeakers',
+                      http_method='GET', name='getFeaturedSpeakers')
+    def getFeaturedSpeakers(self, request):
+        """Return Featured Speakers for many conferences in one call."""
+        wscks = request.websafeConferenceKey
+        # keys that don't resolve to a conference get no data
+        keys = self._parseKeys(wscks, 'Conference')
+        featured = getFeaturedSpeakers(keys.keys())
+        return FeaturedSpeakerForms(
+            items=[FeaturedSpeakerForm(websafeConferenceKey=wsck,
+                                       data=featured.get(wsck))
+                   for wsck in wscks]
+        )
+
+# - - - Sync - - - - - - - - - - - - - - - - - - - -
+
+    @endpoints.method(SYNC_GET_REQUEST, SyncForm,
+                      path='sync',
+                      http_method='GET', name='sync')
+    def sync(self, request):
+        """Return the conferences, sessions & speakers changed (and the
+        conferences & sessions deleted) since the watermark given as since,
+        a page at a time; keep the watermark of the last page for the next
+        sync. Without since, everything is returned."""
+        try:
+            if request.pageToken:
+                state = SyncState.fromPageToken(request.pageToken)
+            else:
+                state = SyncState.start(request.since)
+        except ValueError:
+            raise endpoints.BadRequestException(
+                'Invalid since or pageToken: %s' %
+                (request.pageToken or request.since))
+        if not state:
+            # deletions that old may have been purged
+            return SyncForm(fullResync=True)
+
+        # below 1 a page would read nothing and hand back its own token
+        limit = max(1, min(request.limit or SYNC_PAGE_SIZE, SYNC_PAGE_SIZE))
+        try:
+            changed, next_state = state.nextPage(limit)
+        except datastore_errors.BadValueError:
+            # the token's cursor decoded, but the datastore rejected it
+            raise endpoints.BadRequestException(
+                'Invalid pageToken: %s' % request.pageToken)
+
+        # the organizers are the Conferences' parents, so one batch
+        # fetches their names
+        confs = changed['Conference']
+        organisers = list(set(conf.key.parent() for conf in confs))
+        names = dict((prof.key.id(), prof.displayName)
+                     for prof in ndb.get_multi(organisers) if prof)
+        sessions = self._copySessionsToForms(changed['Session']).items
+        for sesh, sf in zip(changed['Session'], sessions):
+            sf.conferenceKey = sesh.key.parent().urlsafe()
+
+        form = SyncForm(
+            conferences=[self._copyConferenceToForm(
+                conf, names.get(conf.organizerUserId)) for conf in confs],
+            sessions=sessions,
+            speakers=[self._copySpeakerToForm(speaker)
+                      for speaker in changed['Speaker']],
+            deleted=[TombstoneForm(kind=tomb.kind, websafeKey=tomb.key.id())
+                     for tomb in changed['Tombstone']],
+        )
+        if next_state:
+            form.nextPageToken = next_state.pageToken()
+        else:
+            form.watermark = state.watermark
+        return form
 
 # - - - Test - - - - - - - - - - - - - - - - - - - -
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+
+"""
+deletion.py -- Udacity conference server-side Python App Engine
+    background cascade deletion of conferences
+
+deleteConference swaps the Conference for a ConferenceDeletion marker in
+one transaction, then a chain of tasks removes what hangs off it in
+bounded batches:
+
+    facets         the conference's facet counts, if deleteConference
+                   didn't get to uncount them all
+    sessions       Sessions (leaving Tombstones for sync), their
+                   SpeakerSession rows & wishlist entries
+    registrations  the conference in attendees' conferenceKeysToAttend
+    waitlist       the conference's Waitlist & its entries
+    descendants    anything else under the conference key
+
+Each step checkpoints its phase & cursor on the marker, so a step that is
+retried or re-queued by resumeDeletions() carries on from there, and a
+step whose checkpoint no longer matches the marker is a duplicate and is
+dropped. The marker is deleted last. Facet IDs are dropped from the
+marker in the transaction that uncounts them, so each is uncounted once
+however often deleteConference or the facets step is retried.
+
+"""
+
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from announcements import FEATURED_SPEAKER_CACHE
+from facets import conferenceFacetIds
+from facets import uncountFacets
+from models import ConferenceDeletion
+from models import Profile
+from models import Session
+from models import Speaker
+from models import SpeakerSession
+from sync import tombstones
+from versions import VERSION_PROFILE
+from versions import VERSION_SESSIONS
+from versions import bumpVersions
+from waitlist import waitlistKey
+
+DELETION_ID = "deletion"
+DELETE_BATCH_SIZE = 100
+DELETE_URL = '/tasks/delete_conference'
+PHASES = ('facets', 'sessions', 'registrations', 'waitlist', 'descendants')
+
+
+def deletionKey(conf_key):
+    """Return the key of a Conference's ConferenceDeletion marker."""
+    return ndb.Key(ConferenceDeletion, DELETION_ID, parent=conf_key)
+
+
+def _queueStep(wsck, phase, cursor=None, transactional=False):
+    params = {'websafeConferenceKey': wsck, 'phase': phase}
+    if cursor:
+        params['cursor'] = cursor
+    taskqueue.add(params=params, url=DELETE_URL, transactional=transactional)
+
+
+def startDeletion(conf):
+    """Replace conf with its deletion marker and queue the first step;
+    call inside an xg transaction on the conference's entity group."""
+    ndb.put_multi([ConferenceDeletion(key=deletionKey(conf.key), phase=PHASES[0],
+                                      facets=conferenceFacetIds(conf))] +
+                  tombstones([conf.key]))
+    conf.key.delete()
+    _queueStep(conf.key.urlsafe(), PHASES[0], transactional=True)
+
+
+def resumeDeletions():
+    """Re-queue every unfinished deletion from its checkpoint."""
+    markers = ConferenceDeletion.query().fetch()
+    for marker in markers:
+        _queueStep(marker.key.parent().urlsafe(), marker.phase, marker.cursor)
+    return len(markers)
+
+
+@ndb.transactional_tasklet
+def _scrubProfile(prof_key, wsck, wsskeys):
+    """Drop wsck & wsskeys from a Profile, returning whether it changed."""
+    prof = yield prof_key.get_async()
+    if not prof:
+        raise ndb.Return(False)
+    attending = [key for key in prof.conferenceKeysToAttend if key != wsck]
+    wishlist = [key for key in prof.sessionKeysWishlist if key not in wsskeys]
+    if (len(attending) == len(prof.conferenceKeysToAttend) and
+            len(wishlist) == len(prof.sessionKeysWishlist)):
+        raise ndb.Return(False)
+    prof.conferenceKeysToAttend = attending
+    prof.sessionKeysWishlist = wishlist
+    yield prof.put_async()
+    raise ndb.Return(True)
+
+
+def _scrubProfiles(prof_keys, wsck, wsskeys=()):
+    """Scrub Profiles in parallel and invalidate the changed ones' ETags."""
+    prof_keys = list(prof_keys)
+    futures = [_scrubProfile(key, wsck, set(wsskeys)) for key in prof_keys]
+    changed = [VERSION_PROFILE % key.id()
+               for key, future in zip(prof_keys, futures) if future.get_result()]
+    if changed:
+        bumpVersions(*changed)
+
+
+def _deleteFacets(conf_key, wsck, cursor):
+    """Uncount whatever facets are still listed on the marker."""
+    uncountFacets(deletionKey(conf_key))
+    return None, False
+
+
+def _deleteSessions(conf_key, wsck, cursor):
+    """Delete a batch of Sessions with their SpeakerSession rows, after
+    taking them off every wishlist."""
+    sessions, next_cursor, more = Session.query(ancestor=conf_key).fetch_page(
+        DELETE_BATCH_SIZE, start_cursor=cursor)
+    wsskeys = [sesh.key.urlsafe() for sesh in sessions]
+    wishlisted = [Profile.query(Profile.sessionKeysWishlist == wssk).fetch_async(
+                      keys_only=True) for wssk in wsskeys]
+    speaker_ids = set(sesh.speakerId for sesh in sessions if sesh.speakerId)
+    speakers = ndb.get_multi([ndb.Key(Speaker, sid) for sid in speaker_ids])
+    emails = dict((speaker.key.id(), speaker.email)
+                  for speaker in speakers if speaker and speaker.email)
+    _scrubProfiles(set(key for future in wishlisted
+                       for key in future.get_result()), None, wsskeys)
+    # sessions last, so a retried step finds them again
+    ndb.put_multi(tombstones([sesh.key for sesh in sessions]))
+    ndb.delete_multi(
+        [ndb.Key(SpeakerSession, sesh.key.urlsafe(),
+                 parent=SpeakerSession.parentKey(emails[sesh.speakerId]))
+         for sesh in sessions if sesh.speakerId in emails] +
+        [sesh.key for sesh in sessions])
+    return next_cursor, more
+
+
+def _deleteRegistrations(conf_key, wsck, cursor):
+    """Take the conference off a batch of attendees' Profiles."""
+    prof_keys, next_cursor, more = Profile.query(
+        Profile.conferenceKeysToAttend == wsck).fetch_page(
+        DELETE_BATCH_SIZE, start_cursor=cursor, keys_only=True)
+    _scrubProfiles(prof_keys, wsck)
+    return next_cursor, more
+
+
+def _deleteWaitlist(conf_key, wsck, cursor):
+    """Delete a batch of the conference's waitlist entries (and the
+    Waitlist itself, which is part of the same ancestor query)."""
+    keys, next_cursor, more = ndb.Query(ancestor=waitlistKey(wsck)).fetch_page(
+        DELETE_BATCH_SIZE, start_cursor=cursor, keys_only=True)
+    ndb.delete_multi(keys)
+    return next_cursor, more
+
+
+def _deleteDescendants(conf_key, wsck, cursor):
+    """Delete a batch of whatever else is under the conference key."""
+    keys, next_cursor, more = ndb.Query(ancestor=conf_key).fetch_page(
+        DELETE_BATCH_SIZE, start_cursor=cursor, keys_only=True)
+    marker_key = deletionKey(conf_key)
+    ndb.delete_multi([key for key in keys if key != marker_key])
+    return next_cursor, more
+
+
+STEPS = {
+    'facets': _deleteFacets,
+    'sessions': _deleteSessions,
+    'registrations': _deleteRegistrations,
+    'waitlist': _deleteWaitlist,
+    'descendants': _deleteDescendants,
+}
+
+
+def runStep(wsck, phase, cursor=None):
+    """Run one batch of a conference deletion, then checkpoint it and
+    queue the next step (or delete the marker when done)."""
+    conf_key = ndb.Key(urlsafe=wsck)
+    marker = deletionKey(conf_key).get()
+    if not marker or (marker.phase, marker.cursor) != (phase, cursor or None):
+        return  # finished, or a duplicate of a step that already ran
+
+    next_cursor, more = STEPS[phase](conf_key, wsck, Cursor(urlsafe=cursor or None))
+    if more and next_cursor:
+        cursor = next_cursor.urlsafe()
+    elif PHASES.index(phase) + 1 < len(PHASES):
+        phase = PHASES[PHASES.index(phase) + 1]
+        cursor = None
+    else:
+        marker.key.delete()
+        FEATURED_SPEAKER_CACHE.delete(wsck)
+        bumpVersions(VERSION_SESSIONS % wsck)
+        return
+    _checkpoint(marker.key, wsck, phase, cursor)
+
+
+@ndb.transactional
+def _checkpoint(marker_key, wsck, phase, cursor):
+    """Save the checkpoint and queue its step together, so the chain
+    can't stop between the two. The marker is re-read, as the facets
+    step has changed it since runStep read it."""
+    marker = marker_key.get()
+    marker.phase = phase
+    marker.cursor = cursor
+    marker.put()
+    _queueStep(wsck, phase, cursor, transactional=True)
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+"""
+facets.py -- Udacity conference server-side Python App Engine
+    sharded facet counts (city, topic, month) for conference browsing
+
+"""
+
+import random
+from collections import Counter
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from cache import TwoTierCache
+from models import FacetCounterShard
+
+MEMCACHE_FACETS_KEY = "CONFERENCE_FACETS"
+FACETS = ('city', 'topic', 'month')
+NUM_SHARDS = 20
+CAS_RETRIES = 5
+# bounds how long a rebuild racing a write can serve a stale count
+FACETS_CACHE_SECONDS = 600
+FACETS_CACHE = TwoTierCache('facets', '', local_seconds=30,
+                            memcache_seconds=FACETS_CACHE_SECONDS,
+                            stale_seconds=30)
+
+
+def conferenceFacets(conf):
+    """Return the (facet, value) pairs a Conference is counted under."""
+    values = []
+    if conf.city:
+        values.append(('city', conf.city))
+    values.extend(('topic', topic) for topic in set(conf.topics or []))
+    if conf.month:
+        values.append(('month', str(conf.month)))
+    return values
+
+
+def conferenceFacetIds(conf):
+    """Return conferenceFacets(conf) as 'facet:value' strings, to be kept
+    on an entity and later passed to uncountFacets."""
+    return [u'%s:%s' % pair for pair in conferenceFacets(conf)]
+
+
+@ndb.transactional_tasklet
+def _incrementShard(facet, value, amount):
+    """Add amount to a random shard of one facet value's counter."""
+    key = ndb.Key(FacetCounterShard, u'%s:%s:%d' % (
+        facet, value, random.randint(0, NUM_SHARDS - 1)))
+    shard = yield key.get_async()
+    if not shard:
+        shard = FacetCounterShard(key=key, facet=facet, value=value)
+    shard.count += amount
+    yield shard.put_async()
+
+
+@ndb.tasklet
+def applyFacetDelta(old, new):
+    """Move the counts from the old (facet, value) pairs to the new ones."""
+    delta = Counter(new)
+    delta.subtract(Counter(old))
+    delta = dict((fv, n) for fv, n in delta.items() if n)
+    if not delta:
+        return
+    yield [_incrementShard(facet, value, n)
+           for (facet, value), n in delta.items()]
+    _updateCache(delta)
+
+
+@ndb.transactional_tasklet(xg=True)
+def _uncountFacet(holder_key, facet_id):
+    """Take one off facet_id's count and off holder's facets list in the
+    same transaction, returning whether it was still listed."""
+    holder = yield holder_key.get_async()
+    if not holder or facet_id not in holder.facets:
+        raise ndb.Return(False)
+    holder.facets.remove(facet_id)
+    facet, value = facet_id.split(':', 1)
+    yield _incrementShard(facet, value, -1), holder.put_async()
+    raise ndb.Return(True)
+
+
+def uncountFacets(holder_key):
+    """Uncount the facet IDs listed on the entity at holder_key, dropping
+    each from the list as it goes, so a retry never uncounts one twice."""
+    holder = holder_key.get()
+    delta = {}
+    # one at a time, as each transaction writes the holder
+    for facet_id in list(holder.facets if holder else []):
+        if _uncountFacet(holder_key, facet_id).get_result():
+            delta[tuple(facet_id.split(':', 1))] = -1
+    if delta:
+        _updateCache(delta)
+
+
+def _updateCache(delta):
+    """Apply delta to the cached facets in place, or drop them if the
+    compare-and-set keeps losing to other writers. Other instances pick
+    the change up when their local copy expires."""
+    FACETS_CACHE.invalidateLocal(MEMCACHE_FACETS_KEY)
+    client = memcache.Client()
+    for _ in range(CAS_RETRIES):
+        facets = client.gets(MEMCACHE_FACETS_KEY)
+        if facets is None:
+            return  # rebuilt from the shards on the next read
+        for (facet, value), n in delta.items():
+            count = facets[facet].get(value, 0) + n
+            if count > 0:
+                facets[facet][value] = count
+            else:
+                facets[facet].pop(value, None)
+        if client.cas(MEMCACHE_FACETS_KEY, facets, FACETS_CACHE_SECONDS):
+            return
+    memcache.delete(MEMCACHE_FACETS_KEY)
+
+
+def _sumShards():
+    """Return {facet: {value: count}} summed over all the shards."""
+    facets = dict((facet, {}) for facet in FACETS)
+    for shard in FacetCounterShard.query():
+        counts = facets[shard.facet]
+        counts[shard.value] = counts.get(shard.value, 0) + shard.count
+    for counts in facets.values():
+        for value in [v for v, n in counts.items() if n <= 0]:
+            del counts[value]
+    return facets
+
+
+def getFacets():
+    """Return {facet: {value: count}}, summing the shards on a cache miss."""
+    return FACETS_CACHE.get(MEMCACHE_FACETS_KEY, _sumShards)
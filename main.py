@@ -10,44 +10,327 @@ created by wesc on 2014 may 24
 
 """
 
+import json
+import logging
+import threading
+from collections import OrderedDict
+
 import webapp2
 from google.appengine.api import app_identity
 from google.appengine.api import mail
-from conference import ConferenceApi
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from announcements import CONFIRMATION_EMAIL_QUEUE
+from announcements import cacheAnnouncement
+from announcements import getAnnouncement
+from announcements import primeFeaturedSpeakers
+from announcements import setFeaturedSpeaker
+import cache
+import calendars
+import migrations
+import sync
+from deletion import PHASES
+from deletion import resumeDeletions
+from deletion import runStep
+from versions import versionTag
+from waitlist import promote
 
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
+EMAIL_LEASE_SECONDS = 60
+EMAIL_BATCH_SIZE = 100
+EMAIL_MAX_BATCHES = 20
+EMAIL_CONCURRENCY = 10
+EMAIL_MAX_RETRIES = 5
+EMAIL_METRICS_PREFIX = 'CONFIRMATION_EMAIL_'
+
+CONFIRMATION_EMAIL_SUBJECT = 'You created a new Conference!'
+CONFIRMATION_EMAIL_TPL = ('Hi, you have created the following '
+                          'conference:\r\n\r\n%s')
+
+
+def _sendConfirmationEmail(sender, email, conferenceInfo):
+    """Send one conference confirmation email."""
+    mail.send_mail(
+        sender,                                     # from
+        email,                                      # to
+        CONFIRMATION_EMAIL_SUBJECT,                 # subj
+        CONFIRMATION_EMAIL_TPL % conferenceInfo     # body
+    )
+
+
+def _sendConfirmationBatch(queue, tasks):
+    """Send the emails for a batch of leased confirmation tasks.
+
+    Tasks for the same conference are sent once; tasks whose email went
+    out (or that ran out of retries) are deleted, the rest are left to
+    their lease expiring so they are retried. Returns a dict of delivery
+    counts.
+    """
+    metrics = {'sent': 0, 'failed': 0, 'deduped': 0, 'dropped': 0}
+    done = []
+
+    # group tasks by conference so each confirmation is only sent once
+    jobs = OrderedDict()  # dedupe key -> ((email, conferenceInfo), tasks)
+    for task in tasks:
+        if task.retry_count >= EMAIL_MAX_RETRIES:
+            logging.error('Dropping confirmation email after %d retries: %s',
+                          task.retry_count, task.payload)
+            metrics['dropped'] += 1
+            done.append(task)
+            continue
+        try:
+            params = json.loads(task.payload)
+            message = (params['email'], params['conferenceInfo'])
+        except (ValueError, KeyError, TypeError):
+            logging.error('Dropping malformed confirmation email: %s',
+                          task.payload)
+            metrics['dropped'] += 1
+            done.append(task)
+            continue
+        # tasks queued before payloads carried the conference's key can
+        # only be matched on their whole payload
+        key = params.get('websafeConferenceKey') or task.payload
+        jobs.setdefault(key, (message, []))[1].append(task)
+    metrics['deduped'] = sum(len(group) - 1 for _, group in jobs.values())
+
+    # the sender is the same for every message
+    sender = 'noreply@%s.appspotmail.com' % app_identity.get_application_id()
+    messages = jobs.values()
+
+    # send with at most EMAIL_CONCURRENCY messages in flight
+    results = [None] * len(messages)
+
+    def send(i):
+        try:
+            _sendConfirmationEmail(sender, *messages[i][0])
+            results[i] = True
+        except Exception:
+            logging.exception('Failed to send confirmation email')
+            results[i] = False
+
+    for start in range(0, len(messages), EMAIL_CONCURRENCY):
+        threads = [threading.Thread(target=send, args=(i,))
+                   for i in range(start, min(start + EMAIL_CONCURRENCY,
+                                             len(messages)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    for (_, group), ok in zip(messages, results):
+        if ok:
+            metrics['sent'] += 1
+            done.extend(group)
+        else:
+            metrics['failed'] += 1
+
+    if done:
+        queue.delete_tasks(done)
+    memcache.offset_multi(metrics, key_prefix=EMAIL_METRICS_PREFIX,
+                          initial_value=0)
+    return metrics
+
 
 class SetAnnouncementHandler(webapp2.RequestHandler):
     def get(self):
         """Set Announcement in Memcache."""
-        ConferenceApi._cacheAnnouncement()
+        cacheAnnouncement()
+
+
+class WarmupHandler(webapp2.RequestHandler):
+    def get(self):
+        """Preload the API module and prime the hot cache entries."""
+        # importing conference builds the Endpoints API server, which the
+        # instance would otherwise do on its first /_ah/spi request
+        import conference  # noqa
+        getAnnouncement()
+        primeFeaturedSpeakers()
+
+
+class CacheStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Return the two-tier cache hit ratios of the serving instance."""
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(cache.stats(), sort_keys=True))
 
 
 class SendConfirmationEmailHandler(webapp2.RequestHandler):
     def post(self):
-        """Send email confirming Conference creation."""
-        mail.send_mail(
+        """Send email confirming Conference creation.
+
+        Kept for push tasks queued before confirmations moved to the
+        pull queue drained by SendConfirmationEmailsHandler.
+        """
+        _sendConfirmationEmail(
             'noreply@%s.appspotmail.com' % (
-                app_identity.get_application_id()),     # from
-            self.request.get('email'),                  # to
-            'You created a new Conference!',            # subj
-            'Hi, you have created the following '       # body
-            'conference:\r\n\r\n%s' % self.request.get(
-                'conferenceInfo')
+                app_identity.get_application_id()),
+            self.request.get('email'),
+            self.request.get('conferenceInfo')
         )
 
 
+class SendConfirmationEmailsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Lease queued confirmation emails and send them in batches."""
+        queue = taskqueue.Queue(CONFIRMATION_EMAIL_QUEUE)
+        for _ in range(EMAIL_MAX_BATCHES):
+            tasks = queue.lease_tasks(EMAIL_LEASE_SECONDS, EMAIL_BATCH_SIZE)
+            if not tasks:
+                break
+            metrics = _sendConfirmationBatch(queue, tasks)
+            logging.info('Confirmation email batch: %s', metrics)
+            if len(tasks) < EMAIL_BATCH_SIZE:
+                break
+
+
 class SetFeaturedSpeakerHandler(webapp2.RequestHandler):
     def post(self):
-        """Set Featured Speaker in Memcache."""
-        ConferenceApi._setFeaturedSpeaker(
+        """Set a conference's Featured Speaker."""
+        setFeaturedSpeaker(
+            self.request.get('websafeConferenceKey'),
             self.request.get('speaker_name'),
             self.request.get('session_names')
         )
 
+
+class MigrateHandler(webapp2.RequestHandler):
+    def post(self):
+        """Run one batch of a migration, then chain a task for the next."""
+        name = self.request.get('name')
+        if name not in migrations.MIGRATIONS:
+            self.abort(400)
+        migrations.runBatch(name, int(self.request.get('generation')),
+                            self.request.get('cursor') or None)
+
+
+class MigrationsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Return the progress of every migration as JSON."""
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(migrations.progress(), sort_keys=True))
+
+    def post(self):
+        """Start, pause or resume the migration given by name."""
+        name = self.request.get('name')
+        action = self.request.get('action', 'start')
+        if name not in migrations.MIGRATIONS or action not in (
+                'start', 'pause', 'resume'):
+            self.abort(400)
+        if action == 'start':
+            migrations.start(
+                name,
+                int(self.request.get('batch_size') or
+                    migrations.DEFAULT_BATCH_SIZE),
+                float(self.request.get('write_rate') or
+                      migrations.DEFAULT_WRITE_RATE))
+        else:
+            getattr(migrations, action)(name)
+        self.get()
+
+
+class DeleteConferenceHandler(webapp2.RequestHandler):
+    def get(self):
+        """Re-queue every unfinished conference deletion from its
+        checkpoint, e.g. after its task chain was purged."""
+        logging.info('Resumed %d conference deletions', resumeDeletions())
+
+    def post(self):
+        """Run one step of a conference deletion."""
+        phase = self.request.get('phase')
+        if phase not in PHASES:
+            self.abort(400)
+        runStep(self.request.get('websafeConferenceKey'), phase,
+                self.request.get('cursor') or None)
+
+
+class PromoteWaitlistHandler(webapp2.RequestHandler):
+    def post(self):
+        """Give a conference's free seats to its waitlisted users."""
+        wsck = self.request.get('websafeConferenceKey')
+        promoted = promote(wsck)
+        if promoted:
+            logging.info('Promoted %d waitlisted users to %s', promoted, wsck)
+
+
+class CalendarFeedHandler(webapp2.RequestHandler):
+    def serveFeed(self, feed, version_names, render):
+        """Answer If-None-Match with 304, else write the feed body: the
+        cached one for the current versions, or render() streamed out
+        batch by batch and cached."""
+        etag = versionTag(version_names)
+        self.response.headers['ETag'] = etag
+        # clients may keep a copy but must revalidate it
+        self.response.headers['Cache-Control'] = 'private, no-cache'
+        if_none_match = self.request.headers.get('If-None-Match')
+        if if_none_match and etag in [t.strip() for t in if_none_match.split(',')]:
+            self.response.status_int = 304
+            return
+        self.response.headers['Content-Type'] = 'text/calendar; charset=utf-8'
+        body = calendars.getCachedFeed(feed, etag)
+        if body is None:
+            chunks = []
+            for chunk in render():
+                self.response.write(chunk)
+                chunks.append(chunk)
+            calendars.cacheFeed(feed, etag, ''.join(chunks))
+        else:
+            self.response.write(body)
+
+
+class ConferenceCalendarHandler(CalendarFeedHandler):
+    def get(self, wsck):
+        """Serve the iCalendar feed of a conference's sessions."""
+        # the versions are in memcache, so a 304 never reads the datastore
+        def render():
+            conf = calendars.getConference(wsck)
+            if not conf:
+                self.abort(404)
+            return calendars.renderConference(conf)
+        self.serveFeed('conference:' + wsck, calendars.conferenceVersions(wsck),
+                       render)
+
+
+class WishlistCalendarHandler(CalendarFeedHandler):
+    def get(self, token):
+        """Serve the iCalendar feed of the wishlist a signed token is for."""
+        prof = calendars.getProfile(token)
+        if not prof:
+            self.abort(404)
+        self.serveFeed('wishlist:' + prof.key.id(),
+                       calendars.wishlistVersions(prof),
+                       lambda: calendars.renderWishlist(prof))
+
+
+class RebuildRecommendationsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Fold profiles changed since the last run into the session
+        recommendations (?full=1 rebuilds from every profile)."""
+        # NumPy takes a while to import, so only this cron pays for it,
+        # not every instance serving main.py
+        import recommendations
+        summary = recommendations.rebuild(self.request.get('full') == '1')
+        logging.info('Rebuilt recommendations: %s', summary)
+
+
+class PurgeTombstonesHandler(webapp2.RequestHandler):
+    def get(self):
+        """Delete the sync tombstones no client can still need."""
+        logging.info('Purged %d tombstones', sync.purgeTombstones())
+
 app = webapp2.WSGIApplication([
+    ('/_ah/warmup', WarmupHandler),
     ('/crons/set_announcement', SetAnnouncementHandler),
+    ('/crons/send_confirmation_emails', SendConfirmationEmailsHandler),
+    ('/crons/rebuild_recommendations', RebuildRecommendationsHandler),
+    ('/crons/purge_tombstones', PurgeTombstonesHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
     ('/tasks/set_featured_speaker', SetFeaturedSpeakerHandler),
+    ('/tasks/migrate', MigrateHandler),
+    ('/tasks/delete_conference', DeleteConferenceHandler),
+    ('/tasks/promote_waitlist', PromoteWaitlistHandler),
+    ('/calendar/conference/([^/]+)\.ics', ConferenceCalendarHandler),
+    ('/calendar/wishlist/([^/]+)\.ics', WishlistCalendarHandler),
+    ('/admin/cache_stats', CacheStatsHandler),
+    ('/admin/migrations', MigrationsHandler),
 ], debug=True)
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+
+"""
+migrations.py -- Udacity conference server-side Python App Engine
+    resumable, throttled migrations of existing entities
+
+A migration is a function registered with @migration for one model. It
+is given a batch of entities and returns the entities to put; they can
+be the same ones changed in place, or others derived from them. A run
+pages through the kind with a cursor, one task per batch. In-place
+migrations page through keys only, and re-read & transform each entity
+group of the batch in its own transaction, so a registration or edit
+made since the page was read isn't overwritten. After each
+batch it saves its cursor and counts on a MigrationRun (key id: the
+migration name), in the same transaction that queues the next batch.
+The next batch is delayed so the run averages writeRate puts a second.
+
+Tasks carry the run's generation and cursor. A task that no longer
+matches the checkpoint is a duplicate or belongs to an earlier run, and
+does nothing. Pausing stops the chain at the next batch; resuming
+carries on from the saved cursor.
+
+"""
+
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+import models
+
+MIGRATE_URL = '/tasks/migrate'
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_WRITE_RATE = 100.0  # entities put per second
+REINDEX_KINDS = ('Conference', 'Session', 'Speaker', 'FeaturedSpeaker')
+
+MIGRATIONS = {}
+
+
+class Migration(object):
+    """A named transform over every entity of one model."""
+
+    def __init__(self, name, model, transform, description, in_place):
+        self.name = name
+        self.model = model
+        self.transform = transform
+        self.description = description
+        self.in_place = in_place
+
+
+def migration(name, model, description, in_place=True):
+    """Register fn(entities) -> entities to put as a migration of model.
+
+    An in_place fn returns (some of) the entities it is given, and is
+    called inside a transaction with the entities of one entity group, so
+    may not touch other groups. Otherwise fn derives other entities from
+    the batch, and is called outside any transaction.
+    """
+    def register(fn):
+        MIGRATIONS[name] = Migration(name, model, fn, description, in_place)
+        return fn
+    return register
+
+
+# - - - migrations - - - - - - - - - - - - - - - - - - - - - -
+
+def _reindex(entities):
+    return entities
+
+
+for _kind in REINDEX_KINDS:
+    migration('reindex_%s' % _kind.lower(), getattr(models, _kind),
+              're-put every %s so its index rows match the model' % _kind
+              )(_reindex)
+
+
+@migration('conference_month', models.Conference,
+           'set month from startDate (0 without one)')
+def _conferenceMonth(confs):
+    changed = []
+    for conf in confs:
+        month = conf.startDate.month if conf.startDate else 0
+        if conf.month != month:
+            conf.month = month
+            changed.append(conf)
+    return changed
+
+
+@migration('speaker_sessions', models.Session,
+           'list every Session under its speaker\'s email for '
+           'getSessionsBySpeaker', in_place=False)
+def _speakerSessions(sessions):
+    speaker_ids = set(sesh.speakerId for sesh in sessions if sesh.speakerId)
+    emails = dict((speaker.key.id(), speaker.email) for speaker in
+                  ndb.get_multi([ndb.Key(models.Speaker, sid)
+                                 for sid in speaker_ids])
+                  if speaker and speaker.email)
+    # row IDs are the session keys, so a re-run just overwrites them
+    return [models.SpeakerSession.forSession(sesh, emails[sesh.speakerId])
+            for sesh in sessions if sesh.speakerId in emails]
+
+
+# - - - runs - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def _queueBatch(run, countdown=0):
+    taskqueue.add(params={'name': run.key.id(),
+                          'generation': run.generation,
+                          'cursor': run.cursor or ''},
+                  url=MIGRATE_URL, countdown=countdown, transactional=True)
+
+
+@ndb.transactional
+def start(name, batch_size=DEFAULT_BATCH_SIZE, write_rate=DEFAULT_WRITE_RATE,
+          queue=True):
+    """Start (or restart from the beginning) a migration run."""
+    if name not in MIGRATIONS:
+        raise ValueError('Unknown migration: %s' % name)
+    run = (ndb.Key(models.MigrationRun, name).get() or
+           models.MigrationRun(id=name))
+    run.populate(generation=run.generation + 1, status='running',
+                 cursor=None, batchSize=batch_size, writeRate=write_rate,
+                 read=0, written=0, batches=0,
+                 started=datetime.now(), finished=None)
+    run.put()
+    if queue:
+        _queueBatch(run)
+    return run
+
+
+@ndb.transactional
+def pause(name):
+    """Stop a running migration after its current batch."""
+    run = ndb.Key(models.MigrationRun, name).get()
+    if run and run.status == 'running':
+        run.status = 'paused'
+        run.put()
+    return run
+
+
+@ndb.transactional
+def resume(name):
+    """Carry on with a paused (or stalled) migration from its cursor."""
+    run = ndb.Key(models.MigrationRun, name).get()
+    if run and run.status != 'done':
+        # a new generation, so a stalled chain's tasks are ignored
+        run.generation += 1
+        run.status = 'running'
+        run.put()
+        _queueBatch(run)
+    return run
+
+
+@ndb.transactional
+def _migrateGroup(migration, keys):
+    """Re-read keys, all of one entity group, and put what an in-place
+    migration makes of them; returns the number of entities put."""
+    entities = [entity for entity in ndb.get_multi(keys) if entity]
+    puts = migration.transform(entities) if entities else []
+    ndb.put_multi(puts)
+    return len(puts)
+
+
+def _runBatch(migration, run):
+    """Migrate one batch from run's cursor, returning (next cursor or None
+    when finished, entities read, entities written)."""
+    query = migration.model.query()
+    cursor = Cursor(urlsafe=run.cursor or None)
+    if migration.in_place:
+        keys, next_cursor, more = query.fetch_page(
+            run.batchSize, start_cursor=cursor, keys_only=True)
+        groups = OrderedDict()
+        for key in keys:
+            groups.setdefault(key.root(), []).append(key)
+        read = len(keys)
+        written = sum(_migrateGroup(migration, group_keys)
+                      for group_keys in groups.values())
+    else:
+        entities, next_cursor, more = query.fetch_page(
+            run.batchSize, start_cursor=cursor)
+        puts = migration.transform(entities)
+        if puts:
+            ndb.put_multi(puts)
+        read, written = len(entities), len(puts)
+    next_cursor = next_cursor.urlsafe() if more and next_cursor else None
+    return next_cursor, read, written
+
+
+@ndb.transactional
+def _checkpoint(name, generation, cursor, next_cursor, read, written, queue,
+                countdown):
+    """Record a finished batch and queue the next, unless the run was
+    paused, restarted or already moved past this batch."""
+    run = ndb.Key(models.MigrationRun, name).get()
+    if (not run or run.generation != generation or run.cursor != cursor or
+            run.status == 'done'):
+        return run
+    run.cursor = next_cursor
+    run.read += read
+    run.written += written
+    run.batches += 1
+    if not next_cursor:
+        run.status = 'done'
+        run.finished = datetime.now()
+    run.put()
+    if queue and run.status == 'running':
+        _queueBatch(run, countdown)
+    return run
+
+
+def runBatch(name, generation, cursor=None, queue=True):
+    """Run the batch a migration task stands for, then checkpoint it."""
+    run = ndb.Key(models.MigrationRun, name).get()
+    if (not run or run.status != 'running' or run.generation != generation or
+            run.cursor != (cursor or None)):
+        return run  # paused, finished, restarted or a duplicate task
+    started = time.time()
+    next_cursor, read, written = _runBatch(MIGRATIONS[name], run)
+    # wait long enough that this batch's puts average out at writeRate
+    countdown = max(0, written / run.writeRate - (time.time() - started))
+    return _checkpoint(name, generation, run.cursor, next_cursor, read,
+                       written, queue, countdown)
+
+
+def runToCompletion(name, batch_size=DEFAULT_BATCH_SIZE,
+                    write_rate=DEFAULT_WRITE_RATE, progress=None):
+    """Run a migration in-process, without the task queue; for the local
+    stubs (tools/migrate.py). progress(run) is called after each batch."""
+    run = start(name, batch_size, write_rate, queue=False)
+    while run.status == 'running':
+        started = time.time()
+        written = run.written
+        run = runBatch(name, run.generation, run.cursor, queue=False)
+        if progress:
+            progress(run)
+        if run.status == 'running':
+            time.sleep(max(0, (run.written - written) / write_rate -
+                           (time.time() - started)))
+    return run
+
+
+def progress():
+    """Return a dict of every registered migration & its latest run."""
+    runs = dict((run.key.id(), run) for run in ndb.get_multi(
+        [ndb.Key(models.MigrationRun, name) for name in MIGRATIONS]) if run)
+    report = {}
+    for name, mig in MIGRATIONS.items():
+        entry = {'kind': mig.model._get_kind(),
+                 'description': mig.description,
+                 'status': 'never run'}
+        run = runs.get(name)
+        if run:
+            elapsed = ((run.finished or datetime.now()) -
+                       run.started).total_seconds()
+            entry.update(status=run.status, generation=run.generation,
+                         read=run.read, written=run.written,
+                         batches=run.batches, batchSize=run.batchSize,
+                         writeRate=run.writeRate,
+                         started=run.started.isoformat(),
+                         finished=run.finished and run.finished.isoformat(),
+                         actualWriteRate=(round(run.written / elapsed, 1)
+                                          if elapsed > 0 else None))
+        report[name] = entry
+    return report
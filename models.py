@@ -24,6 +24,13 @@ class ConflictException(endpoints.ServiceException):
     http_status = httplib.CONFLICT
 
 
+class RateLimitedException(endpoints.ServiceException):
+    """RateLimitedException -- exception mapped to HTTP 503 response"""
+    # Endpoints turns a 429 into a 404, but passes 503 through; the
+    # message says when to retry
+    http_status = httplib.SERVICE_UNAVAILABLE
+
+
 class Profile(ndb.Model):
     """Profile -- User profile object"""
     displayName = ndb.StringProperty()
@@ -31,6 +38,43 @@ class Profile(ndb.Model):
     teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
     conferenceKeysToAttend = ndb.StringProperty(repeated=True)
     sessionKeysWishlist = ndb.StringProperty(repeated=True)
+    # the WishlistFeed id in this user's wishlist calendar URL, once made
+    calendarFeedId = ndb.StringProperty(indexed=False)
+    lastModified = ndb.DateTimeProperty(auto_now=True)
+
+
+class WishlistFeed(ndb.Model):
+    """WishlistFeed -- the user whose wishlist calendar feed has this
+    entity's key id (a random, opaque ID) in its URL"""
+    userId = ndb.StringProperty(indexed=False)
+
+
+class RecommenderProfile(ndb.Model):
+    """RecommenderProfile -- the items (websafe keys) the Profile with the
+    same id contributed to the last recommendations rebuild"""
+    items = ndb.StringProperty(repeated=True, indexed=False)
+
+
+class RecommenderState(ndb.Model):
+    """RecommenderState -- watermark of the last recommendations rebuild
+    & which RecommenderChunks hold its co-occurrence matrix"""
+    watermark = ndb.DateTimeProperty(indexed=False)
+    generation = ndb.IntegerProperty(default=0, indexed=False)
+    chunks = ndb.IntegerProperty(default=0, indexed=False)
+
+
+class RecommenderChunk(ndb.Model):
+    """RecommenderChunk -- one slice (key id: generation:index) of the
+    compressed co-occurrence matrix"""
+    data = ndb.BlobProperty()
+
+
+class SessionRecommendations(ndb.Model):
+    """SessionRecommendations -- the sessions most often wishlisted with
+    the session or conference whose websafe key is this entity's key id,
+    best first"""
+    sessions = ndb.StringProperty(repeated=True, indexed=False)
+    scores = ndb.FloatProperty(repeated=True, indexed=False)
 
 
 class ProfileMiniForm(messages.Message):
@@ -46,6 +90,8 @@ class ProfileForm(messages.Message):
     teeShirtSize = messages.EnumField('TeeShirtSize', 3)
     conferenceKeysToAttend = messages.StringField(4, repeated=True)
     sessionKeysWishlist = messages.StringField(5, repeated=True)
+    etag = messages.StringField(6)
+    notModified = messages.BooleanField(7)  # only etag is set
 
 
 class BooleanMessage(messages.Message):
@@ -56,15 +102,63 @@ class BooleanMessage(messages.Message):
 class Conference(ndb.Model):
     """Conference -- Conference object"""
     name            = ndb.StringProperty(required=True)
-    description     = ndb.StringProperty()
-    organizerUserId = ndb.StringProperty()
+    description     = ndb.StringProperty(indexed=False)
+    organizerUserId = ndb.StringProperty(indexed=False)
     topics          = ndb.StringProperty(repeated=True)
     city            = ndb.StringProperty()
     startDate       = ndb.DateProperty()
     month           = ndb.IntegerProperty()
-    endDate         = ndb.DateProperty()
+    endDate         = ndb.DateProperty(indexed=False)
     maxAttendees    = ndb.IntegerProperty()
     seatsAvailable  = ndb.IntegerProperty()
+    # users on the Waitlist; while any are, freed seats are theirs
+    waitlisted      = ndb.IntegerProperty(default=0, indexed=False)
+    lastModified    = ndb.DateTimeProperty(auto_now=True)  # for sync
+
+
+class MigrationRun(ndb.Model):
+    """MigrationRun -- checkpoint & progress of the latest run of the
+    migration named by its key id (see migrations.py)"""
+    status = ndb.StringProperty(indexed=False)  # running, paused or done
+    generation = ndb.IntegerProperty(default=0, indexed=False)
+    cursor = ndb.StringProperty(indexed=False)
+    batchSize = ndb.IntegerProperty(indexed=False)
+    writeRate = ndb.FloatProperty(indexed=False)
+    read = ndb.IntegerProperty(default=0, indexed=False)
+    written = ndb.IntegerProperty(default=0, indexed=False)
+    batches = ndb.IntegerProperty(default=0, indexed=False)
+    started = ndb.DateTimeProperty(indexed=False)
+    finished = ndb.DateTimeProperty(indexed=False)
+
+
+class Waitlist(ndb.Model):
+    """Waitlist -- FIFO waitlist of the Conference whose websafe key is
+    this entity's key id; WaitlistEntry children are the waiting users"""
+    nextSeq = ndb.IntegerProperty(default=1, indexed=False)
+
+
+class WaitlistEntry(ndb.Model):
+    """WaitlistEntry -- a user (key id: user ID) waiting for a seat"""
+    seq = ndb.IntegerProperty()
+    joined = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
+
+
+class Tombstone(ndb.Model):
+    """Tombstone -- left by a deleted Conference or Session (key id: its
+    websafe key) for sync clients; purged after sync.TOMBSTONE_DAYS"""
+    kind = ndb.StringProperty(indexed=False)
+    lastModified = ndb.DateTimeProperty(auto_now=True)
+
+
+class ConferenceDeletion(ndb.Model):
+    """ConferenceDeletion -- left in place of a deleted Conference (its
+    parent key) until everything hanging off it is gone; phase & cursor
+    are the checkpoint of the deletion's task chain, and facets the
+    conference's facet IDs not yet uncounted"""
+    phase = ndb.StringProperty(indexed=False)
+    cursor = ndb.StringProperty(indexed=False)
+    facets = ndb.StringProperty(repeated=True, indexed=False)
+    created = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
 
 
 class ConferenceForm(messages.Message):
@@ -81,11 +175,15 @@ class ConferenceForm(messages.Message):
     endDate         = messages.StringField(10) #DateTimeField()
     websafeKey      = messages.StringField(11)
     organizerDisplayName = messages.StringField(12)
+    etag            = messages.StringField(13)
+    notModified     = messages.BooleanField(14)  # only etag is set
 
 
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    etag = messages.StringField(2)
+    notModified = messages.BooleanField(3)  # only etag is set
 
 
 class TeeShirtSize(messages.Enum):
@@ -117,6 +215,7 @@ class ConferenceQueryForm(messages.Message):
 class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm inbound form message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    ifNoneMatch = messages.StringField(2)  # etag of the copy the client has
 
 
 class StringMessage(messages.Message):
@@ -128,7 +227,19 @@ class Speaker(ndb.Model):
     """Speaker -- Speaker object"""
     name = ndb.StringProperty()
     email = ndb.StringProperty()
-    gender = ndb.StringProperty()
+    gender = ndb.StringProperty(indexed=False)
+    lastModified = ndb.DateTimeProperty(auto_now=True)  # for sync
+
+
+class SpeakerRosterEntry(ndb.Model):
+    """SpeakerRosterEntry -- a speaker & their number of sessions"""
+    speakerId = ndb.IntegerProperty()
+    sessions = ndb.IntegerProperty(default=0)
+
+
+class SpeakerRoster(ndb.Model):
+    """SpeakerRoster -- speakers of its parent Conference's sessions"""
+    speakers = ndb.LocalStructuredProperty(SpeakerRosterEntry, repeated=True)
 
 
 class SpeakerForm(messages.Message):
@@ -136,6 +247,8 @@ class SpeakerForm(messages.Message):
     name = messages.StringField(1)
     email = messages.StringField(2)
     gender = messages.StringField(3)
+    sessionCount = messages.IntegerField(4)  # set by getSpeakersByConf
+    websafeKey = messages.StringField(5)
 
 
 class SpeakerForms(messages.Message):
@@ -143,6 +256,23 @@ class SpeakerForms(messages.Message):
     items = messages.MessageField(SpeakerForm, 1, repeated=True)
 
 
+class FeaturedSpeaker(ndb.Model):
+    """FeaturedSpeaker -- featured speaker of its parent Conference"""
+    speakerName = ndb.StringProperty(indexed=False)
+    message = ndb.TextProperty()
+
+
+class FeaturedSpeakerForm(messages.Message):
+    """FeaturedSpeakerForm -- featured speaker outbound form message"""
+    websafeConferenceKey = messages.StringField(1)
+    data = messages.StringField(2)
+
+
+class FeaturedSpeakerForms(messages.Message):
+    """FeaturedSpeakerForms -- multiple FeaturedSpeakerForm outbound form message"""
+    items = messages.MessageField(FeaturedSpeakerForm, 1, repeated=True)
+
+
 class TypeOfSession(messages.Enum):
     """TypeOfSession -- type of session enumeration value"""
     NOT_SPECIFIED = 1
@@ -157,12 +287,34 @@ class TypeOfSession(messages.Enum):
 class Session(ndb.Model):
     """Session -- Session object"""
     name = ndb.StringProperty(required=True)
-    highlights = ndb.StringProperty()
+    highlights = ndb.StringProperty(indexed=False)
     speakerId = ndb.IntegerProperty()
-    duration = ndb.IntegerProperty()
+    duration = ndb.IntegerProperty(indexed=False)
     typeOfSession = msgprop.EnumProperty(TypeOfSession, repeated=True)
     date = ndb.DateProperty()
     startTime = ndb.TimeProperty()
+    lastModified = ndb.DateTimeProperty(auto_now=True)  # for sync
+
+
+class SpeakerSession(ndb.Model):
+    """SpeakerSession -- a Session listed under its speaker's email (the
+    parent key), for getSessionsBySpeaker; id is the websafe Session key"""
+    session = ndb.KeyProperty(indexed=False)
+    speakerId = ndb.IntegerProperty(indexed=False)
+    date = ndb.DateProperty()
+    startTime = ndb.TimeProperty()
+
+    @staticmethod
+    def parentKey(email):
+        """Return the entity group key of one speaker email's rows."""
+        return ndb.Key('SpeakerEmail', email)
+
+    @classmethod
+    def forSession(cls, sesh, email):
+        """Return the row listing sesh under the speaker email."""
+        return cls(id=sesh.key.urlsafe(), parent=cls.parentKey(email),
+                   session=sesh.key, speakerId=sesh.speakerId,
+                   date=sesh.date, startTime=sesh.startTime)
 
 
 class SessionForm(messages.Message):
@@ -177,8 +329,166 @@ class SessionForm(messages.Message):
     date = messages.StringField(8)  # DateField()
     startTime = messages.StringField(9)  # TimeField()
     websafeKey = messages.StringField(10)
+    conferenceName = messages.StringField(11)  # set by getSessionsBySpeaker
+    conferenceKey = messages.StringField(12)  # websafe; ditto
 
 
 class SessionForms(messages.Message):
     """SessionForms -- multiple Session outbound form message"""
     items = messages.MessageField(SessionForm, 1, repeated=True)
+    etag = messages.StringField(2)
+    notModified = messages.BooleanField(3)  # only etag is set
+    nextPageToken = messages.StringField(4)
+
+
+class AgendaConflictForm(messages.Message):
+    """AgendaConflictForm -- pair of overlapping wishlist sessions"""
+    websafeSessionKey = messages.StringField(1)
+    conflictingSessionKey = messages.StringField(2)
+    overlapStart = messages.StringField(3)  # DateTimeField()
+    overlapEnd = messages.StringField(4)  # DateTimeField()
+
+
+class AgendaBlockForm(messages.Message):
+    """AgendaBlockForm -- merged block of back-to-back or overlapping sessions"""
+    start = messages.StringField(1)  # DateTimeField()
+    end = messages.StringField(2)  # DateTimeField()
+    websafeSessionKeys = messages.StringField(3, repeated=True)
+
+
+class WishlistAgendaForm(messages.Message):
+    """WishlistAgendaForm -- wishlist conflicts and merged timeline"""
+    conflicts = messages.MessageField(AgendaConflictForm, 1, repeated=True)
+    timeline = messages.MessageField(AgendaBlockForm, 2, repeated=True)
+
+
+class ConferenceDetailForm(messages.Message):
+    """ConferenceDetailForm -- Conference with its sessions, speakers and caller state"""
+    conference = messages.MessageField(ConferenceForm, 1)
+    sessions = messages.MessageField(SessionForm, 2, repeated=True)
+    speakers = messages.MessageField(SpeakerForm, 3, repeated=True)
+    isRegistered = messages.BooleanField(4)
+    sessionKeysWishlist = messages.StringField(5, repeated=True)
+    featuredSpeaker = messages.StringField(6)
+
+
+class FacetCounterShard(ndb.Model):
+    """FacetCounterShard -- one shard of a conference facet value's count"""
+    facet = ndb.StringProperty(indexed=False)
+    value = ndb.StringProperty(indexed=False)
+    count = ndb.IntegerProperty(default=0, indexed=False)
+
+
+class FacetCountForm(messages.Message):
+    """FacetCountForm -- number of conferences with a facet value"""
+    value = messages.StringField(1)
+    count = messages.IntegerField(2)
+
+
+class TombstoneForm(messages.Message):
+    """TombstoneForm -- a Conference or Session deleted since the sync
+    watermark"""
+    kind = messages.StringField(1)
+    websafeKey = messages.StringField(2)
+
+
+class SyncForm(messages.Message):
+    """SyncForm -- a page of what changed since the sync watermark"""
+    conferences = messages.MessageField(ConferenceForm, 1, repeated=True)
+    sessions = messages.MessageField(SessionForm, 2, repeated=True)
+    speakers = messages.MessageField(SpeakerForm, 3, repeated=True)
+    deleted = messages.MessageField(TombstoneForm, 4, repeated=True)
+    nextPageToken = messages.StringField(5)
+    watermark = messages.StringField(6)  # set on the last page
+    fullResync = messages.BooleanField(7)
+
+
+class ConferenceFacetsForm(messages.Message):
+    """ConferenceFacetsForm -- conference counts per city, topic and month"""
+    city = messages.MessageField(FacetCountForm, 1, repeated=True)
+    topic = messages.MessageField(FacetCountForm, 2, repeated=True)
+    month = messages.MessageField(FacetCountForm, 3, repeated=True)
+
+
+class RegistrationForm(messages.Message):
+    """RegistrationForm -- registerForConference result; data is False
+    and waitlistPosition set when the conference was full and the user
+    was put on its waitlist instead"""
+    data = messages.BooleanField(1)
+    waitlistPosition = messages.IntegerField(2)
+
+
+class RegistrationStatus(messages.Enum):
+    """RegistrationStatus -- outcome of one registerGroup registration"""
+    REGISTERED = 1
+    ALREADY_REGISTERED = 2
+    CONFERENCE_FULL = 3
+    NO_CONFERENCE = 4
+    NO_PROFILE = 5
+    FORBIDDEN = 6  # the caller doesn't organize the conference
+    FAILED = 7  # the datastore failed the user's batch; try again
+
+
+class GroupRegistrationForm(messages.Message):
+    """GroupRegistrationForm -- registerGroup inbound form message: every
+    user with a Profile for each email, for every conference"""
+    websafeConferenceKey = messages.StringField(1, repeated=True)
+    email = messages.StringField(2, repeated=True)
+
+
+class GroupRegistrationResultForm(messages.Message):
+    """GroupRegistrationResultForm -- one email & conference of a
+    registerGroup call"""
+    email = messages.StringField(1)
+    websafeConferenceKey = messages.StringField(2)
+    status = messages.EnumField(RegistrationStatus, 3)
+
+
+class GroupRegistrationResultForms(messages.Message):
+    """GroupRegistrationResultForms -- registerGroup results, in request
+    order of email then conference"""
+    items = messages.MessageField(GroupRegistrationResultForm, 1, repeated=True)
+
+
+class WaitlistPositionForm(messages.Message):
+    """WaitlistPositionForm -- the user's place on a conference's
+    waitlist; position is unset when they are not on it"""
+    websafeConferenceKey = messages.StringField(1)
+    position = messages.IntegerField(2)
+
+
+class ConferenceResultForm(messages.Message):
+    """ConferenceResultForm -- one key of a getConferences batch; found is
+    False (and conference unset) for unknown or malformed keys"""
+    websafeConferenceKey = messages.StringField(1)
+    found = messages.BooleanField(2)
+    conference = messages.MessageField(ConferenceForm, 3)
+
+
+class ConferenceResultForms(messages.Message):
+    """ConferenceResultForms -- getConferences results in request order"""
+    items = messages.MessageField(ConferenceResultForm, 1, repeated=True)
+
+
+class SessionResultForm(messages.Message):
+    """SessionResultForm -- one key of a getSessions batch; found is
+    False (and session unset) for unknown or malformed keys"""
+    websafeSessionKey = messages.StringField(1)
+    found = messages.BooleanField(2)
+    session = messages.MessageField(SessionForm, 3)
+
+
+class SessionResultForms(messages.Message):
+    """SessionResultForms -- getSessions results in request order"""
+    items = messages.MessageField(SessionResultForm, 1, repeated=True)
+
+
+class SeatAvailabilityForm(messages.Message):
+    """SeatAvailabilityForm -- live seats available for a Conference"""
+    websafeConferenceKey = messages.StringField(1)
+    seatsAvailable = messages.IntegerField(2)
+
+
+class SeatAvailabilityForms(messages.Message):
+    """SeatAvailabilityForms -- multiple SeatAvailabilityForm outbound form message"""
+    items = messages.MessageField(SeatAvailabilityForm, 1, repeated=True)
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+
+"""
+recommendations.py -- Udacity conference server-side Python App Engine
+    session recommendations from wishlist & registration co-occurrence
+
+rebuild() runs from cron. It counts, over all profiles, how often two
+items (wishlisted sessions or registered conferences) appear together,
+as a sparse co-occurrence matrix. Pairs are scored by cosine similarity:
+count / sqrt(profiles with item a * profiles with item b). The TOP_K
+most similar sessions of every item are stored as a
+SessionRecommendations entity, so getRecommendedSessions (in
+conference.py, which doesn't import NumPy) only merges the lists of the
+user's own items.
+
+Incremental runs read only the profiles modified since the last run.
+The items each profile contributed last time are kept in a
+RecommenderProfile, so its old pairs are subtracted and its new pairs
+added, a page of PROFILE_BATCH_SIZE profiles at a time. Only the rows
+whose counts changed are re-ranked and rewritten.
+A full rebuild (full=True) also refreshes the rows that only drifted
+because their neighbours' counts changed.
+
+The Python 2.7 runtime ships NumPy but not SciPy, so the matrix is kept
+as coordinate arrays of pair codes (row << 32 | col) with their counts,
+merged with unique/bincount. It is stored zlib-compressed across
+RecommenderChunk entities.
+
+"""
+
+import zlib
+from cStringIO import StringIO
+from datetime import datetime
+from datetime import timedelta
+
+import numpy as np
+from google.appengine.ext import ndb
+
+from models import Profile
+from models import RecommenderChunk
+from models import RecommenderProfile
+from models import RecommenderState
+from models import SessionRecommendations
+
+STATE_ID = "sessions"
+TOP_K = 20
+# caps the pairs (items squared) one profile can add
+MAX_PROFILE_ITEMS = 100
+PROFILE_BATCH_SIZE = 500
+WRITE_BATCH_SIZE = 200
+CHUNK_BYTES = 900 * 1024  # below the 1MB entity limit
+# the lastModified query is eventually consistent; profiles re-read
+# because of the overlap are skipped when their items didn't change
+WATERMARK_OVERLAP = timedelta(minutes=5)
+
+
+def profileItems(prof):
+    """Return the items a Profile contributes, most recent first."""
+    items = []
+    seen = set()
+    for item in (list(reversed(prof.sessionKeysWishlist)) +
+                 list(reversed(prof.conferenceKeysToAttend))):
+        if item not in seen:
+            seen.add(item)
+            items.append(item)
+    return items[:MAX_PROFILE_ITEMS]
+
+
+def _pairCodes(index_lists):
+    """Return the code of every ordered pair of distinct items that share
+    a list, in both directions."""
+    codes = [np.zeros(0, np.int64)]
+    for idx in index_lists:
+        if len(idx) < 2:
+            continue
+        idx = np.asarray(idx, np.int64)
+        rows = np.repeat(idx, len(idx))
+        cols = np.tile(idx, len(idx))
+        keep = rows != cols
+        codes.append((rows[keep] << 32) | cols[keep])
+    return np.concatenate(codes)
+
+
+def _itemCounts(index_lists, n_items):
+    """Return the number of lists each item is on."""
+    flat = [i for idx in index_lists for i in idx]
+    if not flat:
+        return np.zeros(n_items, np.int64)
+    return np.bincount(np.asarray(flat, np.int64), minlength=n_items)
+
+
+def _mergeCounts(codes, vals, delta_codes, delta_vals):
+    """Add delta counts to the sparse matrix, dropping pairs that reach 0."""
+    all_codes = np.concatenate([codes, delta_codes])
+    if not len(all_codes):
+        return codes, vals
+    uniq, inverse = np.unique(all_codes, return_inverse=True)
+    summed = np.round(np.bincount(inverse, weights=np.concatenate(
+        [vals, delta_vals]).astype(np.float64))).astype(np.int64)
+    keep = summed > 0
+    return uniq[keep], summed[keep]
+
+
+def _topK(codes, vals, counts, is_session, rows_wanted):
+    """Return (rows, cols, scores) of the TOP_K session neighbours of
+    each wanted row, best first within a row."""
+    rows = codes >> 32
+    cols = codes & 0xffffffff
+    keep = is_session[cols] & rows_wanted[rows]
+    rows, cols, vals = rows[keep], cols[keep], vals[keep]
+    if not len(rows):
+        return rows, cols, np.zeros(0)
+    scores = vals / np.sqrt(counts[rows].astype(np.float64) * counts[cols])
+    order = np.lexsort((-scores, rows))
+    rows, cols, scores = rows[order], cols[order], scores[order]
+    # rank of each pair within its row
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(rows)) + 1])
+    sizes = np.diff(np.concatenate([starts, [len(rows)]]))
+    rank = np.arange(len(rows)) - np.repeat(starts, sizes)
+    top = rank < TOP_K
+    return rows[top], cols[top], scores[top]
+
+
+def _isSession(item):
+    try:
+        return ndb.Key(urlsafe=item).kind() == 'Session'
+    except Exception:
+        return False
+
+
+# - - - state - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def _loadState():
+    """Return (RecommenderState or None, items, is_session, counts,
+    codes, vals)."""
+    state = ndb.Key(RecommenderState, STATE_ID).get()
+    if not state:
+        return (None, [], np.zeros(0, bool), np.zeros(0, np.int64),
+                np.zeros(0, np.int64), np.zeros(0, np.int64))
+    chunks = ndb.get_multi([
+        ndb.Key(RecommenderChunk, '%d:%d' % (state.generation, i))
+        for i in range(state.chunks)])
+    buf = StringIO(zlib.decompress(''.join(chunk.data for chunk in chunks)))
+    items = [str(item) for item in np.load(buf)]
+    return (state, items, np.load(buf), np.load(buf), np.load(buf),
+            np.load(buf))
+
+
+def _saveState(state, watermark, items, is_session, counts, codes, vals):
+    """Write the matrix under a new generation, then switch to it."""
+    buf = StringIO()
+    for array in (np.array(items, dtype=str), is_session, counts, codes, vals):
+        np.save(buf, array)
+    data = zlib.compress(buf.getvalue())
+    old_generation = state.generation if state else 0
+    generation = old_generation + 1
+    chunks = [RecommenderChunk(id='%d:%d' % (generation, i),
+                               data=data[start:start + CHUNK_BYTES])
+              for i, start in enumerate(range(0, len(data), CHUNK_BYTES))]
+    ndb.put_multi(chunks)
+    old_chunks = state.chunks if state else 0
+    RecommenderState(id=STATE_ID, watermark=watermark, generation=generation,
+                     chunks=len(chunks)).put()
+    ndb.delete_multi([ndb.Key(RecommenderChunk, '%d:%d' % (old_generation, i))
+                      for i in range(old_chunks)])
+
+
+# - - - rebuild - - - - - - - - - - - - - - - - - - - - - - - -
+
+def rebuild(full=False):
+    """Update the co-occurrence matrix from changed profiles (or all of
+    them) and rewrite the affected recommendations; returns a summary."""
+    started = datetime.now()
+    state, items, is_session, counts, codes, vals = _loadState()
+    full = full or state is None
+    if full:
+        items, is_session = [], np.zeros(0, bool)
+        counts = codes = vals = np.zeros(0, np.int64)
+        query = Profile.query()
+    else:
+        query = Profile.query(
+            Profile.lastModified > state.watermark - WATERMARK_OVERLAP)
+    index = dict((item, i) for i, item in enumerate(items))
+
+    def indices(item_list):
+        for item in item_list:
+            if item not in index:
+                index[item] = len(items)
+                items.append(item)
+        return [index[item] for item in item_list]
+
+    changed = 0
+    touched = [np.zeros(0, np.int64)]  # rows whose pair counts changed
+    cursor = None
+    more = True
+    while more:
+        profs, cursor, more = query.fetch_page(
+            PROFILE_BATCH_SIZE, start_cursor=cursor)
+        snaps = ([None] * len(profs) if full else ndb.get_multi(
+            [ndb.Key(RecommenderProfile, prof.key.id()) for prof in profs]))
+        old_lists, new_lists, new_snaps = [], [], []
+        for prof, snap in zip(profs, snaps):
+            old = snap.items if snap else []
+            new = profileItems(prof)
+            if old == new and not full:
+                continue
+            old_lists.append(indices(old) if not full else [])
+            new_lists.append(indices(new))
+            new_snaps.append(RecommenderProfile(id=prof.key.id(), items=new))
+        # merged a page at a time, so the pairs of a whole run are never
+        # held at once
+        counts = (np.concatenate(
+                      [counts, np.zeros(len(items) - len(counts), np.int64)]) +
+                  _itemCounts(new_lists, len(items)) -
+                  _itemCounts(old_lists, len(items)))
+        added, removed = _pairCodes(new_lists), _pairCodes(old_lists)
+        delta_codes = np.concatenate([added, removed])
+        delta_vals = np.concatenate([np.ones(len(added), np.int64),
+                                     -np.ones(len(removed), np.int64)])
+        codes, vals = _mergeCounts(codes, vals, delta_codes, delta_vals)
+        # pairs go both ways, so their rows are all the items involved
+        touched.append(np.unique(delta_codes >> 32))
+        ndb.put_multi(new_snaps)
+        changed += len(new_snaps)
+        more = more and cursor is not None
+
+    n_items = len(items)
+    is_session = np.concatenate([is_session, np.array(
+        [_isSession(item) for item in items[len(is_session):]], bool)])
+    counts = np.concatenate([counts, np.zeros(n_items - len(counts), np.int64)])
+
+    # re-rank the rows whose counts changed (every row on a full run)
+    rows_wanted = np.zeros(n_items, bool)
+    if full:
+        rows_wanted[:] = True
+    else:
+        rows_wanted[np.concatenate(touched)] = True
+    rows, cols, scores = _topK(codes, vals, counts, is_session, rows_wanted)
+    recs = dict((row, SessionRecommendations(id=items[row]))
+                for row in np.flatnonzero(rows_wanted).tolist())
+    for row, col, score in zip(rows.tolist(), cols.tolist(), scores.tolist()):
+        recs[row].sessions.append(items[col])
+        recs[row].scores.append(score)
+    recs = recs.values()
+    for start in range(0, len(recs), WRITE_BATCH_SIZE):
+        ndb.put_multi(recs[start:start + WRITE_BATCH_SIZE])
+
+    _saveState(state, started, items, is_session, counts, codes, vals)
+    return {'full': full, 'profiles': changed, 'items': n_items,
+            'pairs': len(codes), 'rows_written': len(recs)}
+
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+
+"""
+registration.py -- Udacity conference server-side Python App Engine
+    group registration of many users for one or more conferences
+
+registerForConference is a cross-group transaction per user and
+conference. registerUsers instead takes every conference's seats in one
+transaction, all or nothing per conference, which also registers as
+many of the users as the entity group limit leaves room for. The rest
+are registered PROFILE_BATCH_SIZE profiles per transaction with
+put_multi. Seats taken for users who turn out to be registered already
+(by a concurrent registerForConference, say) are handed back in one
+more transaction. A batch whose transaction fails doesn't undo the
+ones before it: its users are reported FAILED (unless their profiles
+show the commit landed after all) and their seats are handed back too.
+
+"""
+
+import logging
+
+from google.appengine.api import datastore_errors
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import Profile
+from models import RegistrationStatus
+from versions import VERSION_CONFERENCE
+from versions import VERSION_CONFERENCES
+from versions import VERSION_PROFILE
+from versions import bumpVersions
+from waitlist import MEMCACHE_SEATS_KEY
+from waitlist import queuePromotion
+
+# a cross-group transaction spans at most 25 entity groups
+MAX_ENTITY_GROUPS = 25
+PROFILE_BATCH_SIZE = MAX_ENTITY_GROUPS
+# values per IN filter, which runs one query per value
+EMAIL_QUERY_BATCH_SIZE = 30
+
+
+def profilesByEmail(emails):
+    """Return {email: user ID} for the emails some Profile has."""
+    futures = [Profile.query(Profile.mainEmail.IN(
+                   emails[start:start + EMAIL_QUERY_BATCH_SIZE])).fetch_async()
+               for start in range(0, len(emails), EMAIL_QUERY_BATCH_SIZE)]
+    user_ids = {}
+    for future in futures:
+        for prof in future.get_result():
+            user_ids.setdefault(prof.mainEmail, prof.key.id())
+    return user_ids
+
+
+def _register(reserved, wants, user_ids):
+    """Register each of user_ids for the conferences wants lists for
+    them that are in reserved; returns the (user ID, wsck) registered.
+    Call inside a transaction."""
+    profs = ndb.get_multi([ndb.Key(Profile, user_id) for user_id in user_ids])
+    registered = []
+    changed = []
+    for prof in profs:
+        if not prof:
+            continue
+        wscks = [wsck for wsck in wants[prof.key.id()] if wsck in reserved and
+                 wsck not in prof.conferenceKeysToAttend]
+        if wscks:
+            prof.conferenceKeysToAttend.extend(wscks)
+            registered.extend((prof.key.id(), wsck) for wsck in wscks)
+            changed.append(prof)
+    ndb.put_multi(changed)
+    return registered
+
+
+@ndb.transactional(xg=True)
+def _reserveSeats(seats, wants, user_ids):
+    """Take seats[wsck] seats from each conference that has that many
+    free and nobody waitlisted, then register user_ids for the ones
+    taken; returns (wscks of the conferences seats were taken from,
+    (user ID, wsck) registered)."""
+    wscks = list(seats)
+    confs = ndb.get_multi([ndb.Key(urlsafe=wsck) for wsck in wscks])
+    reserved = set()
+    for wsck, conf in zip(wscks, confs):
+        # seats freed while others wait are theirs
+        if conf and not conf.waitlisted and conf.seatsAvailable >= seats[wsck]:
+            conf.seatsAvailable -= seats[wsck]
+            reserved.add(wsck)
+    ndb.put_multi([conf for wsck, conf in zip(wscks, confs)
+                   if wsck in reserved])
+    return reserved, _register(reserved, wants, user_ids)
+
+
+@ndb.transactional(xg=True)
+def _registerBatch(reserved, wants, user_ids):
+    return _register(reserved, wants, user_ids)
+
+
+def _registeredIn(reserved, wants, user_ids):
+    """Return the (user ID, wsck) wants lists that user_ids' Profiles now
+    show, for the conferences in reserved; read past the caches, as a
+    commit that timed out may still have landed."""
+    profs = ndb.get_multi([ndb.Key(Profile, user_id) for user_id in user_ids],
+                          use_cache=False, use_memcache=False)
+    return [(prof.key.id(), wsck) for prof in profs if prof
+            for wsck in wants[prof.key.id()]
+            if wsck in reserved and wsck in prof.conferenceKeysToAttend]
+
+
+@ndb.transactional(xg=True)
+def _releaseSeats(seats):
+    """Give seats[wsck] seats back to each conference."""
+    wscks = list(seats)
+    confs = ndb.get_multi([ndb.Key(urlsafe=wsck) for wsck in wscks])
+    for wsck, conf in zip(wscks, confs):
+        if conf:
+            conf.seatsAvailable += seats[wsck]
+    ndb.put_multi([conf for conf in confs if conf])
+
+
+def registerUsers(wscks, user_ids):
+    """Register every user of user_ids for every conference of wscks,
+    whose keys may span at most MAX_ENTITY_GROUPS entity groups. A
+    conference without a seat for each of the users who still need one
+    registers none of them; full conferences, and those with a waitlist,
+    are not waitlisted for.
+    Returns {(user ID, wsck): RegistrationStatus}."""
+    conf_keys = [ndb.Key(urlsafe=wsck) for wsck in wscks]
+    entities = ndb.get_multi(
+        conf_keys + [ndb.Key(Profile, user_id) for user_id in user_ids])
+    confs = dict((wsck, conf) for wsck, conf in zip(wscks, entities) if conf)
+    profs = dict((user_id, prof) for user_id, prof
+                 in zip(user_ids, entities[len(conf_keys):]) if prof)
+
+    statuses = {}
+    wants = {}  # user ID -> wscks to register them for
+    seats = dict((wsck, 0) for wsck in confs)
+    for user_id in user_ids:
+        for wsck in wscks:
+            if wsck not in confs:
+                statuses[user_id, wsck] = RegistrationStatus.NO_CONFERENCE
+            elif user_id not in profs:
+                statuses[user_id, wsck] = RegistrationStatus.NO_PROFILE
+            elif wsck in profs[user_id].conferenceKeysToAttend:
+                statuses[user_id, wsck] = RegistrationStatus.ALREADY_REGISTERED
+            else:
+                wants.setdefault(user_id, []).append(wsck)
+                seats[wsck] += 1
+    seats = dict((wsck, n) for wsck, n in seats.items() if n)
+    if not seats:
+        return statuses
+
+    # the users whose profiles fit beside the conferences are registered
+    # in the same transaction as the seats are taken
+    users = [user_id for user_id in user_ids if user_id in wants]
+    groups = set(ndb.Key(urlsafe=wsck).root() for wsck in seats)
+    first = 0
+    for user_id in users:
+        groups.add(ndb.Key(Profile, user_id))
+        if len(groups) > MAX_ENTITY_GROUPS:
+            break
+        first += 1
+
+    reserved = set()
+    registered = []
+    failed = set()  # user IDs of batches whose transaction failed
+    try:
+        reserved, registered = _reserveSeats(seats, wants, users[:first])
+        for start in range(first, len(users), PROFILE_BATCH_SIZE):
+            batch = users[start:start + PROFILE_BATCH_SIZE]
+            try:
+                registered += _registerBatch(reserved, wants, batch)
+            except datastore_errors.Error:
+                # the batches before it are committed, so report this
+                # one rather than fail the whole request
+                logging.exception('Group registration batch failed')
+                registered += _registeredIn(reserved, wants, batch)
+                failed.update(batch)
+    finally:
+        # seats nobody ended up in, including after a failed batch
+        taken = dict((wsck, 0) for wsck in reserved)
+        for _, wsck in registered:
+            taken[wsck] += 1
+        unused = dict((wsck, seats[wsck] - taken[wsck]) for wsck in reserved
+                      if seats[wsck] > taken[wsck])
+        if unused:
+            _releaseSeats(unused)
+            for wsck in unused:
+                queuePromotion(wsck)
+        for wsck, n in taken.items():
+            if n:
+                memcache.decr(MEMCACHE_SEATS_KEY + wsck, n)
+        if registered:
+            bumpVersions(VERSION_CONFERENCES,
+                         *set([VERSION_CONFERENCE % wsck for wsck in taken] +
+                              [VERSION_PROFILE % user_id
+                               for user_id, _ in registered]))
+
+    registered = set(registered)
+    for user_id, user_wscks in wants.items():
+        for wsck in user_wscks:
+            if (user_id, wsck) in registered:
+                statuses[user_id, wsck] = RegistrationStatus.REGISTERED
+            elif wsck in reserved and user_id in failed:
+                statuses[user_id, wsck] = RegistrationStatus.FAILED
+            elif wsck in reserved:
+                # registered meanwhile
+                statuses[user_id, wsck] = RegistrationStatus.ALREADY_REGISTERED
+            else:
+                statuses[user_id, wsck] = RegistrationStatus.CONFERENCE_FULL
+    return statuses
@@ -16,3 +16,19 @@ WEB_CLIENT_ID = '273589036641-e5g6ok25j04q0n8r4bt59cseg3ml0s2p.apps.googleuserco
 ANDROID_CLIENT_ID = 'replace with Android client ID'
 IOS_CLIENT_ID = 'replace with iOS client ID'
 ANDROID_AUDIENCE = WEB_CLIENT_ID
+
+# Signs the tokens in wishlist calendar feed URLs (calendars.py); changing
+# it invalidates every URL handed out. Wishlist feeds are off until it is
+# replaced
+CALENDAR_FEED_SECRET = 'replace with a long random string'
+
+# Per-user token-bucket limits for write endpoints, as
+# method name: (bucket capacity, tokens refilled per second)
+RATE_LIMITS = {
+    'registerForConference': (5, 0.1),
+    'registerGroup': (2, 0.02),
+    'unregisterFromConference': (5, 0.1),
+    'addSessionToWishlist': (20, 0.5),
+    'removeSessionFromWishlist': (20, 0.5),
+    'createSession': (10, 0.2),
+}
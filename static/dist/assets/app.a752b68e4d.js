@@ -0,0 +1,726 @@
+'use strict';
+var app = angular.module('conferenceApp',
+['conferenceControllers', 'ngRoute', 'ui.bootstrap']).
+config(['$routeProvider',
+function ($routeProvider) {
+$routeProvider.
+when('/conference', {
+templateUrl: '/assets/show_conferences.db57a47bf5.html',
+controller: 'ShowConferenceCtrl'
+}).
+when('/conference/create', {
+templateUrl: '/assets/create_conferences.6894a21344.html',
+controller: 'CreateConferenceCtrl'
+}).
+when('/conference/detail/:websafeConferenceKey', {
+templateUrl: '/assets/conference_detail.60cefa1b7d.html',
+controller: 'ConferenceDetailCtrl'
+}).
+when('/profile', {
+templateUrl: '/assets/profile.eb3fed0c67.html',
+controller: 'MyProfileCtrl'
+}).
+when('/', {
+templateUrl: '/assets/home.cd1ddc4080.html'
+}).
+otherwise({
+redirectTo: '/'
+});
+}]);
+app.filter('startFrom', function () {
+var filter = function (data, start) {
+return data.slice(start);
+}
+return filter;
+});
+app.constant('HTTP_ERRORS', {
+'UNAUTHORIZED': 401
+});
+app.factory('oauth2Provider', function ($modal) {
+var oauth2Provider = {
+CLIENT_ID: '273589036641-e5g6ok25j04q0n8r4bt59cseg3ml0s2p.apps.googleusercontent.com',
+SCOPES: 'email profile',
+signedIn: false
+}
+oauth2Provider.signIn = function (callback) {
+gapi.auth.signIn({
+'clientid': oauth2Provider.CLIENT_ID,
+'cookiepolicy': 'single_host_origin',
+'accesstype': 'online',
+'approveprompt': 'auto',
+'scope': oauth2Provider.SCOPES,
+'callback': callback
+});
+};
+oauth2Provider.signOut = function () {
+gapi.auth.signOut();
+gapi.auth.setToken({access_token: ''})
+oauth2Provider.signedIn = false;
+};
+oauth2Provider.showLoginModal = function() {
+var modalInstance = $modal.open({
+templateUrl: '/assets/login.modal.5edf465b9f.html',
+controller: 'OAuth2LoginModalCtrl'
+});
+return modalInstance;
+};
+return oauth2Provider;
+});
+app.factory('conferenceApi', function ($log) {
+var READ_TTL_MS = {
+getProfile: 5 * 60 * 1000,
+getConferencesCreated: 60 * 1000,
+getConferencesToAttend: 60 * 1000,
+getConferenceDetail: 30 * 1000,
+queryConferences: 30 * 1000
+};
+var ETAG_METHODS = {
+getProfile: true,
+getConferencesCreated: true,
+getConferencesToAttend: true,
+queryConferences: true
+};
+var INVALIDATES = {
+saveProfile: function () {
+return ['getProfile'];
+},
+createConference: function () {
+return ['queryConferences', 'getConferencesCreated'];
+},
+registerForConference: registrationInvalidates,
+unregisterFromConference: registrationInvalidates
+};
+function registrationInvalidates(params) {
+return ['getProfile', 'getConferencesToAttend', 'getConferencesCreated', 'queryConferences',
+{method: 'getConferenceDetail', params: {websafeConferenceKey: params.websafeConferenceKey}}];
+}
+var cache = {};
+var inFlight = {};
+var generation = 0;
+var accessToken = null;
+var stats = {requests: 0, cacheHits: 0, coalesced: 0, notModified: 0};
+function stableStringify(value) {
+if (angular.isArray(value)) {
+return '[' + value.map(stableStringify).join(',') + ']';
+}
+if (angular.isObject(value) && !angular.isDate(value)) {
+return '{' + Object.keys(value).sort().map(function (key) {
+return JSON.stringify(key) + ':' + stableStringify(value[key]);
+}).join(',') + '}';
+}
+return JSON.stringify(value);
+}
+function cacheKey(method, params) {
+return method + ':' + stableStringify(params || {});
+}
+function clear() {
+cache = {};
+inFlight = {};
+generation++;
+}
+function checkUser() {
+var token = gapi.auth.getToken();
+token = (token && token.access_token) || '';
+if (token !== accessToken) {
+clear();
+accessToken = token;
+}
+}
+function invalidate(targets) {
+generation++;
+angular.forEach(targets, function (target) {
+var keys = angular.isString(target) ?
+Object.keys(cache).concat(Object.keys(inFlight)).filter(function (key) {
+return key.indexOf(target + ':') === 0;
+}) :
+[cacheKey(target.method, target.params)];
+angular.forEach(keys, function (key) {
+if (cache[key]) {
+cache[key].expires = 0;
+}
+delete inFlight[key];
+});
+});
+}
+function read(method, params, callback) {
+checkUser();
+var key = cacheKey(method, params);
+var hit = cache[key];
+if (hit && hit.expires > Date.now()) {
+stats.cacheHits++;
+$log.debug('conferenceApi cache hit: ' + key);
+setTimeout(function () {
+callback(angular.copy(hit.resp));
+}, 0);
+return;
+}
+if (inFlight[key]) {
+stats.coalesced++;
+inFlight[key].push(callback);
+return;
+}
+var waiting = inFlight[key] = [callback];
+var started = generation;
+var request = params;
+if (hit && ETAG_METHODS[method] && hit.resp.etag) {
+request = angular.extend({}, params, {ifNoneMatch: hit.resp.etag});
+}
+stats.requests++;
+gapi.client.conference[method](request).execute(function (resp) {
+if (inFlight[key] === waiting) {
+delete inFlight[key];
+}
+if (!resp.error && resp.notModified) {
+stats.notModified++;
+resp = hit.resp;
+}
+if (!resp.error && started === generation) {
+cache[key] = {expires: Date.now() + READ_TTL_MS[method], resp: resp};
+}
+angular.forEach(waiting, function (waitingCallback) {
+waitingCallback(angular.copy(resp));
+});
+});
+}
+function write(method, params, callback) {
+checkUser();
+stats.requests++;
+gapi.client.conference[method](params).execute(function (resp) {
+invalidate(INVALIDATES[method](params || {}));
+callback(resp);
+});
+}
+var conferenceApi = {clear: clear, stats: stats};
+angular.forEach(READ_TTL_MS, function (ttl, method) {
+conferenceApi[method] = function (params) {
+return {execute: function (callback) {
+read(method, params, callback);
+}};
+};
+});
+angular.forEach(INVALIDATES, function (targets, method) {
+conferenceApi[method] = function (params) {
+return {execute: function (callback) {
+write(method, params, callback);
+}};
+};
+});
+return conferenceApi;
+});
+;
+'use strict';
+var conferenceApp = conferenceApp || {};
+conferenceApp.controllers = angular.module('conferenceControllers', ['ui.bootstrap']);
+conferenceApp.controllers.controller('MyProfileCtrl',
+function ($scope, $log, oauth2Provider, conferenceApi, HTTP_ERRORS) {
+$scope.submitted = false;
+$scope.loading = false;
+$scope.initialProfile = {};
+$scope.teeShirtSizes = [
+{'size': 'XS_M', 'text': "XS - Men's"},
+{'size': 'XS_W', 'text': "XS - Women's"},
+{'size': 'S_M', 'text': "S - Men's"},
+{'size': 'S_W', 'text': "S - Women's"},
+{'size': 'M_M', 'text': "M - Men's"},
+{'size': 'M_W', 'text': "M - Women's"},
+{'size': 'L_M', 'text': "L - Men's"},
+{'size': 'L_W', 'text': "L - Women's"},
+{'size': 'XL_M', 'text': "XL - Men's"},
+{'size': 'XL_W', 'text': "XL - Women's"},
+{'size': 'XXL_M', 'text': "XXL - Men's"},
+{'size': 'XXL_W', 'text': "XXL - Women's"},
+{'size': 'XXXL_M', 'text': "XXXL - Men's"},
+{'size': 'XXXL_W', 'text': "XXXL - Women's"}
+];
+$scope.init = function () {
+var retrieveProfileCallback = function () {
+$scope.profile = {};
+$scope.loading = true;
+conferenceApi.getProfile().
+execute(function (resp) {
+$scope.$apply(function () {
+$scope.loading = false;
+if (resp.error) {
+} else {
+$scope.profile.displayName = resp.result.displayName;
+$scope.profile.teeShirtSize = resp.result.teeShirtSize;
+$scope.initialProfile = resp.result;
+}
+});
+}
+);
+};
+if (!oauth2Provider.signedIn) {
+var modalInstance = oauth2Provider.showLoginModal();
+modalInstance.result.then(retrieveProfileCallback);
+} else {
+retrieveProfileCallback();
+}
+};
+$scope.saveProfile = function () {
+$scope.submitted = true;
+$scope.loading = true;
+conferenceApi.saveProfile($scope.profile).
+execute(function (resp) {
+$scope.$apply(function () {
+$scope.loading = false;
+if (resp.error) {
+var errorMessage = resp.error.message || '';
+$scope.messages = 'Failed to update a profile : ' + errorMessage;
+$scope.alertStatus = 'warning';
+$log.error($scope.messages + 'Profile : ' + JSON.stringify($scope.profile));
+if (resp.code && resp.code == HTTP_ERRORS.UNAUTHORIZED) {
+oauth2Provider.showLoginModal();
+return;
+}
+} else {
+$scope.messages = 'The profile has been updated';
+$scope.alertStatus = 'success';
+$scope.submitted = false;
+$scope.initialProfile = {
+displayName: $scope.profile.displayName,
+teeShirtSize: $scope.profile.teeShirtSize
+};
+$log.info($scope.messages + JSON.stringify(resp.result));
+}
+});
+});
+};
+})
+;
+conferenceApp.controllers.controller('CreateConferenceCtrl',
+function ($scope, $log, oauth2Provider, conferenceApi, HTTP_ERRORS) {
+$scope.conference = $scope.conference || {};
+$scope.cities = [
+'Chicago',
+'London',
+'Paris',
+'San Francisco',
+'Tokyo'
+];
+$scope.topics = [
+'Medical Innovations',
+'Programming Languages',
+'Web Technologies',
+'Movie Making',
+'Health and Nutrition'
+];
+$scope.isValidMaxAttendees = function () {
+if (!$scope.conference.maxAttendees || $scope.conference.maxAttendees.length == 0) {
+return true;
+}
+return /^[\d]+$/.test($scope.conference.maxAttendees) && $scope.conference.maxAttendees >= 0;
+}
+$scope.isValidDates = function () {
+if (!$scope.conference.startDate && !$scope.conference.endDate) {
+return true;
+}
+if ($scope.conference.startDate && !$scope.conference.endDate) {
+return true;
+}
+return $scope.conference.startDate <= $scope.conference.endDate;
+}
+$scope.isValidConference = function (conferenceForm) {
+return !conferenceForm.$invalid &&
+$scope.isValidMaxAttendees() &&
+$scope.isValidDates();
+}
+$scope.createConference = function (conferenceForm) {
+if (!$scope.isValidConference(conferenceForm)) {
+return;
+}
+$scope.loading = true;
+conferenceApi.createConference($scope.conference).
+execute(function (resp) {
+$scope.$apply(function () {
+$scope.loading = false;
+if (resp.error) {
+var errorMessage = resp.error.message || '';
+$scope.messages = 'Failed to create a conference : ' + errorMessage;
+$scope.alertStatus = 'warning';
+$log.error($scope.messages + ' Conference : ' + JSON.stringify($scope.conference));
+if (resp.code && resp.code == HTTP_ERRORS.UNAUTHORIZED) {
+oauth2Provider.showLoginModal();
+return;
+}
+} else {
+$scope.messages = 'The conference has been created : ' + resp.result.name;
+$scope.alertStatus = 'success';
+$scope.submitted = false;
+$scope.conference = {};
+$log.info($scope.messages + ' : ' + JSON.stringify(resp.result));
+}
+});
+});
+};
+});
+conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $log, oauth2Provider, conferenceApi,
+HTTP_ERRORS) {
+$scope.submitted = false;
+$scope.selectedTab = 'ALL';
+$scope.filters = [
+];
+$scope.filtereableFields = [
+{enumValue: 'CITY', displayName: 'City'},
+{enumValue: 'TOPIC', displayName: 'Topic'},
+{enumValue: 'MONTH', displayName: 'Start month'},
+{enumValue: 'MAX_ATTENDEES', displayName: 'Max Attendees'}
+]
+$scope.operators = [
+{displayName: '=', enumValue: 'EQ'},
+{displayName: '>', enumValue: 'GT'},
+{displayName: '>=', enumValue: 'GTEQ'},
+{displayName: '<', enumValue: 'LT'},
+{displayName: '<=', enumValue: 'LTEQ'},
+{displayName: '!=', enumValue: 'NE'}
+];
+$scope.conferences = [];
+$scope.isOffcanvasEnabled = false;
+$scope.tabAllSelected = function () {
+$scope.selectedTab = 'ALL';
+$scope.queryConferences();
+};
+$scope.tabYouHaveCreatedSelected = function () {
+$scope.selectedTab = 'YOU_HAVE_CREATED';
+if (!oauth2Provider.signedIn) {
+oauth2Provider.showLoginModal();
+return;
+}
+$scope.queryConferences();
+};
+$scope.tabYouWillAttendSelected = function () {
+$scope.selectedTab = 'YOU_WILL_ATTEND';
+if (!oauth2Provider.signedIn) {
+oauth2Provider.showLoginModal();
+return;
+}
+$scope.queryConferences();
+};
+$scope.toggleOffcanvas = function () {
+$scope.isOffcanvasEnabled = !$scope.isOffcanvasEnabled;
+};
+$scope.pagination = $scope.pagination || {};
+$scope.pagination.currentPage = 0;
+$scope.pagination.pageSize = 20;
+$scope.pagination.numberOfPages = function () {
+return Math.ceil($scope.conferences.length / $scope.pagination.pageSize);
+};
+$scope.pagination.pageArray = function () {
+var pages = [];
+var numberOfPages = $scope.pagination.numberOfPages();
+for (var i = 0; i < numberOfPages; i++) {
+pages.push(i);
+}
+return pages;
+};
+$scope.pagination.isDisabled = function (event) {
+return angular.element(event.target).hasClass('disabled');
+}
+$scope.addFilter = function () {
+$scope.filters.push({
+field: $scope.filtereableFields[0],
+operator: $scope.operators[0],
+value: ''
+})
+};
+$scope.clearFilters = function () {
+$scope.filters = [];
+};
+$scope.removeFilter = function (index) {
+if ($scope.filters[index]) {
+$scope.filters.splice(index, 1);
+}
+};
+$scope.queryConferences = function () {
+$scope.submitted = false;
+if ($scope.selectedTab == 'ALL') {
+$scope.queryConferencesAll();
+} else if ($scope.selectedTab == 'YOU_HAVE_CREATED') {
+$scope.getConferencesCreated();
+} else if ($scope.selectedTab == 'YOU_WILL_ATTEND') {
+$scope.getConferencesAttend();
+}
+};
+$scope.queryConferencesAll = function () {
+var sendFilters = {
+filters: []
+}
+for (var i = 0; i < $scope.filters.length; i++) {
+var filter = $scope.filters[i];
+if (filter.field && filter.operator && filter.value) {
+sendFilters.filters.push({
+field: filter.field.enumValue,
+operator: filter.operator.enumValue,
+value: filter.value
+});
+}
+}
+$scope.loading = true;
+conferenceApi.queryConferences(sendFilters).
+execute(function (resp) {
+$scope.$apply(function () {
+$scope.loading = false;
+if (resp.error) {
+var errorMessage = resp.error.message || '';
+$scope.messages = 'Failed to query conferences : ' + errorMessage;
+$scope.alertStatus = 'warning';
+$log.error($scope.messages + ' filters : ' + JSON.stringify(sendFilters));
+} else {
+$scope.submitted = false;
+$scope.messages = 'Query succeeded : ' + JSON.stringify(sendFilters);
+$scope.alertStatus = 'success';
+$log.info($scope.messages);
+$scope.conferences = [];
+angular.forEach(resp.items, function (conference) {
+$scope.conferences.push(conference);
+});
+}
+$scope.submitted = true;
+});
+});
+}
+$scope.getConferencesCreated = function () {
+$scope.loading = true;
+conferenceApi.getConferencesCreated().
+execute(function (resp) {
+$scope.$apply(function () {
+$scope.loading = false;
+if (resp.error) {
+var errorMessage = resp.error.message || '';
+$scope.messages = 'Failed to query the conferences created : ' + errorMessage;
+$scope.alertStatus = 'warning';
+$log.error($scope.messages);
+if (resp.code && resp.code == HTTP_ERRORS.UNAUTHORIZED) {
+oauth2Provider.showLoginModal();
+return;
+}
+} else {
+$scope.submitted = false;
+$scope.messages = 'Query succeeded : Conferences you have created';
+$scope.alertStatus = 'success';
+$log.info($scope.messages);
+$scope.conferences = [];
+angular.forEach(resp.items, function (conference) {
+$scope.conferences.push(conference);
+});
+}
+$scope.submitted = true;
+});
+});
+};
+$scope.getConferencesAttend = function () {
+$scope.loading = true;
+conferenceApi.getConferencesToAttend().
+execute(function (resp) {
+$scope.$apply(function () {
+if (resp.error) {
+var errorMessage = resp.error.message || '';
+$scope.messages = 'Failed to query the conferences to attend : ' + errorMessage;
+$scope.alertStatus = 'warning';
+$log.error($scope.messages);
+if (resp.code && resp.code == HTTP_ERRORS.UNAUTHORIZED) {
+oauth2Provider.showLoginModal();
+return;
+}
+} else {
+$scope.conferences = resp.result.items;
+$scope.loading = false;
+$scope.messages = 'Query succeeded : Conferences you will attend (or you have attended)';
+$scope.alertStatus = 'success';
+$log.info($scope.messages);
+}
+$scope.submitted = true;
+});
+});
+};
+});
+conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $log, $routeParams, oauth2Provider,
+conferenceApi, HTTP_ERRORS) {
+$scope.conference = {};
+$scope.isUserAttending = false;
+$scope.sessions = [];
+$scope.featuredSpeaker = '';
+$scope.init = function () {
+$scope.loading = true;
+conferenceApi.getConferenceDetail({
+websafeConferenceKey: $routeParams.websafeConferenceKey
+}).execute(function (resp) {
+$scope.$apply(function () {
+$scope.loading = false;
+if (resp.error) {
+var errorMessage = resp.error.message || '';
+$scope.messages = 'Failed to get the conference : ' + $routeParams.websafeKey
++ ' ' + errorMessage;
+$scope.alertStatus = 'warning';
+$log.error($scope.messages);
+} else {
+$scope.alertStatus = 'success';
+$scope.conference = resp.result.conference;
+$scope.sessions = resp.result.sessions || [];
+$scope.featuredSpeaker = resp.result.featuredSpeaker || '';
+if (resp.result.isRegistered) {
+$scope.alertStatus = 'info';
+$scope.messages = 'You are attending this conference';
+$scope.isUserAttending = true;
+}
+}
+});
+});
+};
+$scope.registerForConference = function () {
+$scope.loading = true;
+conferenceApi.registerForConference({
+websafeConferenceKey: $routeParams.websafeConferenceKey
+}).execute(function (resp) {
+$scope.$apply(function () {
+$scope.loading = false;
+if (resp.error) {
+var errorMessage = resp.error.message || '';
+$scope.messages = 'Failed to register for the conference : ' + errorMessage;
+$scope.alertStatus = 'warning';
+$log.error($scope.messages);
+if (resp.code && resp.code == HTTP_ERRORS.UNAUTHORIZED) {
+oauth2Provider.showLoginModal();
+return;
+}
+} else {
+if (resp.result && resp.result.waitlistPosition) {
+$scope.messages = 'The conference is full. You are number ' +
+resp.result.waitlistPosition + ' on the waitlist';
+$scope.alertStatus = 'info';
+} else if (resp.result) {
+$scope.messages = 'Registered for the conference';
+$scope.alertStatus = 'success';
+$scope.isUserAttending = true;
+$scope.conference.seatsAvailable = $scope.conference.seatsAvailable - 1;
+} else {
+$scope.messages = 'Failed to register for the conference';
+$scope.alertStatus = 'warning';
+}
+}
+});
+});
+};
+$scope.unregisterFromConference = function () {
+$scope.loading = true;
+conferenceApi.unregisterFromConference({
+websafeConferenceKey: $routeParams.websafeConferenceKey
+}).execute(function (resp) {
+$scope.$apply(function () {
+$scope.loading = false;
+if (resp.error) {
+var errorMessage = resp.error.message || '';
+$scope.messages = 'Failed to unregister from the conference : ' + errorMessage;
+$scope.alertStatus = 'warning';
+$log.error($scope.messages);
+if (resp.code && resp.code == HTTP_ERRORS.UNAUTHORIZED) {
+oauth2Provider.showLoginModal();
+return;
+}
+} else {
+if (resp.result) {
+$scope.messages = 'Unregistered from the conference';
+$scope.alertStatus = 'success';
+$scope.conference.seatsAvailable = $scope.conference.seatsAvailable + 1;
+$scope.isUserAttending = false;
+$log.info($scope.messages);
+} else {
+var errorMessage = resp.error.message || '';
+$scope.messages = 'Failed to unregister from the conference : ' + $routeParams.websafeKey +
+' : ' + errorMessage;
+$scope.messages = 'Failed to unregister from the conference';
+$scope.alertStatus = 'warning';
+$log.error($scope.messages);
+}
+}
+});
+});
+};
+});
+conferenceApp.controllers.controller('RootCtrl', function ($scope, $location, oauth2Provider) {
+$scope.isActive = function (viewLocation) {
+return viewLocation === $location.path();
+};
+$scope.getSignedInState = function () {
+return oauth2Provider.signedIn;
+};
+$scope.signIn = function () {
+oauth2Provider.signIn(function () {
+gapi.client.oauth2.userinfo.get().execute(function (resp) {
+$scope.$apply(function () {
+if (resp.email) {
+oauth2Provider.signedIn = true;
+$scope.alertStatus = 'success';
+$scope.rootMessages = 'Logged in with ' + resp.email;
+}
+});
+});
+});
+};
+$scope.initSignInButton = function () {
+gapi.signin.render('signInButton', {
+'callback': function () {
+jQuery('#signInButton button').attr('disabled', 'true').css('cursor', 'default');
+if (gapi.auth.getToken() && gapi.auth.getToken().access_token) {
+$scope.$apply(function () {
+oauth2Provider.signedIn = true;
+});
+}
+},
+'clientid': oauth2Provider.CLIENT_ID,
+'cookiepolicy': 'single_host_origin',
+'scope': oauth2Provider.SCOPES
+});
+};
+$scope.signOut = function () {
+oauth2Provider.signOut();
+$scope.alertStatus = 'success';
+$scope.rootMessages = 'Logged out';
+};
+$scope.collapseNavbar = function () {
+angular.element(document.querySelector('.navbar-collapse')).removeClass('in');
+};
+});
+conferenceApp.controllers.controller('OAuth2LoginModalCtrl',
+function ($scope, $modalInstance, $rootScope, oauth2Provider) {
+$scope.singInViaModal = function () {
+oauth2Provider.signIn(function () {
+gapi.client.oauth2.userinfo.get().execute(function (resp) {
+$scope.$root.$apply(function () {
+oauth2Provider.signedIn = true;
+$scope.$root.alertStatus = 'success';
+$scope.$root.rootMessages = 'Logged in with ' + resp.email;
+});
+$modalInstance.close();
+});
+});
+};
+});
+conferenceApp.controllers.controller('DatepickerCtrl', function ($scope) {
+$scope.today = function () {
+$scope.dt = new Date();
+};
+$scope.today();
+$scope.clear = function () {
+$scope.dt = null;
+};
+$scope.disabled = function (date, mode) {
+return ( mode === 'day' && ( date.getDay() === 0 || date.getDay() === 6 ) );
+};
+$scope.toggleMin = function () {
+$scope.minDate = ( $scope.minDate ) ? null : new Date();
+};
+$scope.toggleMin();
+$scope.open = function ($event) {
+$event.preventDefault();
+$event.stopPropagation();
+$scope.opened = true;
+};
+$scope.dateOptions = {
+'year-format': "'yy'",
+'starting-day': 1
+};
+$scope.formats = ['dd-MMMM-yyyy', 'yyyy/MM/dd', 'shortDate'];
+$scope.format = $scope.formats[0];
+});
+;
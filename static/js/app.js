@@ -130,3 +130,192 @@ app.factory('oauth2Provider', function ($modal) {
 
     return oauth2Provider;
 });
+
+
+/**
+ * @ngdoc service
+ * @name conferenceApi
+ *
+ * @description
+ * Wraps gapi.client.conference for the controllers, with the same request.execute(callback) interface.
+ * Identical reads made while one is in flight share its response, and successful reads are cached for
+ * READ_TTL_MS[method]. Each write marks the cached reads it can change as stale (INVALIDATES[method]), and
+ * the cache is cleared whenever the signed-in user changes. A stale or expired read of ETAG_METHODS is
+ * revalidated: its etag goes as ifNoneMatch, and a notModified answer reuses the cached response.
+ *
+ */
+app.factory('conferenceApi', function ($log) {
+    /**
+     * How long a successful response of each cached read is reused, in milliseconds.
+     * @type {{}}
+     */
+    var READ_TTL_MS = {
+        getProfile: 5 * 60 * 1000,
+        getConferencesCreated: 60 * 1000,
+        getConferencesToAttend: 60 * 1000,
+        getConferenceDetail: 30 * 1000,
+        queryConferences: 30 * 1000
+    };
+
+    /**
+     * The cached reads whose responses carry an etag the API can answer notModified to.
+     * @type {{}}
+     */
+    var ETAG_METHODS = {
+        getProfile: true,
+        getConferencesCreated: true,
+        getConferencesToAttend: true,
+        queryConferences: true
+    };
+
+    /**
+     * The cached reads each write makes stale. A method name marks every cached response of that method,
+     * a {method, params} object the one for those params.
+     * @type {{}}
+     */
+    var INVALIDATES = {
+        saveProfile: function () {
+            return ['getProfile'];
+        },
+        createConference: function () {
+            return ['queryConferences', 'getConferencesCreated'];
+        },
+        registerForConference: registrationInvalidates,
+        unregisterFromConference: registrationInvalidates
+    };
+
+    // (un)registering changes the profile, the attending list and the seats shown by every list
+    function registrationInvalidates(params) {
+        return ['getProfile', 'getConferencesToAttend', 'getConferencesCreated', 'queryConferences',
+            {method: 'getConferenceDetail', params: {websafeConferenceKey: params.websafeConferenceKey}}];
+    }
+
+    var cache = {};      // key -> {expires: ms, resp: response}; kept once expired, for its etag
+    var inFlight = {};   // key -> callbacks waiting for the read in flight
+    var generation = 0;  // bumped by every invalidation; reads started before one aren't cached
+    var accessToken = null;
+    var stats = {requests: 0, cacheHits: 0, coalesced: 0, notModified: 0};
+
+    /**
+     * JSON with object keys sorted, so equal params give equal cache keys.
+     */
+    function stableStringify(value) {
+        if (angular.isArray(value)) {
+            return '[' + value.map(stableStringify).join(',') + ']';
+        }
+        if (angular.isObject(value) && !angular.isDate(value)) {
+            return '{' + Object.keys(value).sort().map(function (key) {
+                return JSON.stringify(key) + ':' + stableStringify(value[key]);
+            }).join(',') + '}';
+        }
+        return JSON.stringify(value);
+    }
+
+    function cacheKey(method, params) {
+        return method + ':' + stableStringify(params || {});
+    }
+
+    function clear() {
+        cache = {};
+        inFlight = {};
+        generation++;
+    }
+
+    function checkUser() {
+        var token = gapi.auth.getToken();
+        token = (token && token.access_token) || '';
+        if (token !== accessToken) {
+            clear();
+            accessToken = token;
+        }
+    }
+
+    function invalidate(targets) {
+        generation++;
+        angular.forEach(targets, function (target) {
+            var keys = angular.isString(target) ?
+                Object.keys(cache).concat(Object.keys(inFlight)).filter(function (key) {
+                    return key.indexOf(target + ':') === 0;
+                }) :
+                [cacheKey(target.method, target.params)];
+            angular.forEach(keys, function (key) {
+                // stale entries stay for their etag, to be revalidated by the next read
+                if (cache[key]) {
+                    cache[key].expires = 0;
+                }
+                delete inFlight[key];
+            });
+        });
+    }
+
+    function read(method, params, callback) {
+        checkUser();
+        var key = cacheKey(method, params);
+        var hit = cache[key];
+        if (hit && hit.expires > Date.now()) {
+            stats.cacheHits++;
+            $log.debug('conferenceApi cache hit: ' + key);
+            // callers wrap their callback in $scope.$apply, so call back outside the digest as gapi does
+            setTimeout(function () {
+                callback(angular.copy(hit.resp));
+            }, 0);
+            return;
+        }
+        if (inFlight[key]) {
+            stats.coalesced++;
+            inFlight[key].push(callback);
+            return;
+        }
+        var waiting = inFlight[key] = [callback];
+        var started = generation;
+        var request = params;
+        if (hit && ETAG_METHODS[method] && hit.resp.etag) {
+            // ifNoneMatch stays out of the cache key
+            request = angular.extend({}, params, {ifNoneMatch: hit.resp.etag});
+        }
+        stats.requests++;
+        gapi.client.conference[method](request).execute(function (resp) {
+            if (inFlight[key] === waiting) {
+                delete inFlight[key];
+            }
+            if (!resp.error && resp.notModified) {
+                stats.notModified++;
+                resp = hit.resp;
+            }
+            if (!resp.error && started === generation) {
+                cache[key] = {expires: Date.now() + READ_TTL_MS[method], resp: resp};
+            }
+            // each caller gets its own copy, so none can change the cached response
+            angular.forEach(waiting, function (waitingCallback) {
+                waitingCallback(angular.copy(resp));
+            });
+        });
+    }
+
+    function write(method, params, callback) {
+        checkUser();
+        stats.requests++;
+        gapi.client.conference[method](params).execute(function (resp) {
+            // even a failed write may have been applied, so always invalidate
+            invalidate(INVALIDATES[method](params || {}));
+            callback(resp);
+        });
+    }
+
+    var conferenceApi = {clear: clear, stats: stats};
+    angular.forEach(READ_TTL_MS, function (ttl, method) {
+        conferenceApi[method] = function (params) {
+            return {execute: function (callback) {
+                read(method, params, callback);
+            }};
+        };
+    });
+    angular.forEach(INVALIDATES, function (targets, method) {
+        conferenceApi[method] = function (params) {
+            return {execute: function (callback) {
+                write(method, params, callback);
+            }};
+        };
+    });
+    return conferenceApi;
+});
@@ -25,7 +25,7 @@ conferenceApp.controllers = angular.module('conferenceControllers', ['ui.bootstr
  * A controller used for the My Profile page.
  */
 conferenceApp.controllers.controller('MyProfileCtrl',
-    function ($scope, $log, oauth2Provider, HTTP_ERRORS) {
+    function ($scope, $log, oauth2Provider, conferenceApi, HTTP_ERRORS) {
         $scope.submitted = false;
         $scope.loading = false;
 
@@ -63,7 +63,7 @@ conferenceApp.controllers.controller('MyProfileCtrl',
             var retrieveProfileCallback = function () {
                 $scope.profile = {};
                 $scope.loading = true;
-                gapi.client.conference.getProfile().
+                conferenceApi.getProfile().
                     execute(function (resp) {
                         $scope.$apply(function () {
                             $scope.loading = false;
@@ -94,7 +94,7 @@ conferenceApp.controllers.controller('MyProfileCtrl',
         $scope.saveProfile = function () {
             $scope.submitted = true;
             $scope.loading = true;
-            gapi.client.conference.saveProfile($scope.profile).
+            conferenceApi.saveProfile($scope.profile).
                 execute(function (resp) {
                     $scope.$apply(function () {
                         $scope.loading = false;
@@ -135,7 +135,7 @@ conferenceApp.controllers.controller('MyProfileCtrl',
  * A controller used for the Create conferences page.
  */
 conferenceApp.controllers.controller('CreateConferenceCtrl',
-    function ($scope, $log, oauth2Provider, HTTP_ERRORS) {
+    function ($scope, $log, oauth2Provider, conferenceApi, HTTP_ERRORS) {
 
         /**
          * The conference object being edited in the page.
@@ -214,7 +214,7 @@ conferenceApp.controllers.controller('CreateConferenceCtrl',
             }
 
             $scope.loading = true;
-            gapi.client.conference.createConference($scope.conference).
+            conferenceApi.createConference($scope.conference).
                 execute(function (resp) {
                     $scope.$apply(function () {
                         $scope.loading = false;
@@ -249,7 +249,8 @@ conferenceApp.controllers.controller('CreateConferenceCtrl',
  * @description
  * A controller used for the Show conferences page.
  */
-conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $log, oauth2Provider, HTTP_ERRORS) {
+conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $log, oauth2Provider, conferenceApi,
+                                                                     HTTP_ERRORS) {
 
     /**
      * Holds the status if the query is being executed.
@@ -441,7 +442,7 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
             }
         }
         $scope.loading = true;
-        gapi.client.conference.queryConferences(sendFilters).
+        conferenceApi.queryConferences(sendFilters).
             execute(function (resp) {
                 $scope.$apply(function () {
                     $scope.loading = false;
@@ -473,7 +474,7 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.getConferencesCreated = function () {
         $scope.loading = true;
-        gapi.client.conference.getConferencesCreated().
+        conferenceApi.getConferencesCreated().
             execute(function (resp) {
                 $scope.$apply(function () {
                     $scope.loading = false;
@@ -511,7 +512,7 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.getConferencesAttend = function () {
         $scope.loading = true;
-        gapi.client.conference.getConferencesToAttend().
+        conferenceApi.getConferencesToAttend().
             execute(function (resp) {
                 $scope.$apply(function () {
                     if (resp.error) {
@@ -547,19 +548,25 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
  * @description
  * A controller used for the conference detail page.
  */
-conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $log, $routeParams, HTTP_ERRORS) {
+conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $log, $routeParams, oauth2Provider,
+                                                                       conferenceApi, HTTP_ERRORS) {
     $scope.conference = {};
 
     $scope.isUserAttending = false;
 
+    $scope.sessions = [];
+
+    $scope.featuredSpeaker = '';
+
     /**
      * Initializes the conference detail page.
-     * Invokes the conference.getConference method and sets the returned conference in the $scope.
+     * Invokes the conference.getConferenceDetail method, which returns the conference, its sessions,
+     * the featured speaker and whether the user is attending in a single request.
      *
      */
     $scope.init = function () {
         $scope.loading = true;
-        gapi.client.conference.getConference({
+        conferenceApi.getConferenceDetail({
             websafeConferenceKey: $routeParams.websafeConferenceKey
         }).execute(function (resp) {
             $scope.$apply(function () {
@@ -574,27 +581,14 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
                 } else {
                     // The request has succeeded.
                     $scope.alertStatus = 'success';
-                    $scope.conference = resp.result;
-                }
-            });
-        });
-
-        $scope.loading = true;
-        // If the user is attending the conference, updates the status message and available function.
-        gapi.client.conference.getProfile().execute(function (resp) {
-            $scope.$apply(function () {
-                $scope.loading = false;
-                if (resp.error) {
-                    // Failed to get a user profile.
-                } else {
-                    var profile = resp.result;
-                    for (var i = 0; i < profile.conferenceKeysToAttend.length; i++) {
-                        if ($routeParams.websafeConferenceKey == profile.conferenceKeysToAttend[i]) {
-                            // The user is attending the conference.
-                            $scope.alertStatus = 'info';
-                            $scope.messages = 'You are attending this conference';
-                            $scope.isUserAttending = true;
-                        }
+                    $scope.conference = resp.result.conference;
+                    $scope.sessions = resp.result.sessions || [];
+                    $scope.featuredSpeaker = resp.result.featuredSpeaker || '';
+                    if (resp.result.isRegistered) {
+                        // The user is attending the conference.
+                        $scope.alertStatus = 'info';
+                        $scope.messages = 'You are attending this conference';
+                        $scope.isUserAttending = true;
                     }
                 }
             });
@@ -607,7 +601,7 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
      */
     $scope.registerForConference = function () {
         $scope.loading = true;
-        gapi.client.conference.registerForConference({
+        conferenceApi.registerForConference({
             websafeConferenceKey: $routeParams.websafeConferenceKey
         }).execute(function (resp) {
             $scope.$apply(function () {
@@ -624,7 +618,12 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
                         return;
                     }
                 } else {
-                    if (resp.result) {
+                    if (resp.result && resp.result.waitlistPosition) {
+                        // The conference is full; the user was waitlisted.
+                        $scope.messages = 'The conference is full. You are number ' +
+                            resp.result.waitlistPosition + ' on the waitlist';
+                        $scope.alertStatus = 'info';
+                    } else if (resp.result) {
                         // Register succeeded.
                         $scope.messages = 'Registered for the conference';
                         $scope.alertStatus = 'success';
@@ -644,7 +643,7 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
      */
     $scope.unregisterFromConference = function () {
         $scope.loading = true;
-        gapi.client.conference.unregisterFromConference({
+        conferenceApi.unregisterFromConference({
             websafeConferenceKey: $routeParams.websafeConferenceKey
         }).execute(function (resp) {
             $scope.$apply(function () {
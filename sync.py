@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+"""
+sync.py -- Udacity conference server-side Python App Engine
+    delta sync of Conferences, Sessions & Speakers for offline clients
+
+Conference, Session & Speaker carry an indexed lastModified stamp, and
+deleting a Conference or Session leaves a Tombstone (stamped the same
+way). A sync walks those kinds in SYNC_KINDS order, each by lastModified
+> the client's watermark, a page at a time: the page token holds the
+kind & cursor reached plus the watermark the client is to keep once the
+last page is in. That watermark is taken SYNC_OVERLAP before the sync
+started, since lastModified is set before a put commits and global
+queries are eventually consistent; the entities seen twice as a result
+are simply sent again.
+
+Tombstones are purged after TOMBSTONE_DAYS, so a client whose watermark
+is older than that is told to resync from scratch.
+
+"""
+
+import base64
+import json
+from datetime import datetime
+from datetime import timedelta
+
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import Session
+from models import Speaker
+from models import Tombstone
+
+SYNC_KINDS = (Conference, Session, Speaker, Tombstone)
+SYNC_PAGE_SIZE = 100
+SYNC_OVERLAP = timedelta(seconds=60)
+TOMBSTONE_DAYS = 30
+PURGE_BATCH_SIZE = 500
+WATERMARK_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def tombstones(keys):
+    """Return the Tombstones to put for deleting the entities of keys."""
+    return [Tombstone(id=key.urlsafe(), kind=key.kind()) for key in keys]
+
+
+def _formatWatermark(dt):
+    return dt.strftime(WATERMARK_FORMAT)
+
+
+def _parseWatermark(watermark):
+    return datetime.strptime(watermark, WATERMARK_FORMAT)
+
+
+class SyncState(object):
+    """Where a sync is: the next kind & cursor to read, the watermark it
+    reads from (None for everything) and the one to hand the client."""
+
+    def __init__(self, phase, since, watermark, cursor=None):
+        self.phase = phase
+        self.since = since
+        self.watermark = watermark
+        self.cursor = cursor
+
+    @classmethod
+    def start(cls, since=None):
+        """Return the state of a new sync from the watermark since, or
+        None if its tombstones may be gone and the client must resync.
+        Raises ValueError for a malformed watermark."""
+        now = datetime.utcnow()
+        since = _parseWatermark(since) if since else None
+        if since and since < now - timedelta(days=TOMBSTONE_DAYS):
+            return None
+        return cls(0, since, _formatWatermark(now - SYNC_OVERLAP))
+
+    @classmethod
+    def fromPageToken(cls, token):
+        """Return the state a pageToken was made from; raises ValueError
+        if it is malformed."""
+        try:
+            state = json.loads(base64.urlsafe_b64decode(str(token)))
+            return cls(int(state['phase']),
+                       _parseWatermark(state['since']) if state['since'] else None,
+                       state['watermark'],
+                       Cursor(urlsafe=state['cursor']) if state['cursor'] else None)
+        except Exception:
+            # bad base64 or JSON, a missing field or a corrupt cursor
+            raise ValueError('Invalid pageToken: %s' % token)
+
+    def pageToken(self):
+        return base64.urlsafe_b64encode(json.dumps({
+            'phase': self.phase,
+            'since': _formatWatermark(self.since) if self.since else None,
+            'watermark': self.watermark,
+            'cursor': self.cursor.urlsafe() if self.cursor else None,
+        }))
+
+    def nextPage(self, limit):
+        """Return ({kind: [entity, ...]}, the state of the next page or
+        None if this is the last) for up to limit changed entities."""
+        changed = dict((model._get_kind(), []) for model in SYNC_KINDS)
+        phase, cursor = self.phase, self.cursor
+        while phase < len(SYNC_KINDS) and limit > 0:
+            model = SYNC_KINDS[phase]
+            if model is Tombstone and not self.since:
+                # a client syncing everything has nothing to delete
+                phase += 1
+                continue
+            query = model.query()
+            if self.since:
+                query = query.filter(model.lastModified > self.since)
+            entities, next_cursor, more = query.order(
+                model.lastModified).fetch_page(limit, start_cursor=cursor)
+            changed[model._get_kind()].extend(entities)
+            limit -= len(entities)
+            if more and next_cursor:
+                cursor = next_cursor
+                break
+            phase += 1
+            cursor = None
+        if phase >= len(SYNC_KINDS):
+            return changed, None
+        return changed, SyncState(phase, self.since, self.watermark, cursor)
+
+
+def purgeTombstones():
+    """Delete the Tombstones older than TOMBSTONE_DAYS; returns how many."""
+    query = Tombstone.query(Tombstone.lastModified <
+                            datetime.utcnow() - timedelta(days=TOMBSTONE_DAYS))
+    purged = 0
+    cursor = None
+    more = True
+    while more:
+        keys, cursor, more = query.fetch_page(
+            PURGE_BATCH_SIZE, start_cursor=cursor, keys_only=True)
+        ndb.delete_multi(keys)
+        purged += len(keys)
+        more = more and cursor is not None
+    return purged
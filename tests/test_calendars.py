@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+"""
+test_calendars.py -- wishlist feed URLs carry a signed opaque ID, and
+no feed is served while CALENDAR_FEED_SECRET is the placeholder
+
+"""
+
+# testbase puts the SDK on sys.path, so comes first
+from testbase import AppTestCase  # noqa
+
+import base64
+import unittest
+
+import calendars
+import conference
+import main
+
+USER = 'user@example.com'
+
+
+class WishlistFeedTest(AppTestCase):
+
+    def setUp(self):
+        super(WishlistFeedTest, self).setUp()
+        self.secret = calendars.CALENDAR_FEED_SECRET
+        calendars.CALENDAR_FEED_SECRET = 'a long random test secret'
+        self.signIn(USER)
+
+    def tearDown(self):
+        calendars.CALENDAR_FEED_SECRET = self.secret
+        super(WishlistFeedTest, self).tearDown()
+
+    def feedUrl(self):
+        return self.call('getWishlistCalendarUrl').data
+
+    def getFeed(self, token):
+        return main.app.get_response(calendars.WISHLIST_FEED_URL % token)
+
+    def token(self, url):
+        return url.rsplit('/', 1)[1][:-len('.ics')]
+
+    def testURLServesTheUsersFeed(self):
+        url = self.feedUrl()
+        self.assertEqual(self.feedUrl(), url)
+        token = self.token(url)
+        self.assertNotIn(base64.urlsafe_b64encode(USER).rstrip('='), token)
+        response = self.getFeed(token)
+        self.assertEqual(response.status_int, 200)
+        self.assertIn('BEGIN:VCALENDAR', response.body)
+
+    def testForgedTokensAreRefused(self):
+        feed_id = self.token(self.feedUrl()).split('.')[0]
+        self.assertEqual(self.getFeed(feed_id + '.' + '0' * 32).status_int,
+                         404)
+        # tokens for another ID don't resolve, even signed
+        self.assertEqual(self.getFeed(calendars.feedToken(USER)).status_int,
+                         404)
+
+    def testNonAsciiTokensAreUnknown(self):
+        self.feedUrl()
+        self.assertEqual(self.getFeed('%C3%A9').status_int, 404)
+        self.assertIsNone(calendars.feedIdFromToken('\xc3\xa9'))
+        self.assertIsNone(calendars.feedIdFromToken(u'\xe9'))
+
+    def testPlaceholderSecretServesNothing(self):
+        token = self.token(self.feedUrl())
+        calendars.CALENDAR_FEED_SECRET = calendars.PLACEHOLDER_SECRET
+        self.assertEqual(self.getFeed(token).status_int, 404)
+        self.assertEqual(self.getFeed(calendars.feedToken(token.split('.')[0]))
+                         .status_int, 404)
+        with self.assertRaises(Exception) as raised:
+            self.feedUrl()
+        self.assertIn('not configured', str(raised.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+
+"""
+test_conference.py -- ConferenceApi handlers that fetch & write in
+parallel return what they did when each RPC waited on the last, and
+batch reads answer for keys that don't resolve
+
+"""
+
+# testbase puts the SDK on sys.path, so comes first
+from testbase import AppTestCase  # noqa
+
+import base64
+import json
+import unittest
+
+from google.appengine.api import datastore_errors
+from google.appengine.ext import ndb
+
+import conference
+from announcements import CONFIRMATION_EMAIL_QUEUE
+from announcements import setFeaturedSpeaker
+from models import Conference
+from models import ConferenceForm
+from models import Profile
+from models import RateLimitedException
+from settings import RATE_LIMITS
+
+ORGANIZER = 'organizer@example.com'
+ATTENDEE = 'attendee@example.com'
+
+
+class ConferenceTestCase(AppTestCase):
+
+    def setUp(self):
+        super(ConferenceTestCase, self).setUp()
+        self.signIn(ORGANIZER)
+        # the organizer's profile (displayName: their nickname, here the
+        # email) must exist before they create sessions
+        self.call('getProfile', conference.ETAG_GET_REQUEST)
+
+    def createConference(self, **fields):
+        fields.setdefault('name', 'PyCon')
+        self.call('createConference', ConferenceForm, **fields)
+        conf = Conference.query(Conference.name == fields['name']).get()
+        return conf.key.urlsafe()
+
+    def confirmationTasks(self):
+        return self.taskqueue.GetTasks(CONFIRMATION_EMAIL_QUEUE)
+
+
+class CreateConferenceTest(ConferenceTestCase):
+
+    def testCreateStoresConferenceAndQueuesConfirmation(self):
+        wsck = self.createConference(city='London', maxAttendees=10,
+                                     startDate='2026-06-01')
+        cf = self.call('getConference', conference.CONF_ETAG_GET_REQUEST,
+                       websafeConferenceKey=wsck)
+        self.assertEqual(cf.name, 'PyCon')
+        self.assertEqual(cf.city, 'London')
+        self.assertEqual(cf.seatsAvailable, 10)
+        self.assertEqual(cf.month, 6)
+        self.assertEqual(cf.organizerUserId, ORGANIZER)
+        self.assertEqual(cf.organizerDisplayName, ORGANIZER)
+        tasks = self.confirmationTasks()
+        self.assertEqual(len(tasks), 1)
+        # confirmations are deduplicated on the conference's key
+        payload = json.loads(base64.b64decode(tasks[0]['body']))
+        self.assertEqual(payload['websafeConferenceKey'], wsck)
+        self.assertEqual(payload['email'], ORGANIZER)
+
+    def testDefaultsAreFilledIn(self):
+        cf = self.call('createConference', ConferenceForm, name='Bare')
+        self.assertEqual(cf.city, 'Default City')
+        self.assertEqual(cf.topics, ['Default', 'Topic'])
+        self.assertEqual(cf.organizerUserId, ORGANIZER)
+
+    def testFailedPutQueuesNoConfirmation(self):
+        def failPut(conf):
+            raise datastore_errors.Timeout()
+        Conference._pre_put_hook = failPut
+        try:
+            with self.assertRaises(datastore_errors.Timeout):
+                self.call('createConference', ConferenceForm, name='Lost')
+        finally:
+            del Conference._pre_put_hook
+        self.assertEqual(Conference.query().count(), 0)
+        self.assertEqual(self.confirmationTasks(), [])
+
+    def testNameIsRequired(self):
+        with self.assertRaises(Exception) as raised:
+            self.call('createConference', ConferenceForm, city='London')
+        self.assertIn("'name' field required", str(raised.exception))
+
+
+class ReadConferenceTest(ConferenceTestCase):
+
+    def testUpdateConference(self):
+        wsck = self.createConference(city='London', startDate='2026-06-01')
+        cf = self.call('updateConference', conference.CONF_POST_REQUEST,
+                       websafeConferenceKey=wsck, city='Paris',
+                       startDate='2026-09-01')
+        self.assertEqual(cf.city, 'Paris')
+        self.assertEqual(cf.month, 9)
+        self.assertEqual(cf.organizerDisplayName, ORGANIZER)
+        self.assertEqual(Conference.query().get().city, 'Paris')
+
+    def testOnlyTheOwnerCanUpdate(self):
+        wsck = self.createConference()
+        self.signIn(ATTENDEE)
+        with self.assertRaises(Exception) as raised:
+            self.call('updateConference', conference.CONF_POST_REQUEST,
+                      websafeConferenceKey=wsck, city='Paris')
+        self.assertIn('Only the owner', str(raised.exception))
+
+    def testConferencesToAttend(self):
+        wscks = [self.createConference(name=name, maxAttendees=5)
+                 for name in ('A', 'B', 'C')]
+        self.signIn(ATTENDEE)
+        for wsck in wscks[:2]:
+            self.call('registerForConference', conference.CONF_GET_REQUEST,
+                      websafeConferenceKey=wsck)
+        cfs = self.call('getConferencesToAttend', conference.ETAG_GET_REQUEST)
+        self.assertEqual([cf.name for cf in cfs.items], ['A', 'B'])
+        self.assertEqual([cf.organizerDisplayName for cf in cfs.items],
+                         [ORGANIZER, ORGANIZER])
+
+
+class SeatAvailabilityTest(ConferenceTestCase):
+
+    def seats(self, wscks):
+        forms = self.call('getSeatAvailability',
+                          conference.CONF_KEYS_GET_REQUEST,
+                          websafeConferenceKey=wscks).items
+        return [(sf.websafeConferenceKey, sf.seatsAvailable) for sf in forms]
+
+    def testUnresolvedKeysHaveNoSeats(self):
+        wsck = self.createConference(maxAttendees=10)
+        gone = ndb.Key(Conference, 'gone', parent=ndb.Key(Profile, ORGANIZER))
+        profile = ndb.Key(Profile, ORGANIZER).urlsafe()
+        wscks = [wsck, 'not-a-key', gone.urlsafe(), profile, wsck]
+        self.assertEqual(self.seats(wscks), [
+            (wsck, 10), ('not-a-key', None), (gone.urlsafe(), None),
+            (profile, None), (wsck, 10)])
+        # and again from memcache
+        self.assertEqual(self.seats(wscks)[0], (wsck, 10))
+
+    def testTooManyKeys(self):
+        with self.assertRaises(Exception) as raised:
+            self.seats(['key%d' % i
+                        for i in range(conference.MAX_BATCH_KEYS + 1)])
+        self.assertIn('At most', str(raised.exception))
+
+
+class FeaturedSpeakerTest(ConferenceTestCase):
+
+    def featured(self, wscks):
+        forms = self.call('getFeaturedSpeakers',
+                          conference.CONF_KEYS_GET_REQUEST,
+                          websafeConferenceKey=wscks).items
+        return [(fsf.websafeConferenceKey, fsf.data) for fsf in forms]
+
+    def testUnresolvedKeysHaveNoData(self):
+        wsck = self.createConference()
+        plain = self.createConference(name='Plain')
+        text = setFeaturedSpeaker(wsck, 'Ada', 'Intro, Deep dive')
+        profile = ndb.Key(Profile, ORGANIZER).urlsafe()
+        self.assertEqual(
+            self.featured([wsck, 'not-a-key', plain, profile, wsck]),
+            [(wsck, text), ('not-a-key', None), (plain, ''),
+             (profile, None), (wsck, text)])
+
+    def testTooManyKeys(self):
+        with self.assertRaises(Exception) as raised:
+            self.featured(['key%d' % i
+                           for i in range(conference.MAX_BATCH_KEYS + 1)])
+        self.assertIn('At most', str(raised.exception))
+
+    def testMalformedKeyIsNotFound(self):
+        with self.assertRaises(Exception) as raised:
+            self.call('getFeaturedSpeaker', conference.CONF_GET_REQUEST,
+                      websafeConferenceKey='not-a-key')
+        self.assertIn('No conference found', str(raised.exception))
+
+
+class RateLimitTest(ConferenceTestCase):
+
+    def testOverTheLimitIsA503WithARetryHint(self):
+        capacity, rate = RATE_LIMITS['registerForConference']
+        wscks = [self.createConference(name='C%d' % i)
+                 for i in range(capacity + 1)]
+        self.signIn(ATTENDEE)
+        for wsck in wscks[:capacity]:
+            self.call('registerForConference', conference.CONF_GET_REQUEST,
+                      websafeConferenceKey=wsck)
+        with self.assertRaises(RateLimitedException) as raised:
+            self.call('registerForConference', conference.CONF_GET_REQUEST,
+                      websafeConferenceKey=wscks[-1])
+        # Endpoints passes a 503 through to clients, unlike a 429
+        self.assertEqual(raised.exception.http_status, 503)
+        self.assertIn('retry in %d seconds' % (1 / rate),
+                      str(raised.exception))
+
+
+class SessionTest(ConferenceTestCase):
+
+    def testSessionsCarryTheirSpeakers(self):
+        wsck = self.createConference()
+        for name, email in (('Intro', 'ada@example.com'),
+                            ('Deep dive', 'ada@example.com'),
+                            ('Keynote', 'bob@example.com')):
+            self.call('createSession', conference.SESH_POST_REQUEST,
+                      websafeConferenceKey=wsck, name=name,
+                      speaker_name=email.split('@')[0], speaker_email=email,
+                      date='2026-06-01', startTime='10:00')
+        sessions = self.call('getConferenceSessions',
+                             conference.SESH_ETAG_GET_REQUEST,
+                             websafeConferenceKey=wsck).items
+        self.assertEqual(sorted((sf.name, sf.speaker_email) for sf in sessions),
+                         [('Deep dive', 'ada@example.com'),
+                          ('Intro', 'ada@example.com'),
+                          ('Keynote', 'bob@example.com')])
+        # a second session by a speaker queues the featured speaker task
+        tasks = self.taskqueue.GetTasks('default')
+        self.assertEqual(len(tasks), 1)
+        self.assertEqual(tasks[0]['url'], '/tasks/set_featured_speaker')
+
+    def testOnlyTheOrganizerCreatesSessions(self):
+        wsck = self.createConference()
+        self.signIn(ATTENDEE)
+        with self.assertRaises(Exception) as raised:
+            self.call('createSession', conference.SESH_POST_REQUEST,
+                      websafeConferenceKey=wsck, name='Sneaky')
+        self.assertIn('Only the organizer', str(raised.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
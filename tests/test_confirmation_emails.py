@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+"""
+test_confirmation_emails.py -- the confirmation emails cron job leases
+pull tasks in batches, sends one email per conference & retries or drops
+the rest
+
+"""
+
+# testbase puts the SDK on sys.path, so comes first
+from testbase import AppTestCase  # noqa
+
+import json
+import unittest
+
+from google.appengine.api import taskqueue
+
+import main
+from announcements import CONFIRMATION_EMAIL_QUEUE
+
+CRON_URL = '/crons/send_confirmation_emails'
+
+
+class ConfirmationEmailTest(AppTestCase):
+
+    def setUp(self):
+        super(ConfirmationEmailTest, self).setUp()
+        self.queue = taskqueue.Queue(CONFIRMATION_EMAIL_QUEUE)
+
+    def queueConfirmation(self, wsck, email='organizer@example.com',
+                          info='<ConferenceForm name: PyCon>'):
+        self.queue.add(taskqueue.Task(method='PULL', payload=json.dumps(
+            {'email': email, 'websafeConferenceKey': wsck,
+             'conferenceInfo': info})))
+
+    def runCron(self):
+        response = main.app.get_response(CRON_URL)
+        self.assertEqual(response.status_int, 200)
+
+    def sent(self):
+        return self.mail.get_sent_messages()
+
+    def queued(self):
+        return self.taskqueue.GetTasks(CONFIRMATION_EMAIL_QUEUE)
+
+    def testSendsEveryQueuedConfirmationInBatches(self):
+        count = main.EMAIL_BATCH_SIZE + 5
+        for i in range(count):
+            self.queueConfirmation('conf%d' % i)
+        self.runCron()
+        self.assertEqual(len(self.sent()), count)
+        self.assertEqual(self.queued(), [])
+
+    def testDuplicatesOfAConferenceAreSentOnce(self):
+        self.queueConfirmation('conf1')
+        self.queueConfirmation('conf1')
+        self.runCron()
+        self.assertEqual(len(self.sent()), 1)
+        self.assertEqual(self.queued(), [])
+
+    def testDistinctConferencesWithTheSameFormAreEachSent(self):
+        # same organizer, same form fields, different conferences
+        self.queueConfirmation('conf1')
+        self.queueConfirmation('conf2')
+        self.runCron()
+        self.assertEqual(len(self.sent()), 2)
+
+    def testLegacyPayloadsDedupeOnTheWholePayload(self):
+        for _ in range(2):
+            self.queue.add(taskqueue.Task(method='PULL', payload=json.dumps(
+                {'email': 'organizer@example.com', 'conferenceInfo': 'x'})))
+        self.runCron()
+        self.assertEqual(len(self.sent()), 1)
+
+    def testFailedSendIsRetried(self):
+        self.queueConfirmation('conf1')
+        send_mail, lease_seconds = main.mail.send_mail, main.EMAIL_LEASE_SECONDS
+
+        def failSend(*args, **kwargs):
+            raise Exception('mail service unavailable')
+        main.mail.send_mail = failSend
+        # a zero-second lease runs out at once
+        main.EMAIL_LEASE_SECONDS = 0
+        try:
+            self.runCron()
+        finally:
+            main.mail.send_mail = send_mail
+            main.EMAIL_LEASE_SECONDS = lease_seconds
+        self.assertEqual(self.sent(), [])
+        # left to its lease running out rather than deleted, so it is
+        # leased again by the next run
+        self.assertEqual(len(self.queued()), 1)
+        self.runCron()
+        self.assertEqual(len(self.sent()), 1)
+        self.assertEqual(self.queued(), [])
+
+    def testDroppedAfterMaxRetries(self):
+        self.queueConfirmation('conf1')
+        # every lease counts as an attempt; zero-second leases run out
+        # at once
+        for _ in range(main.EMAIL_MAX_RETRIES):
+            self.queue.lease_tasks(0, 1000)
+        self.runCron()
+        self.assertEqual(self.sent(), [])
+        self.assertEqual(self.queued(), [])
+
+    def testMalformedPayloadIsDropped(self):
+        self.queue.add(taskqueue.Task(method='PULL', payload='not json'))
+        self.queueConfirmation('conf1')
+        self.runCron()
+        self.assertEqual(len(self.sent()), 1)
+        self.assertEqual(self.queued(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+"""
+test_deletion.py -- deleteConference's task chain runs its phases in
+order from the marker's checkpoint, scrubs attendees' profiles, and
+uncounts the conference's facets exactly once
+
+"""
+
+# testbase puts the SDK on sys.path, so comes first
+from testbase import AppTestCase  # noqa
+
+import base64
+import unittest
+import urlparse
+
+from google.appengine.ext import ndb
+
+import conference
+import deletion
+import facets
+import main
+import waitlist
+from models import Conference
+from models import ConferenceDeletion
+from models import ConferenceForm
+from models import FacetCounterShard
+from models import Profile
+from models import Session
+from models import SpeakerSession
+from models import Tombstone
+
+ORGANIZER = 'organizer@example.com'
+ATTENDEE = 'attendee@example.com'
+WAITING = 'waiting@example.com'
+
+
+class DeletionTest(AppTestCase):
+
+    def setUp(self):
+        super(DeletionTest, self).setUp()
+        for email in (ORGANIZER, ATTENDEE):
+            self.signIn(email)
+            self.call('getProfile', conference.ETAG_GET_REQUEST)
+        self.signIn(ORGANIZER)
+        for name in ('PyCon', 'DjangoCon'):
+            self.call('createConference', ConferenceForm, name=name,
+                      city='London', topics=['Python'], maxAttendees=10)
+        self.conf_key = Conference.query(Conference.name == 'PyCon').get().key
+        self.wsck = self.conf_key.urlsafe()
+        self.wsskeys = [
+            self.call('createSession', conference.SESH_POST_REQUEST,
+                      websafeConferenceKey=self.wsck, name=name,
+                      speaker_email='ada@example.com',
+                      speaker_name='Ada').websafeKey
+            for name in ('Keynote', 'Workshop', 'Closing')]
+        self.signIn(ATTENDEE)
+        self.call('registerForConference', conference.CONF_GET_REQUEST,
+                  websafeConferenceKey=self.wsck)
+        self.call('addSessionToWishlist', conference.WISHLIST_REQUEST,
+                  websafeSessionKey=self.wsskeys[0])
+        waitlist.joinWaitlist(self.wsck, WAITING)
+        self.taskqueue.FlushQueue('default')
+        self.signIn(ORGANIZER)
+        self.batch_size = deletion.DELETE_BATCH_SIZE
+        deletion.DELETE_BATCH_SIZE = 2
+
+    def tearDown(self):
+        deletion.DELETE_BATCH_SIZE = self.batch_size
+        super(DeletionTest, self).tearDown()
+
+    def deleteConference(self):
+        self.call('deleteConference', conference.CONF_GET_REQUEST,
+                  websafeConferenceKey=self.wsck)
+
+    def runTasks(self, limit=None):
+        """Run queued deletion steps in order, up to limit of them,
+        returning the phase of each one run."""
+        phases = []
+        while limit is None or len(phases) < limit:
+            tasks = [task for task in self.taskqueue.GetTasks('default')
+                     if task['url'] == deletion.DELETE_URL]
+            if not tasks:
+                break
+            self.taskqueue.DeleteTask('default', tasks[0]['name'])
+            params = dict(urlparse.parse_qsl(base64.b64decode(tasks[0]['body'])))
+            response = main.app.get_response(deletion.DELETE_URL, POST=params)
+            self.assertEqual(response.status_int, 200)
+            phases.append(params['phase'])
+        return phases
+
+    def londonCount(self):
+        """The raw sum of the London shards, which may go negative."""
+        return sum(shard.count for shard in FacetCounterShard.query()
+                   if (shard.facet, shard.value) == ('city', 'London'))
+
+    def assertAllGone(self):
+        self.assertIsNone(self.conf_key.get())
+        self.assertEqual(ndb.Query(ancestor=self.conf_key).count(), 0)
+        self.assertEqual(ndb.Query(
+            ancestor=waitlist.waitlistKey(self.wsck)).count(), 0)
+        self.assertEqual(SpeakerSession.query().count(), 0)
+        self.assertEqual(Session.query().count(), 0)
+        # sync clients are told about the conference and its sessions
+        self.assertEqual(
+            sorted(key.id() for key in Tombstone.query().fetch(keys_only=True)),
+            sorted([self.wsck] + self.wsskeys))
+
+    def testPhasesRunInOrder(self):
+        self.deleteConference()
+        self.assertIsNone(self.conf_key.get())
+        phases = self.runTasks()
+        self.assertEqual(phases, ['facets', 'sessions', 'sessions',
+                                  'registrations', 'waitlist', 'descendants'])
+        self.assertAllGone()
+        self.assertIsNone(deletion.deletionKey(self.conf_key).get())
+
+    def testProfilesAreScrubbed(self):
+        self.deleteConference()
+        self.runTasks()
+        prof = ndb.Key(Profile, ATTENDEE).get()
+        self.assertEqual(prof.conferenceKeysToAttend, [])
+        self.assertEqual(prof.sessionKeysWishlist, [])
+
+    def testResumesFromTheCheckpoint(self):
+        self.deleteConference()
+        self.assertEqual(self.runTasks(limit=2), ['facets', 'sessions'])
+        marker = deletion.deletionKey(self.conf_key).get()
+        self.assertEqual(marker.phase, 'sessions')
+        self.assertTrue(marker.cursor)
+        # the chain is lost, e.g. the queue was purged
+        self.taskqueue.FlushQueue('default')
+        self.assertEqual(main.app.get_response(deletion.DELETE_URL).status_int,
+                         200)
+        # a step from before the checkpoint is a duplicate, and is dropped
+        deletion.runStep(self.wsck, 'facets')
+        self.assertEqual(self.runTasks(), ['sessions', 'registrations',
+                                           'waitlist', 'descendants'])
+        self.assertAllGone()
+
+    def testFacetsAreUncountedOnce(self):
+        self.assertEqual(self.londonCount(), 2)
+        self.deleteConference()
+        self.assertEqual(self.londonCount(), 1)
+        self.assertEqual(deletion.deletionKey(self.conf_key).get().facets, [])
+        # neither a retried call nor the facets step uncounts it again
+        self.deleteConference()
+        self.runTasks()
+        self.assertEqual(self.londonCount(), 1)
+        self.assertEqual(self.call('getConferenceFacets').city[0].count, 1)
+
+    def testInterruptedUncountIsFinished(self):
+        # cached, so the uncount patches the cached copy
+        facets.FACETS_CACHE.get(facets.MEMCACHE_FACETS_KEY, facets._sumShards)
+        # the marker is written, but the request dies before uncounting
+        conference.ConferenceApi()._deleteConferenceObject(self.wsck)
+        marker = deletion.deletionKey(self.conf_key).get()
+        self.assertEqual(sorted(marker.facets),
+                         ['city:London', 'topic:Python'])
+        self.assertEqual(self.londonCount(), 2)
+        self.runTasks(limit=1)
+        self.assertEqual(self.londonCount(), 1)
+        self.assertEqual(self.call('getConferenceFacets').city[0].count, 1)
+        self.deleteConference()
+        self.assertEqual(self.londonCount(), 1)
+        self.assertEqual(ConferenceDeletion.query().get().facets, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+"""
+test_etags.py -- read endpoints answer a current ifNoneMatch with only
+etag & notModified, and each write path gives them a new etag
+
+"""
+
+# testbase puts the SDK on sys.path, so comes first
+from testbase import AppTestCase  # noqa
+
+import time
+import unittest
+
+import conference
+import versions
+import waitlist
+from models import Conference
+from models import ConferenceForm
+from models import ConferenceQueryForms
+from models import ProfileMiniForm
+
+ORGANIZER = 'organizer@example.com'
+ATTENDEE = 'attendee@example.com'
+WAITLISTED = 'waitlisted@example.com'
+
+
+class ETagTest(AppTestCase):
+
+    def setUp(self):
+        super(ETagTest, self).setUp()
+        self.signIn(ORGANIZER)
+        self.call('getProfile', conference.ETAG_GET_REQUEST)
+        self.call('createConference', ConferenceForm, name='PyCon',
+                  maxAttendees=1)
+        self.wsck = Conference.query().get().key.urlsafe()
+
+    def getConference(self, **fields):
+        return self.call('getConference', conference.CONF_ETAG_GET_REQUEST,
+                         websafeConferenceKey=self.wsck, **fields)
+
+    def assertChangedBy(self, write, *reads):
+        """Assert that calling write gives each of reads a new etag."""
+        etags = [read().etag for read in reads]
+        for read, etag in zip(reads, etags):
+            self.assertTrue(etag)
+            self.assertTrue(read(ifNoneMatch=etag).notModified)
+        write()
+        for read, etag in zip(reads, etags):
+            form = read(ifNoneMatch=etag)
+            self.assertFalse(form.notModified)
+            self.assertNotEqual(form.etag, etag)
+
+    def testMissReturnsTheWholeResponse(self):
+        cf = self.getConference(ifNoneMatch='"stale"')
+        self.assertFalse(cf.notModified)
+        self.assertEqual(cf.name, 'PyCon')
+        self.assertTrue(cf.etag)
+
+    def testHitReturnsOnlyTheETag(self):
+        etag = self.getConference().etag
+        cf = self.getConference(ifNoneMatch=etag)
+        self.assertTrue(cf.notModified)
+        self.assertEqual(cf.etag, etag)
+        self.assertIsNone(cf.name)
+
+    def testIfNoneMatchHeaderIsHonoured(self):
+        etag = self.getConference().etag
+        cf = self.call('getConference', conference.CONF_ETAG_GET_REQUEST,
+                       headers={'If-None-Match': '"other", ' + etag},
+                       websafeConferenceKey=self.wsck)
+        self.assertTrue(cf.notModified)
+
+    def testCreateConference(self):
+        def read(**fields):
+            return self.call('getConferencesCreated',
+                             conference.ETAG_GET_REQUEST, **fields)
+        self.assertChangedBy(lambda: self.call(
+            'createConference', ConferenceForm, name='DjangoCon'), read)
+
+    def testUpdateConference(self):
+        self.assertChangedBy(lambda: self.call(
+            'updateConference', conference.CONF_POST_REQUEST,
+            websafeConferenceKey=self.wsck, city='Paris'), self.getConference)
+
+    def testDeleteConference(self):
+        def read(**fields):
+            return self.call('getConferencesCreated',
+                             conference.ETAG_GET_REQUEST, **fields)
+        self.assertChangedBy(lambda: self.call(
+            'deleteConference', conference.CONF_GET_REQUEST,
+            websafeConferenceKey=self.wsck), read)
+
+    def testSaveProfile(self):
+        def read(**fields):
+            return self.call('getProfile', conference.ETAG_GET_REQUEST,
+                             **fields)
+        self.assertChangedBy(lambda: self.call(
+            'saveProfile', ProfileMiniForm, displayName='Org'), read)
+
+    def testRegisterAndUnregister(self):
+        self.signIn(ATTENDEE)
+
+        def read(**fields):
+            return self.call('getConferencesToAttend',
+                             conference.ETAG_GET_REQUEST, **fields)
+        for method in ('registerForConference', 'unregisterFromConference'):
+            self.assertChangedBy(lambda: self.call(
+                method, conference.CONF_GET_REQUEST,
+                websafeConferenceKey=self.wsck), read, self.getConference)
+
+    def testCreateSession(self):
+        def read(**fields):
+            return self.call('getConferenceSessions',
+                             conference.SESH_ETAG_GET_REQUEST,
+                             websafeConferenceKey=self.wsck, **fields)
+        self.assertChangedBy(lambda: self.call(
+            'createSession', conference.SESH_POST_REQUEST,
+            websafeConferenceKey=self.wsck, name='Intro'), read)
+
+    def testWaitlistPromotion(self):
+        # the only seat is taken, so the next user is waitlisted
+        for email in (ATTENDEE, WAITLISTED):
+            self.signIn(email)
+            self.call('registerForConference', conference.CONF_GET_REQUEST,
+                      websafeConferenceKey=self.wsck)
+
+        def read(**fields):
+            self.signIn(WAITLISTED)
+            return self.call('getProfile', conference.ETAG_GET_REQUEST,
+                             **fields)
+
+        def freeSeatAndPromote():
+            self.signIn(ATTENDEE)
+            self.call('unregisterFromConference', conference.CONF_GET_REQUEST,
+                      websafeConferenceKey=self.wsck)
+            self.assertEqual(waitlist.promote(self.wsck), 1)
+        self.assertChangedBy(freeSeatAndPromote, read)
+
+
+class QueryETagTest(AppTestCase):
+
+    def setUp(self):
+        super(QueryETagTest, self).setUp()
+        self.signIn(ORGANIZER)
+        self.call('getProfile', conference.ETAG_GET_REQUEST)
+        self.call('createConference', ConferenceForm, name='PyCon')
+
+    def tearDown(self):
+        versions.time = time
+        super(QueryETagTest, self).tearDown()
+
+    def query(self, **fields):
+        return self.call('queryConferences', ConferenceQueryForms, **fields)
+
+    def settle(self):
+        """Move versions' clock past the settle window."""
+        class Later(object):
+            offset = conference.QUERY_ETAG_SETTLE_SECONDS + 1
+
+            @classmethod
+            def time(cls):
+                return time.time() + cls.offset
+        versions.time = Later
+
+    def testNoETagRightAfterAWrite(self):
+        cfs = self.query()
+        self.assertIsNone(cfs.etag)
+        self.assertEqual([cf.name for cf in cfs.items], ['PyCon'])
+
+    def testETagOnceSettled(self):
+        self.settle()
+        etag = self.query().etag
+        self.assertTrue(etag)
+        self.assertTrue(self.query(ifNoneMatch=etag).notModified)
+
+    def testWriteWithholdsTheETagAgain(self):
+        self.settle()
+        etag = self.query().etag
+        versions.time = time
+        self.call('createConference', ConferenceForm, name='DjangoCon')
+        cfs = self.query(ifNoneMatch=etag)
+        self.assertFalse(cfs.notModified)
+        self.assertIsNone(cfs.etag)
+        self.assertEqual(len(cfs.items), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
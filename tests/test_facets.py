@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+"""
+test_facets.py -- conference writes move the sharded facet counts, and
+the cached totals are patched in place or rebuilt from the shards
+
+"""
+
+# testbase puts the SDK on sys.path, so comes first
+from testbase import AppTestCase  # noqa
+
+import unittest
+
+from google.appengine.api import memcache
+
+import conference
+import facets
+from models import Conference
+from models import ConferenceForm
+from models import FacetCounterShard
+
+ORGANIZER = 'organizer@example.com'
+
+
+class FacetsTest(AppTestCase):
+
+    def setUp(self):
+        super(FacetsTest, self).setUp()
+        self.signIn(ORGANIZER)
+        self.call('getProfile', conference.ETAG_GET_REQUEST)
+
+    def createConference(self, name, **fields):
+        self.call('createConference', ConferenceForm, name=name, **fields)
+        return Conference.query(Conference.name == name).get().key.urlsafe()
+
+    def facets(self):
+        form = self.call('getConferenceFacets')
+        return dict((facet, dict((fc.value, fc.count)
+                                 for fc in getattr(form, facet)))
+                    for facet in facets.FACETS)
+
+    def dropCache(self):
+        memcache.delete(facets.MEMCACHE_FACETS_KEY)
+        facets.FACETS_CACHE.invalidateLocal(facets.MEMCACHE_FACETS_KEY)
+
+    def testCreateCountsTheConference(self):
+        self.createConference('PyCon', city='London', topics=['Python'],
+                              startDate='2026-06-01')
+        self.createConference('DjangoCon', city='London',
+                              topics=['Python', 'Web'])
+        self.assertEqual(self.facets(), {
+            'city': {'London': 2},
+            'topic': {'Python': 2, 'Web': 1},
+            'month': {'6': 1}})
+
+    def testUpdateMovesTheCounts(self):
+        wsck = self.createConference('PyCon', city='London',
+                                     topics=['Python'],
+                                     startDate='2026-06-01')
+        self.facets()  # cached, so the update patches the cached copy
+        self.call('updateConference', conference.CONF_POST_REQUEST,
+                  websafeConferenceKey=wsck, name='PyCon', city='Paris',
+                  topics=['Python', 'Web'], startDate='2026-09-01')
+        expected = {'city': {'Paris': 1},
+                    'topic': {'Python': 1, 'Web': 1},
+                    'month': {'9': 1}}
+        self.assertEqual(self.facets(), expected)
+        # the shards agree with the patched cache
+        self.dropCache()
+        self.assertEqual(self.facets(), expected)
+
+    def testCacheMissSumsTheShards(self):
+        for i in range(12):
+            self.createConference('C%d' % i, city='London')
+        self.dropCache()
+        self.assertEqual(self.facets()['city'], {'London': 12})
+        # the count is spread over the shards and cached again
+        self.assertTrue(FacetCounterShard.query().count() > 1)
+        self.assertEqual(memcache.get(facets.MEMCACHE_FACETS_KEY)['city'],
+                         {'London': 12})
+
+
+class RacingClient(memcache.Client):
+    """A memcache client whose next `losses` compare-and-sets lose to
+    another writer adding one London conference."""
+    losses = 0
+
+    def cas(self, key, value, time=0):
+        if RacingClient.losses:
+            RacingClient.losses -= 1
+            other = memcache.get(key)
+            other['city']['London'] = other['city'].get('London', 0) + 1
+            memcache.set(key, other)
+        return super(RacingClient, self).cas(key, value, time)
+
+
+class UpdateCacheTest(AppTestCase):
+
+    def setUp(self):
+        super(UpdateCacheTest, self).setUp()
+        memcache.set(facets.MEMCACHE_FACETS_KEY,
+                     {'city': {'London': 1}, 'topic': {}, 'month': {}})
+        self.client = memcache.Client
+        memcache.Client = RacingClient
+
+    def tearDown(self):
+        memcache.Client = self.client
+        RacingClient.losses = 0
+        super(UpdateCacheTest, self).tearDown()
+
+    def testLostCasIsRetried(self):
+        RacingClient.losses = 1
+        facets._updateCache({('city', 'Paris'): 1, ('city', 'London'): -1})
+        # both writers' changes survive
+        self.assertEqual(memcache.get(facets.MEMCACHE_FACETS_KEY)['city'],
+                         {'London': 1, 'Paris': 1})
+
+    def testCacheIsDroppedIfCasKeepsLosing(self):
+        RacingClient.losses = facets.CAS_RETRIES
+        facets._updateCache({('city', 'Paris'): 1})
+        self.assertIsNone(memcache.get(facets.MEMCACHE_FACETS_KEY))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+"""
+test_migrations.py -- in-place migrations re-read each entity group in
+a transaction, so writes made while a batch runs are kept; the
+speaker_sessions backfill lists existing sessions under their speaker
+
+"""
+
+# testbase puts the SDK on sys.path, so comes first
+from testbase import AppTestCase  # noqa
+
+import unittest
+from datetime import date
+from datetime import time
+
+from google.appengine.ext import ndb
+
+import migrations
+from models import Conference
+from models import Profile
+from models import Session
+from models import Speaker
+from models import SpeakerSession
+
+
+class ConferenceMonthTest(AppTestCase):
+
+    def setUp(self):
+        super(ConferenceMonthTest, self).setUp()
+        # month is stale, as it was before conference_month
+        self.confs = [Conference(parent=ndb.Key(Profile, 'organizer%d' % i),
+                                 name='C%d' % i, startDate=date(2026, 6, 1),
+                                 month=0, maxAttendees=10, seatsAvailable=10)
+                      for i in range(3)]
+        ndb.put_multi(self.confs)
+
+    def testSetsMonth(self):
+        run = migrations.runToCompletion('conference_month', batch_size=2)
+        self.assertEqual(run.status, 'done')
+        self.assertEqual((run.read, run.written), (3, 3))
+        self.assertEqual([conf.month for conf in
+                          ndb.get_multi([c.key for c in self.confs])],
+                         [6, 6, 6])
+
+    def testKeepsWritesMadeAfterThePageWasRead(self):
+        query = Conference.query
+
+        def registerDuringPage(*args, **kwargs):
+            q = query(*args, **kwargs)
+            fetch_page = q.fetch_page
+
+            def fetchThenRegister(*args, **kwargs):
+                page = fetch_page(*args, **kwargs)
+                # a registration commits between the page and its puts,
+                # from another request (so not through this context's cache)
+                conf = self.confs[0].key.get(use_cache=False)
+                conf.seatsAvailable -= 1
+                conf.put(use_cache=False)
+                return page
+            q.fetch_page = fetchThenRegister
+            return q
+        Conference.query = staticmethod(registerDuringPage)
+        try:
+            migrations.runToCompletion('conference_month')
+        finally:
+            del Conference.query
+        conf = self.confs[0].key.get()
+        self.assertEqual(conf.month, 6)
+        self.assertEqual(conf.seatsAvailable, 9)
+
+
+class SpeakerSessionsTest(AppTestCase):
+
+    def setUp(self):
+        super(SpeakerSessionsTest, self).setUp()
+        # sessions from before createSession wrote SpeakerSession rows
+        conf_key = Conference(parent=ndb.Key(Profile, 'organizer'),
+                              name='PyCon', maxAttendees=10,
+                              seatsAvailable=10).put()
+        ada = Speaker(name='Ada', email='ada@example.com').put()
+        nameless = Speaker(name='Nobody').put()
+        self.sessions = [
+            Session(parent=conf_key, name='Talk %d' % i, speakerId=ada.id(),
+                    date=date(2026, 6, 1), startTime=time(10 + i))
+            for i in range(3)]
+        self.sessions.append(Session(parent=conf_key, name='Lunch'))
+        self.sessions.append(Session(parent=conf_key, name='Panel',
+                                     speakerId=nameless.id()))
+        ndb.put_multi(self.sessions)
+
+    def rows(self):
+        return SpeakerSession.query(
+            ancestor=SpeakerSession.parentKey('ada@example.com')).order(
+            SpeakerSession.startTime).fetch()
+
+    def testListsSessionsUnderTheSpeakerEmail(self):
+        run = migrations.runToCompletion('speaker_sessions', batch_size=2)
+        self.assertEqual(run.status, 'done')
+        self.assertEqual((run.read, run.written), (5, 3))
+        self.assertEqual([row.session for row in self.rows()],
+                         [sesh.key for sesh in self.sessions[:3]])
+        # sessions without a speaker email get no row
+        self.assertEqual(SpeakerSession.query().count(), 3)
+
+    def testRerunOverwritesTheRows(self):
+        migrations.runToCompletion('speaker_sessions')
+        migrations.runToCompletion('speaker_sessions')
+        self.assertEqual(len(self.rows()), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+"""
+test_recommendations.py -- rebuild() merges a page of profiles at a
+time into the same recommendations as merging them all at once
+
+"""
+
+# testbase puts the SDK on sys.path, so comes first
+from testbase import AppTestCase  # noqa
+
+import unittest
+
+from google.appengine.ext import ndb
+
+import recommendations
+from models import Profile
+from models import SessionRecommendations
+
+
+class RebuildTest(AppTestCase):
+
+    def setUp(self):
+        super(RebuildTest, self).setUp()
+        conf = ndb.Key(Profile, 'organizer', 'Conference', 1)
+        self.sessions = [ndb.Key('Session', i, parent=conf).urlsafe()
+                         for i in range(1, 7)]
+        s = self.sessions
+        self.profs = [Profile(id='user%d' % i, sessionKeysWishlist=wishlist)
+                      for i, wishlist in enumerate(
+                          [s[0:3], s[1:4], s[2:5], s[0:6:2], s[3:6], s[:1]])]
+        ndb.put_multi(self.profs)
+
+    def rebuild(self, batch_size, full=False):
+        recommendations.PROFILE_BATCH_SIZE, size = (
+            batch_size, recommendations.PROFILE_BATCH_SIZE)
+        try:
+            return recommendations.rebuild(full)
+        finally:
+            recommendations.PROFILE_BATCH_SIZE = size
+
+    def recs(self):
+        """Return {item: {session: score}}; tied sessions are ranked in
+        no particular order."""
+        return dict((rec.key.id(), dict(zip(
+                        rec.sessions, [round(score, 6) for score in rec.scores])))
+                    for rec in SessionRecommendations.query())
+
+    def matrix(self):
+        """Return ({item: profiles with it}, {(item, item): count})."""
+        _, items, _, counts, codes, vals = recommendations._loadState()
+        return (dict((item, n) for item, n in zip(items, counts) if n),
+                dict(((items[code >> 32], items[code & 0xffffffff]), val)
+                     for code, val in zip(codes.tolist(), vals.tolist())))
+
+    def testPagesGiveTheSameResult(self):
+        self.rebuild(len(self.profs), full=True)
+        whole, whole_matrix = self.recs(), self.matrix()
+        self.assertTrue(whole)
+        summary = self.rebuild(2, full=True)
+        self.assertEqual(summary['profiles'], len(self.profs))
+        self.assertEqual(self.recs(), whole)
+        self.assertEqual(self.matrix(), whole_matrix)
+
+    def testIncrementalPagesGiveTheSameMatrix(self):
+        self.rebuild(2, full=True)
+        self.profs[0].sessionKeysWishlist = self.sessions[4:6]
+        self.profs[5].sessionKeysWishlist = self.sessions[1:3]
+        ndb.put_multi([self.profs[0], self.profs[5]])
+        summary = self.rebuild(1)
+        self.assertEqual(summary['profiles'], 2)
+        incremental = self.matrix()
+        self.rebuild(len(self.profs), full=True)
+        self.assertEqual(self.matrix(), incremental)
+
+
+if __name__ == '__main__':
+    unittest.main()
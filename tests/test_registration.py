@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+"""
+test_registration.py -- registerGroup registers users only for the
+conferences the caller organizes, and reports a failed batch without
+undoing the ones before it
+
+"""
+
+# testbase puts the SDK on sys.path, so comes first
+from testbase import AppTestCase  # noqa
+
+import unittest
+
+from google.appengine.api import datastore_errors
+from google.appengine.ext import ndb
+
+import conference
+import registration
+from models import Conference
+from models import ConferenceForm
+from models import GroupRegistrationForm
+from models import Profile
+from models import RegistrationStatus
+
+ORGANIZER = 'organizer@example.com'
+OTHER = 'other@example.com'
+USERS = ['ada@example.com', 'bob@example.com']
+
+
+class RegisterGroupTest(AppTestCase):
+
+    def setUp(self):
+        super(RegisterGroupTest, self).setUp()
+        for email in [ORGANIZER, OTHER] + USERS:
+            self.signIn(email)
+            self.call('getProfile', conference.ETAG_GET_REQUEST)
+        self.own = self.createConference(ORGANIZER, 'Own')
+        self.others = self.createConference(OTHER, 'Others')
+        self.signIn(ORGANIZER)
+
+    def createConference(self, email, name):
+        self.signIn(email)
+        self.call('createConference', ConferenceForm, name=name,
+                  maxAttendees=10)
+        return Conference.query(Conference.name == name).get().key.urlsafe()
+
+    def registerGroup(self, wscks, emails=USERS):
+        forms = self.call('registerGroup', GroupRegistrationForm,
+                          websafeConferenceKey=wscks, email=emails).items
+        return dict(((form.email, form.websafeConferenceKey), form.status)
+                    for form in forms)
+
+    def attending(self, email):
+        return ndb.Key(Profile, email).get().conferenceKeysToAttend
+
+    def testOnlyOwnConferencesAreRegisteredFor(self):
+        statuses = self.registerGroup([self.own, self.others, 'not-a-key'])
+        for email in USERS:
+            self.assertEqual(statuses[email, self.own],
+                             RegistrationStatus.REGISTERED)
+            self.assertEqual(statuses[email, self.others],
+                             RegistrationStatus.FORBIDDEN)
+            self.assertEqual(statuses[email, 'not-a-key'],
+                             RegistrationStatus.NO_CONFERENCE)
+            self.assertEqual(self.attending(email), [self.own])
+        self.assertEqual(ndb.Key(urlsafe=self.others).get().seatsAvailable,
+                         10)
+
+    def testUnknownEmail(self):
+        statuses = self.registerGroup([self.own], ['nobody@example.com'])
+        self.assertEqual(statuses['nobody@example.com', self.own],
+                         RegistrationStatus.NO_PROFILE)
+
+
+class FailedBatchTest(AppTestCase):
+
+    def setUp(self):
+        super(FailedBatchTest, self).setUp()
+        self.emails = ['user%d@example.com' % i for i in range(7)]
+        for email in [ORGANIZER] + self.emails:
+            self.signIn(email)
+            self.call('getProfile', conference.ETAG_GET_REQUEST)
+        self.signIn(ORGANIZER)
+        self.call('createConference', ConferenceForm, name='PyCon',
+                  maxAttendees=10)
+        self.wsck = Conference.query().get().key.urlsafe()
+        # the conference and one profile, then batches of two
+        self.saved = (registration.MAX_ENTITY_GROUPS,
+                      registration.PROFILE_BATCH_SIZE,
+                      registration._registerBatch)
+        registration.MAX_ENTITY_GROUPS = 2
+        registration.PROFILE_BATCH_SIZE = 2
+        self.failed = []
+
+    def tearDown(self):
+        (registration.MAX_ENTITY_GROUPS, registration.PROFILE_BATCH_SIZE,
+         registration._registerBatch) = self.saved
+        super(FailedBatchTest, self).tearDown()
+
+    def failSecondBatch(self, commit):
+        """Make the second batch raise, after committing if commit."""
+        register = self.saved[2]
+        calls = []
+
+        def registerBatch(reserved, wants, user_ids):
+            calls.append(user_ids)
+            if len(calls) != 2:
+                return register(reserved, wants, user_ids)
+            self.failed.extend(user_ids)
+            if commit:
+                register(reserved, wants, user_ids)
+            raise datastore_errors.Timeout()
+        registration._registerBatch = registerBatch
+
+    def registerGroup(self):
+        forms = self.call('registerGroup', GroupRegistrationForm,
+                          websafeConferenceKey=[self.wsck],
+                          email=self.emails).items
+        return dict((form.email, form.status) for form in forms)
+
+    def testOtherBatchesAreKept(self):
+        self.failSecondBatch(commit=False)
+        statuses = self.registerGroup()
+        self.assertEqual(len(self.failed), 2)
+        for email in self.emails:
+            expected = (RegistrationStatus.FAILED if email in self.failed
+                        else RegistrationStatus.REGISTERED)
+            self.assertEqual(statuses[email], expected)
+            self.assertEqual(ndb.Key(Profile, email).get().conferenceKeysToAttend,
+                             [] if email in self.failed else [self.wsck])
+        # the failed batch's seats are handed back
+        self.assertEqual(ndb.Key(urlsafe=self.wsck).get().seatsAvailable, 5)
+        # and calling again registers just those users
+        registration._registerBatch = self.saved[2]
+        statuses = self.registerGroup()
+        for email in self.failed:
+            self.assertEqual(statuses[email], RegistrationStatus.REGISTERED)
+        self.assertEqual(ndb.Key(urlsafe=self.wsck).get().seatsAvailable, 3)
+
+    def testCommitThatLandedCountsAsRegistered(self):
+        self.failSecondBatch(commit=True)
+        statuses = self.registerGroup()
+        self.assertEqual(set(statuses.values()),
+                         set([RegistrationStatus.REGISTERED]))
+        self.assertEqual(ndb.Key(urlsafe=self.wsck).get().seatsAvailable, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
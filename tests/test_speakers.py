@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+"""
+test_speakers.py -- createSession keeps each conference's SpeakerRoster
+in step, getSpeakersByConf answers from the roster alone, and
+getSessionsBySpeaker pages through a speaker's sessions
+
+"""
+
+# testbase puts the SDK on sys.path, so comes first
+from testbase import AppTestCase  # noqa
+
+import unittest
+
+import endpoints
+from google.appengine.ext import ndb
+
+import conference
+from models import Conference
+from models import ConferenceForm
+from models import Session
+from models import SpeakerRoster
+
+ORGANIZER = 'organizer@example.com'
+ADA = 'ada@example.com'
+BOB = 'bob@example.com'
+
+
+class SpeakerRosterTest(AppTestCase):
+
+    def setUp(self):
+        super(SpeakerRosterTest, self).setUp()
+        self.signIn(ORGANIZER)
+        self.call('getProfile', conference.ETAG_GET_REQUEST)
+        self.call('createConference', ConferenceForm, name='PyCon')
+        self.conf_key = Conference.query().get().key
+        self.wsck = self.conf_key.urlsafe()
+
+    def createSession(self, name, email=None, speaker=None):
+        return self.call('createSession', conference.SESH_POST_REQUEST,
+                         websafeConferenceKey=self.wsck, name=name,
+                         speaker_email=email, speaker_name=speaker).websafeKey
+
+    def roster(self):
+        key = ndb.Key(SpeakerRoster, conference.SPEAKER_ROSTER_ID,
+                      parent=self.conf_key)
+        return key.get()
+
+    def speakers(self):
+        forms = self.call('getSpeakersByConf', conference.SPEAKER_GET_REQUEST,
+                          websafeConferenceKey=self.wsck).items
+        return [(form.email, form.sessionCount) for form in forms]
+
+    def createTalks(self):
+        self.createSession('Keynote', ADA, 'Ada')
+        self.createSession('Workshop', BOB, 'Bob')
+        self.createSession('Closing', ADA, 'Ada')
+        self.createSession('Lunch')
+
+    def testCreateSessionCountsTheSpeaker(self):
+        self.createSession('Lunch')
+        self.assertEqual(self.roster().speakers, [])
+        self.createTalks()
+        roster = self.roster()
+        self.assertEqual([entry.sessions for entry in roster.speakers],
+                         [2, 1])
+        self.assertEqual(self.speakers(), [(ADA, 2), (BOB, 1)])
+
+    def testSpeakersAreReadFromTheRoster(self):
+        self.createTalks()
+        # with the sessions gone the roster still answers
+        ndb.delete_multi(Session.query(ancestor=self.conf_key)
+                         .fetch(keys_only=True))
+        self.assertEqual(self.speakers(), [(ADA, 2), (BOB, 1)])
+
+    def testMissingRosterIsBuiltFromTheSessions(self):
+        self.createTalks()
+        self.roster().key.delete()
+        self.assertEqual(self.speakers(), [(ADA, 2), (BOB, 1)])
+        self.assertEqual([entry.sessions for entry in self.roster().speakers],
+                         [2, 1])
+        # and later sessions count on the rebuilt roster
+        self.createSession('Panel', BOB, 'Bob')
+        self.assertEqual(self.speakers(), [(ADA, 2), (BOB, 2)])
+
+
+class SessionsBySpeakerTest(AppTestCase):
+
+    def setUp(self):
+        super(SessionsBySpeakerTest, self).setUp()
+        self.signIn(ORGANIZER)
+        self.call('getProfile', conference.ETAG_GET_REQUEST)
+        self.wscks = []
+        for name in ('PyCon', 'DjangoCon'):
+            self.call('createConference', ConferenceForm, name=name)
+            self.wscks.append(
+                Conference.query(Conference.name == name).get().key.urlsafe())
+        # created out of order, across both conferences
+        for wsck, name, date, startTime in [
+                (self.wscks[1], 'D', '2026-07-01', '09:00'),
+                (self.wscks[0], 'B', '2026-06-01', '14:00'),
+                (self.wscks[1], 'E', '2026-07-02', '09:00'),
+                (self.wscks[0], 'A', '2026-06-01', '10:00'),
+                (self.wscks[0], 'C', '2026-06-02', '10:00')]:
+            self.call('createSession', conference.SESH_POST_REQUEST,
+                      websafeConferenceKey=wsck, name=name, date=date,
+                      startTime=startTime, speaker_email=ADA,
+                      speaker_name='Ada')
+
+    def page(self, **fields):
+        return self.call('getSessionsBySpeaker',
+                         conference.SESH_GET_REQUEST_SPEAKER, email=ADA,
+                         **fields)
+
+    def testPagesInDateOrder(self):
+        names, token, pages = [], None, 0
+        while True:
+            forms = self.page(limit=2, pageToken=token)
+            names.extend(sf.name for sf in forms.items)
+            pages += 1
+            token = forms.nextPageToken
+            if not token:
+                break
+        self.assertEqual(names, ['A', 'B', 'C', 'D', 'E'])
+        self.assertEqual(pages, 3)
+
+    def testSessionsCarryTheirConference(self):
+        forms = self.page().items
+        self.assertEqual([(sf.conferenceName, sf.conferenceKey)
+                          for sf in forms[2:4]],
+                         [('PyCon', self.wscks[0]),
+                          ('DjangoCon', self.wscks[1])])
+        self.assertEqual(set(sf.speaker_email for sf in forms), set([ADA]))
+
+    def testLimitIsClamped(self):
+        self.assertEqual(len(self.page(limit=-5).items), 1)
+        self.assertEqual(len(self.page(limit=0).items), 5)
+
+    def testBadPageTokenAndUnknownSpeaker(self):
+        with self.assertRaises(endpoints.BadRequestException):
+            self.page(pageToken='not-a-cursor')
+        with self.assertRaises(endpoints.NotFoundException):
+            self.call('getSessionsBySpeaker',
+                      conference.SESH_GET_REQUEST_SPEAKER, email=BOB)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+"""
+test_sync.py -- sync pages through what changed since a watermark,
+reports deletions from their tombstones, and purges old tombstones
+
+"""
+
+# testbase puts the SDK on sys.path, so comes first
+from testbase import AppTestCase  # noqa
+
+import base64
+import json
+import unittest
+from datetime import datetime
+from datetime import timedelta
+
+import endpoints
+from google.appengine.ext import ndb
+
+import conference
+import deletion
+import sync
+from models import Conference
+from models import ConferenceForm
+from models import Tombstone
+
+ORGANIZER = 'organizer@example.com'
+
+
+class SyncTest(AppTestCase):
+
+    def setUp(self):
+        super(SyncTest, self).setUp()
+        # so a watermark excludes everything written before it was taken
+        self.overlap = sync.SYNC_OVERLAP
+        sync.SYNC_OVERLAP = timedelta(0)
+        self.signIn(ORGANIZER)
+        self.call('getProfile', conference.ETAG_GET_REQUEST)
+        self.wscks = [self.createConference(name)
+                      for name in ('PyCon', 'DjangoCon')]
+        self.wsskeys = [
+            self.call('createSession', conference.SESH_POST_REQUEST,
+                      websafeConferenceKey=self.wscks[0], name=name,
+                      speaker_email='ada@example.com',
+                      speaker_name='Ada').websafeKey
+            for name in ('Keynote', 'Workshop')]
+
+    def tearDown(self):
+        sync.SYNC_OVERLAP = self.overlap
+        super(SyncTest, self).tearDown()
+
+    def createConference(self, name):
+        self.call('createConference', ConferenceForm, name=name)
+        return Conference.query(Conference.name == name).get().key.urlsafe()
+
+    def sync(self, **fields):
+        """Return (conference, session, speaker & deleted keys, the pages
+        read, the watermark) of a sync followed to its last page."""
+        keys = dict((name, []) for name in
+                    ('conferences', 'sessions', 'speakers', 'deleted'))
+        pages = 0
+        token = None
+        while True:
+            form = self.call('sync', conference.SYNC_GET_REQUEST,
+                             pageToken=token, **fields)
+            pages += 1
+            for name in keys:
+                keys[name].extend(item.websafeKey
+                                  for item in getattr(form, name))
+            token = form.nextPageToken
+            if not token:
+                return keys, pages, form.watermark
+
+    def testFirstSyncSendsEverything(self):
+        keys, pages, watermark = self.sync()
+        self.assertEqual(sorted(keys['conferences']), sorted(self.wscks))
+        self.assertEqual(sorted(keys['sessions']), sorted(self.wsskeys))
+        self.assertEqual(len(keys['speakers']), 1)
+        self.assertEqual(keys['deleted'], [])
+        self.assertEqual(pages, 1)
+        self.assertTrue(watermark)
+
+    def testPagesFollowTheLimit(self):
+        keys, pages, _ = self.sync(limit=2)
+        self.assertEqual(sorted(keys['conferences']), sorted(self.wscks))
+        self.assertEqual(sorted(keys['sessions']), sorted(self.wsskeys))
+        self.assertEqual(len(keys['speakers']), 1)
+        self.assertEqual(pages, 3)
+        # a limit below 1 still makes progress, one entity a page
+        first = self.call('sync', conference.SYNC_GET_REQUEST, limit=-1)
+        self.assertEqual(len(first.conferences), 1)
+        self.assertTrue(first.nextPageToken)
+
+    def testDeltaHasOnlyLaterWrites(self):
+        _, _, watermark = self.sync()
+        self.assertEqual(self.sync(since=watermark)[0],
+                         {'conferences': [], 'sessions': [], 'speakers': [],
+                          'deleted': []})
+        self.call('updateConference', conference.CONF_POST_REQUEST,
+                  websafeConferenceKey=self.wscks[1], name='DjangoCon',
+                  city='Paris')
+        added = self.createConference('FlaskCon')
+        keys, _, later = self.sync(since=watermark)
+        self.assertEqual(sorted(keys['conferences']),
+                         sorted([self.wscks[1], added]))
+        self.assertEqual(keys['sessions'], [])
+        self.assertTrue(later > watermark)
+
+    def testDeletionsAreTombstoned(self):
+        _, _, watermark = self.sync()
+        self.call('deleteConference', conference.CONF_GET_REQUEST,
+                  websafeConferenceKey=self.wscks[0])
+        self.assertEqual(self.sync(since=watermark)[0]['deleted'],
+                         [self.wscks[0]])
+        # the task chain tombstones the sessions as it deletes them
+        marker = deletion.deletionKey(ndb.Key(urlsafe=self.wscks[0])).get()
+        while marker:
+            deletion.runStep(self.wscks[0], marker.phase, marker.cursor)
+            marker = marker.key.get()
+        keys = self.sync(since=watermark)[0]
+        self.assertEqual(sorted(keys['deleted']),
+                         sorted([self.wscks[0]] + self.wsskeys))
+        # a first sync has nothing to delete
+        self.assertEqual(self.sync()[0]['deleted'], [])
+
+    def testOldWatermarkNeedsAFullResync(self):
+        since = datetime.utcnow() - timedelta(days=sync.TOMBSTONE_DAYS + 1)
+        form = self.call('sync', conference.SYNC_GET_REQUEST,
+                         since=since.strftime(sync.WATERMARK_FORMAT))
+        self.assertTrue(form.fullResync)
+        self.assertEqual(form.conferences, [])
+
+    def testBadTokensAreRefused(self):
+        corrupt = base64.urlsafe_b64encode(json.dumps({
+            'phase': 0, 'since': None, 'watermark': 'x',
+            'cursor': 'not-a-cursor'}))
+        for fields in ({'pageToken': 'not base64 json'},
+                       {'pageToken': corrupt},
+                       {'since': 'yesterday'}):
+            with self.assertRaises(endpoints.BadRequestException):
+                self.call('sync', conference.SYNC_GET_REQUEST, **fields)
+
+
+class Later(datetime):
+    """A datetime whose utcnow() is TOMBSTONE_DAYS after `now`."""
+    now = None
+
+    @classmethod
+    def utcnow(cls):
+        return cls.now + timedelta(days=sync.TOMBSTONE_DAYS)
+
+
+class PurgeTombstonesTest(AppTestCase):
+
+    def setUp(self):
+        super(PurgeTombstonesTest, self).setUp()
+        self.batch_size = sync.PURGE_BATCH_SIZE
+        sync.PURGE_BATCH_SIZE = 2
+        sync.datetime = Later
+
+    def tearDown(self):
+        sync.datetime = datetime
+        sync.PURGE_BATCH_SIZE = self.batch_size
+        super(PurgeTombstonesTest, self).tearDown()
+
+    def testOnlyOldTombstonesArePurged(self):
+        old = [Tombstone(id='old%d' % i, kind='Session') for i in range(5)]
+        for tomb in old:
+            tomb.put()
+        # the cut-off falls just after the last of them
+        Later.now = (max(tomb.lastModified for tomb in old) +
+                     timedelta(microseconds=1))
+        Tombstone(id='new', kind='Session').put()
+        self.assertEqual(sync.purgeTombstones(), 5)
+        self.assertEqual([key.id() for key in
+                          Tombstone.query().fetch(keys_only=True)], ['new'])
+
+
+if __name__ == '__main__':
+    unittest.main()
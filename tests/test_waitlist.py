@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+"""
+test_waitlist.py -- seats freed while users are waitlisted go to them,
+not to whoever registers next
+
+"""
+
+# testbase puts the SDK on sys.path, so comes first
+from testbase import AppTestCase  # noqa
+
+import unittest
+
+from google.appengine.ext import ndb
+
+import conference
+import registration
+import waitlist
+from models import Conference
+from models import ConferenceForm
+from models import RegistrationStatus
+
+ORGANIZER = 'organizer@example.com'
+FIRST = 'first@example.com'
+WAITING = 'waiting@example.com'
+LATE = 'late@example.com'
+
+
+class WaitlistTest(AppTestCase):
+
+    def setUp(self):
+        super(WaitlistTest, self).setUp()
+        for email in (ORGANIZER, FIRST, WAITING, LATE):
+            self.signIn(email)
+            self.call('getProfile', conference.ETAG_GET_REQUEST)
+        self.signIn(ORGANIZER)
+        self.call('createConference', ConferenceForm, name='PyCon',
+                  maxAttendees=1)
+        self.wsck = Conference.query().get().key.urlsafe()
+        # FIRST takes the only seat and WAITING is waitlisted
+        self.assertTrue(self.register(FIRST).data)
+        self.assertEqual(self.register(WAITING).waitlistPosition, 1)
+
+    def register(self, email):
+        self.signIn(email)
+        return self.call('registerForConference', conference.CONF_GET_REQUEST,
+                         websafeConferenceKey=self.wsck)
+
+    def unregister(self, email):
+        self.signIn(email)
+        return self.call('unregisterFromConference',
+                         conference.CONF_GET_REQUEST,
+                         websafeConferenceKey=self.wsck)
+
+    def conf(self):
+        return ndb.Key(urlsafe=self.wsck).get()
+
+    def testFreedSeatGoesToTheWaitlist(self):
+        self.assertEqual(self.conf().waitlisted, 1)
+        self.unregister(FIRST)
+        # the seat is free until promotion runs, but not for LATE
+        self.assertEqual(self.conf().seatsAvailable, 1)
+        form = self.register(LATE)
+        self.assertFalse(form.data)
+        self.assertEqual(form.waitlistPosition, 2)
+        self.assertEqual(waitlist.promote(self.wsck), 1)
+        conf = self.conf()
+        self.assertEqual((conf.seatsAvailable, conf.waitlisted), (0, 1))
+        self.signIn(WAITING)
+        self.assertIn(self.wsck, self.call(
+            'getProfile', conference.ETAG_GET_REQUEST).conferenceKeysToAttend)
+
+    def testLeavingTheWaitlistReopensRegistration(self):
+        self.assertTrue(self.unregister(WAITING).data)
+        self.assertEqual(self.conf().waitlisted, 0)
+        self.unregister(FIRST)
+        self.assertTrue(self.register(LATE).data)
+
+    def testGroupRegistrationLeavesFreedSeatsToTheWaitlist(self):
+        self.unregister(FIRST)
+        statuses = registration.registerUsers([self.wsck], [LATE])
+        self.assertEqual(statuses[LATE, self.wsck],
+                         RegistrationStatus.CONFERENCE_FULL)
+        self.assertEqual(self.conf().seatsAvailable, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
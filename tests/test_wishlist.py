@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+"""
+test_wishlist.py -- getWishlistAgenda reports overlapping wishlist
+sessions and a merged timeline, kept in step as sessions are added and
+removed
+
+"""
+
+# testbase puts the SDK on sys.path, so comes first
+from testbase import AppTestCase  # noqa
+
+import unittest
+
+from google.appengine.api import memcache
+
+import conference
+from models import Conference
+from models import ConferenceForm
+
+ORGANIZER = 'organizer@example.com'
+ATTENDEE = 'attendee@example.com'
+
+
+class WishlistAgendaTest(AppTestCase):
+
+    def setUp(self):
+        super(WishlistAgendaTest, self).setUp()
+        for email in (ORGANIZER, ATTENDEE):
+            self.signIn(email)
+            self.call('getProfile', conference.ETAG_GET_REQUEST)
+        self.signIn(ORGANIZER)
+        self.call('createConference', ConferenceForm, name='PyCon')
+        self.wsck = Conference.query().get().key.urlsafe()
+
+    def createSession(self, name, startTime, duration):
+        self.signIn(ORGANIZER)
+        return self.call('createSession', conference.SESH_POST_REQUEST,
+                         websafeConferenceKey=self.wsck, name=name,
+                         date='2026-06-01', startTime=startTime,
+                         duration=duration).websafeKey
+
+    def wishlist(self, *wsskeys):
+        self.signIn(ATTENDEE)
+        for wssk in wsskeys:
+            self.call('addSessionToWishlist', conference.WISHLIST_REQUEST,
+                      websafeSessionKey=wssk)
+
+    def agenda(self):
+        """Return ([(key, key, start, end)], [(start, end, [keys])])."""
+        self.signIn(ATTENDEE)
+        form = self.call('getWishlistAgenda')
+        return ([(c.websafeSessionKey, c.conflictingSessionKey,
+                  c.overlapStart, c.overlapEnd) for c in form.conflicts],
+                [(b.start, b.end, b.websafeSessionKeys)
+                 for b in form.timeline])
+
+    def testOverlappingSessionsConflict(self):
+        keynote = self.createSession('Keynote', '10:00', 60)
+        talk = self.createSession('Talk', '10:30', 60)
+        self.wishlist(keynote, talk)
+        conflicts, timeline = self.agenda()
+        self.assertEqual(conflicts, [(keynote, talk, '2026-06-01 10:30:00',
+                                      '2026-06-01 11:00:00')])
+        self.assertEqual(timeline, [('2026-06-01 10:00:00',
+                                     '2026-06-01 11:30:00', [keynote, talk])])
+
+    def testTouchingSessionsDoNotConflict(self):
+        keynote = self.createSession('Keynote', '10:00', 60)
+        talk = self.createSession('Talk', '11:00', 30)
+        later = self.createSession('Later', '14:00', 30)
+        self.wishlist(later, keynote, talk)
+        conflicts, timeline = self.agenda()
+        self.assertEqual(conflicts, [])
+        self.assertEqual(timeline, [
+            ('2026-06-01 10:00:00', '2026-06-01 11:30:00', [keynote, talk]),
+            ('2026-06-01 14:00:00', '2026-06-01 14:30:00', [later])])
+
+    def testZeroLengthSessionsConflictWithNothing(self):
+        keynote = self.createSession('Keynote', '10:00', 60)
+        photo = self.createSession('Photo', '10:15', 0)
+        self.wishlist(keynote, photo)
+        conflicts, timeline = self.agenda()
+        self.assertEqual(conflicts, [])
+        self.assertEqual(timeline, [('2026-06-01 10:00:00',
+                                     '2026-06-01 11:00:00', [keynote, photo])])
+
+    def testRemovalUpdatesTheCachedIndex(self):
+        keynote = self.createSession('Keynote', '10:00', 60)
+        talk = self.createSession('Talk', '10:30', 60)
+        self.wishlist(keynote, talk)
+        self.assertEqual(len(self.agenda()[0]), 1)
+        mc_key = conference.MEMCACHE_WISHLIST_INDEX_KEY + ATTENDEE
+        self.assertEqual(len(memcache.get(mc_key)['intervals']), 2)
+        self.call('removeSessionFromWishlist', conference.WISHLIST_REQUEST,
+                  websafeSessionKey=talk)
+        # the cached index is edited in place, not rebuilt
+        self.assertEqual(memcache.get(mc_key)['keys'], [keynote])
+        self.assertEqual(len(memcache.get(mc_key)['intervals']), 1)
+        conflicts, timeline = self.agenda()
+        self.assertEqual(conflicts, [])
+        self.assertEqual(timeline, [('2026-06-01 10:00:00',
+                                     '2026-06-01 11:00:00', [keynote])])
+
+
+if __name__ == '__main__':
+    unittest.main()
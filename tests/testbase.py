@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+"""
+testbase.py -- shared setup for the tests, run against the SDK's stubs
+
+Each test gets fresh datastore, memcache, task queue & mail stubs, and
+calls ConferenceApi methods in-process as the user signed in with
+signIn(). Run from the app root:
+
+    APPENGINE_SDK=~/google-cloud-sdk/platform/google_appengine \\
+        python -m unittest discover -s tests
+
+"""
+
+import os
+import sys
+import unittest
+
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SDK = os.environ.get('APPENGINE_SDK')
+
+sys.path.insert(0, APP_ROOT)
+if SDK:
+    sys.path.insert(0, SDK)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+# endpoints.api_server reads the version when conference is imported
+os.environ.setdefault('CURRENT_VERSION_ID', '1.1')
+
+from google.appengine.datastore import datastore_stub_util  # noqa
+from google.appengine.ext import ndb  # noqa
+from google.appengine.ext import testbed  # noqa
+from protorpc import message_types  # noqa
+from protorpc import remote  # noqa
+
+import cache  # noqa
+import conference  # noqa
+
+APP_ID = 'dev~conference-central-jc'
+
+
+class AppTestCase(unittest.TestCase):
+    """Activate the service stubs around each test."""
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.setup_env(app_id=APP_ID, current_version_id='1.1',
+                               overwrite=True)
+        # global queries see every write, as they do once the datastore
+        # has caught up; tests of eventual consistency set their own policy
+        self.testbed.init_datastore_v3_stub(
+            consistency_policy=datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+                probability=1))
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=APP_ROOT)
+        self.testbed.init_mail_stub()
+        self.testbed.init_app_identity_stub()
+        self.testbed.init_user_stub()
+        self.taskqueue = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        self.mail = self.testbed.get_stub(testbed.MAIL_SERVICE_NAME)
+        ndb.get_context().clear_cache()
+        # the local tier of the two-tier caches outlives the stubs
+        for two_tier in cache.CACHES.values():
+            two_tier._entries.clear()
+
+    def tearDown(self):
+        self.signIn(None)
+        self.testbed.deactivate()
+
+    def signIn(self, email):
+        """Make endpoints.get_current_user() return email's user, or None."""
+        if email:
+            os.environ['ENDPOINTS_AUTH_EMAIL'] = email
+            os.environ['ENDPOINTS_AUTH_DOMAIN'] = 'gmail.com'
+        else:
+            os.environ.pop('ENDPOINTS_AUTH_EMAIL', None)
+            os.environ.pop('ENDPOINTS_AUTH_DOMAIN', None)
+
+    def call(self, method, container=None, headers=None, **fields):
+        """Call a ConferenceApi method the way the Endpoints SPI would,
+        with the given request headers."""
+        api = conference.ConferenceApi()
+        api.initialize_request_state(
+            remote.HttpRequestState(http_method='POST', headers=headers or {}))
+        if container is None:
+            message_class = message_types.VoidMessage
+        elif hasattr(container, 'combined_message_class'):
+            message_class = container.combined_message_class
+        else:
+            message_class = container
+        return getattr(api, method)(message_class(**fields))
@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+
+"""
+build_assets.py -- bundle, minify & fingerprint the web client's static files
+
+The <!-- build:css --> & <!-- build:js --> blocks of templates/index.html
+are each concatenated into one minified bundle. Images & fonts are
+recompressed (when PIL is installed) and every file gets the first
+HASH_LENGTH hex digits of its md5 in its name, with the references in
+the CSS, partials, JS & index.html rewritten to match. Output goes to
+static/dist: fingerprinted files under assets/ (cached for a year, since
+any change gives them a new name), index.html (never cached) and
+favicon.ico. The static handlers between the # build:assets markers of
+app.yaml are rewritten to serve them. Run from the app root after
+editing anything under static/ or templates/index.html, and before
+deploying:
+
+    python tools/build_assets.py
+
+"""
+
+import argparse
+import hashlib
+import os
+import posixpath
+import re
+import shutil
+from cStringIO import StringIO
+
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INDEX_SOURCE = 'templates/index.html'
+DIST_DIR = 'static/dist'
+ASSETS_URL = '/assets'
+HASH_LENGTH = 10
+JPEG_QUALITY = 85
+
+# URL prefixes the sources use, as they were served before the build
+URL_DIRS = {
+    '/css': 'static/bootstrap/css',
+    '/fonts': 'static/fonts',
+    '/img': 'static/img',
+    '/js': 'static/js',
+    '/partials': 'static/partials',
+}
+# copied (after recompressing images) in this order; the partials &
+# bundles that refer to them are written afterwards
+COPY_DIRS = ['static/img', 'static/fonts']
+PARTIALS_DIR = 'static/partials'
+# browsers ask for /favicon.ico itself, so it is also copied unhashed
+FAVICON = 'static/img/favicon.ico'
+
+BUILD_BLOCK = re.compile(
+    r'([ \t]*)<!-- build:(css|js) -->(.*?)<!-- endbuild -->', re.S)
+LOCAL_URL = re.compile(r'''(?:href|src)=["'](/[^"']+)["']''')
+ASSET_REF = re.compile(r'''(["'(])(/(?:%s)/[^"'()?#\s]+)''' %
+                       '|'.join(prefix[1:] for prefix in URL_DIRS))
+CSS_URL = re.compile(r'''url\((["']?)([^"')]+)\1\)''')
+APP_YAML_BLOCK = re.compile(r'# build:assets.*?# endbuild\n', re.S)
+
+APP_YAML_HANDLERS = """\
+# build:assets -- written by tools/build_assets.py
+- url: /favicon\\.ico
+  static_files: %(dist)s/favicon.ico
+  upload: %(dist)s/favicon\\.ico
+  expiration: "1d"
+
+- url: %(assets_url)s
+  static_dir: %(dist)s%(assets_url)s
+  expiration: "365d"
+
+- url: /
+  static_files: %(dist)s/index.html
+  upload: %(dist)s/index\\.html
+  secure: always
+  expiration: "0s"
+# endbuild
+"""
+
+JS_KEYWORDS_BEFORE_REGEX = re.compile(
+    r'(?:^|[^\w$])(?:return|typeof|case|do|else|in|instanceof|new|delete|'
+    r'void|throw)$')
+
+
+def readFile(path):
+    with open(os.path.join(APP_ROOT, path), 'rb') as f:
+        return f.read()
+
+
+def writeFile(path, data):
+    with open(os.path.join(APP_ROOT, path), 'wb') as f:
+        f.write(data)
+
+
+def urlToSource(url):
+    """Return the source path of a pre-build URL, or None."""
+    for prefix, directory in URL_DIRS.items():
+        if url.startswith(prefix + '/'):
+            return directory + url[len(prefix):]
+    return None
+
+
+def sourceToUrl(path):
+    """Return the pre-build URL of a source path, or None."""
+    for prefix, directory in URL_DIRS.items():
+        if path.startswith(directory + '/'):
+            return prefix + path[len(directory):]
+    return None
+
+
+def minifyJs(source):
+    """Strip comments, indentation & blank lines.
+
+    Newlines are kept, so automatic semicolon insertion behaves as in the
+    source, and names are kept, so Angular's injector still reads the
+    dependencies from the parameter names.
+    """
+    out = []
+    i, n = 0, len(source)
+    while i < n:
+        c = source[i]
+        if c in '\'"':
+            j = i + 1
+            while j < n and source[j] != c:
+                j += 2 if source[j] == '\\' else 1
+            out.append(source[i:j + 1])
+            i = j + 1
+        elif source.startswith('//', i):
+            j = source.find('\n', i)
+            i = n if j < 0 else j
+        elif source.startswith('/*', i):
+            j = source.find('*/', i + 2)
+            j = n if j < 0 else j + 2
+            out.append('\n' if '\n' in source[i:j] else ' ')
+            i = j
+        elif c == '/' and _regexMayStart(''.join(out[-20:]).rstrip()):
+            j = i + 1
+            in_class = False
+            while j < n and (source[j] != '/' or in_class):
+                if source[j] == '\\':
+                    j += 1
+                elif source[j] == '[':
+                    in_class = True
+                elif source[j] == ']':
+                    in_class = False
+                j += 1
+            out.append(source[i:j + 1])
+            i = j + 1
+        else:
+            out.append(c)
+            i += 1
+    lines = [line.strip() for line in ''.join(out).split('\n')]
+    return '\n'.join(line for line in lines if line) + '\n'
+
+
+def _regexMayStart(before):
+    """Whether a / after the code in before starts a regex literal rather
+    than being a division."""
+    return (not before or before[-1] in '(,=:[!&|?{};+-*%<>~^' or
+            bool(JS_KEYWORDS_BEFORE_REGEX.search(before)))
+
+
+def minifyCss(source):
+    """Drop comments (but /*! licences) and collapsible whitespace."""
+    source = re.sub(r'/\*(?!!).*?\*/', '', source, flags=re.S)
+    source = re.sub(r'\s+', ' ', source)
+    source = re.sub(r'\s*([{};,>])\s*', r'\1', source)
+    return source.replace(';}', '}').strip() + '\n'
+
+
+def recompressImage(path, data):
+    """Return data re-encoded by PIL if that is smaller, else data."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return data
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in ('.jpg', '.jpeg', '.png'):
+        return data
+    image = Image.open(StringIO(data))
+    buf = StringIO()
+    if ext == '.png':
+        image.save(buf, 'PNG', optimize=True)
+    else:
+        image.save(buf, 'JPEG', quality=JPEG_QUALITY, optimize=True,
+                   progressive=True)
+    return buf.getvalue() if buf.tell() < len(data) else data
+
+
+class AssetBuilder(object):
+    """Write fingerprinted assets, remembering each source's new URL."""
+
+    def __init__(self):
+        self.urls = {}  # source path -> fingerprinted URL
+        self.sizes = []  # (name, source bytes, built bytes)
+
+    def emit(self, source_path, data, source_size=None):
+        """Write data under its fingerprinted name; return its URL."""
+        base, ext = os.path.splitext(os.path.basename(source_path))
+        digest = hashlib.md5(data).hexdigest()[:HASH_LENGTH]
+        name = '%s.%s%s' % (base, digest, ext)
+        writeFile(os.path.join(DIST_DIR + ASSETS_URL, name), data)
+        url = '%s/%s' % (ASSETS_URL, name)
+        self.urls[source_path] = url
+        self.sizes.append((name, len(data) if source_size is None
+                           else source_size, len(data)))
+        return url
+
+    def rewriteRefs(self, text):
+        """Point pre-build URLs in HTML or JS at the built files."""
+        def replace(match):
+            source = urlToSource(match.group(2))
+            if source not in self.urls:
+                return match.group(0)
+            return match.group(1) + self.urls[source]
+        return ASSET_REF.sub(replace, text)
+
+    def rewriteCssUrls(self, css, css_path):
+        """Point the url()s of a stylesheet at the built files."""
+        def replace(match):
+            url = match.group(2)
+            if url.startswith(('//', 'http:', 'https:', 'data:')):
+                return match.group(0)
+            path, suffix = re.match(r'([^?#]*)(.*)', url).groups()
+            # relative URLs resolve against the stylesheet's URL, which
+            # isn't its path: /css is served from static/bootstrap/css
+            source = urlToSource(posixpath.normpath(posixpath.join(
+                posixpath.dirname(sourceToUrl(css_path)), path)))
+            if source not in self.urls:
+                raise SystemExit('%s: no built file for url(%s)'
+                                 % (css_path, url))
+            return 'url(%s%s)' % (self.urls[source], suffix)
+        return CSS_URL.sub(replace, css)
+
+    def bundle(self, kind, sources):
+        """Concatenate, rewrite & minify sources into one bundle."""
+        parts = []
+        for source in sources:
+            text = readFile(source)
+            if kind == 'css':
+                parts.append(self.rewriteCssUrls(text, source))
+            else:
+                # a source missing its final semicolon can't run into the next
+                parts.append(self.rewriteRefs(text).rstrip() + '\n;')
+        text = '\n'.join(parts)
+        minified = minifyCss(text) if kind == 'css' else minifyJs(text)
+        return self.emit('app.' + kind, minified, len(text))
+
+    def build(self):
+        dist = os.path.join(APP_ROOT, DIST_DIR)
+        if os.path.isdir(dist):
+            shutil.rmtree(dist)
+        os.makedirs(dist + ASSETS_URL)
+
+        for directory in COPY_DIRS:
+            for name in sorted(os.listdir(os.path.join(APP_ROOT, directory))):
+                source = '%s/%s' % (directory, name)
+                data = readFile(source)
+                self.emit(source, recompressImage(source, data), len(data))
+        for name in sorted(os.listdir(os.path.join(APP_ROOT, PARTIALS_DIR))):
+            source = '%s/%s' % (PARTIALS_DIR, name)
+            self.emit(source, self.rewriteRefs(readFile(source)))
+
+        def replaceBlock(match):
+            indent, kind, body = match.groups()
+            sources = [urlToSource(url) for url in LOCAL_URL.findall(body)]
+            if None in sources:
+                raise SystemExit('%s: unknown URL in build:%s block'
+                                 % (INDEX_SOURCE, kind))
+            url = self.bundle(kind, sources)
+            if kind == 'css':
+                return '%s<link rel="stylesheet" href="%s">' % (indent, url)
+            return '%s<script src="%s"></script>' % (indent, url)
+
+        writeFile(DIST_DIR + '/favicon.ico', readFile(FAVICON))
+        index = BUILD_BLOCK.sub(replaceBlock, readFile(INDEX_SOURCE))
+        writeFile(DIST_DIR + '/index.html', self.rewriteRefs(index))
+
+    def writeAppYaml(self):
+        """Rewrite the static handlers of app.yaml to serve the build."""
+        app_yaml = readFile('app.yaml')
+        if not APP_YAML_BLOCK.search(app_yaml):
+            raise SystemExit('app.yaml has no # build:assets block')
+        handlers = APP_YAML_HANDLERS % {'assets_url': ASSETS_URL,
+                                        'dist': DIST_DIR}
+        writeFile('app.yaml', APP_YAML_BLOCK.sub(lambda _: handlers, app_yaml))
+
+    def report(self):
+        print '%-44s %9s %9s' % ('file', 'source', 'built')
+        for name, source_size, size in self.sizes:
+            print '%-44s %9d %9d' % (name, source_size, size)
+        print '%-44s %9d %9d' % ('total', sum(s[1] for s in self.sizes),
+                                 sum(s[2] for s in self.sizes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--no-app-yaml', action='store_true',
+                        help="don't rewrite the handlers in app.yaml")
+    args = parser.parse_args()
+
+    builder = AssetBuilder()
+    builder.build()
+    if not args.no_app_yaml:
+        builder.writeAppYaml()
+    builder.report()
+
+
+if __name__ == '__main__':
+    main()
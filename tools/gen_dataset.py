@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+
+"""
+gen_dataset.py -- write a seeded, production-shaped dataset to the local
+    datastore stub
+
+Profiles, Conferences with Zipf-skewed city/topic/month distributions,
+Sessions per conference drawn from a shared pool of Speakers, and
+registrations & wishlists that follow a popularity curve. The same --seed
+always produces the same data. Run from the app root:
+
+    python tools/gen_dataset.py --sdk ~/google-cloud-sdk/platform/google_appengine \\
+        --datastore-path conference.sqlite --conferences 200 --sessions 2000
+
+"""
+
+import argparse
+import bisect
+import random
+import time
+from datetime import date
+from datetime import time as dtime
+from datetime import timedelta
+
+from local_stubs import activateStubs
+from local_stubs import addStubArguments
+
+CITIES = ['London', 'San Francisco', 'New York', 'Berlin', 'Tokyo',
+          'Chicago', 'Paris', 'Austin', 'Seattle', 'Sydney', 'Toronto',
+          'Bangalore', 'Amsterdam', 'Boston', 'Singapore', 'Dublin']
+TOPICS = ['Medical Innovations', 'Programming Languages', 'Web Technologies',
+          'Movie Making', 'Health and Nutrition', 'Machine Learning',
+          'Cloud Computing', 'Security', 'Mobile', 'Design', 'Data',
+          'DevOps']
+# conference season: more in spring & autumn, few in summer & December
+MONTH_WEIGHTS = [3, 4, 8, 10, 9, 6, 3, 2, 9, 10, 7, 2]
+GENDERS = ['female', 'male', 'other']
+
+BATCH_SIZE = 500
+
+
+class WeightedChoice(object):
+    """Draw items with given weights using a cumulative table + bisect."""
+
+    def __init__(self, rng, items, weights):
+        self.rng = rng
+        self.items = items
+        self.totals = []
+        total = 0.0
+        for weight in weights:
+            total += weight
+            self.totals.append(total)
+
+    def __call__(self):
+        return self.items[bisect.bisect(self.totals,
+                                        self.rng.random() * self.totals[-1])]
+
+    def sample(self, k):
+        """Return up to k distinct items, in the order they were drawn."""
+        k = min(k, len(self.items))
+        if k > len(self.items) // 2:
+            return self.rng.sample(self.items, k)
+        picked = []
+        seen = set()
+        while len(picked) < k:
+            i = bisect.bisect(self.totals, self.rng.random() * self.totals[-1])
+            if i not in seen:
+                seen.add(i)
+                picked.append(self.items[i])
+        return picked
+
+
+def zipf(rng, items, s=1.1):
+    """Return a WeightedChoice over items with Zipf(s) popularity."""
+    return WeightedChoice(rng, items,
+                          [1.0 / (rank + 1) ** s for rank in range(len(items))])
+
+
+def putBatched(ndb, entities):
+    """put_multi entities in BATCH_SIZE chunks."""
+    for start in range(0, len(entities), BATCH_SIZE):
+        ndb.put_multi(entities[start:start + BATCH_SIZE])
+
+
+def generate(args):
+    """Generate the dataset described by args, returning entity counts."""
+    from google.appengine.ext import ndb
+    import models
+    from facets import conferenceFacets
+
+    rng = random.Random(args.seed)
+    counts = {}
+
+    # Profiles
+    profiles = [models.Profile(
+        key=ndb.Key(models.Profile, 'user%06d@example.com' % i),
+        displayName='User %d' % i,
+        mainEmail='user%06d@example.com' % i,
+        teeShirtSize=rng.choice(sorted(models.TeeShirtSize.names())),
+    ) for i in range(args.profiles)]
+
+    # Conferences, organized by a small set of heavy organizers
+    organizer = zipf(rng, profiles, 1.3)
+    city = zipf(rng, CITIES)
+    topic = zipf(rng, TOPICS)
+    month = WeightedChoice(rng, range(1, 13), MONTH_WEIGHTS)
+    conferences = []
+    for i in range(args.conferences):
+        org = organizer()
+        start = date(args.year, month(), rng.randint(1, 28))
+        max_attendees = rng.choice([50, 100, 200, 500, 1000, 5000])
+        conferences.append(models.Conference(
+            key=ndb.Key(models.Conference, i + 1, parent=org.key),
+            name='Conference %d' % i,
+            description='Synthetic conference %d' % i,
+            organizerUserId=org.key.id(),
+            topics=topic.sample(rng.randint(1, 3)),
+            city=city(),
+            startDate=start,
+            month=start.month,
+            endDate=start + timedelta(days=rng.randint(0, 3)),
+            maxAttendees=max_attendees,
+            seatsAvailable=max_attendees,
+        ))
+
+    # Speakers shared across conferences; a few speak everywhere
+    speakers = [models.Speaker(
+        key=ndb.Key(models.Speaker, i + 1),
+        name='Speaker %d' % i,
+        email='speaker%06d@example.com' % i,
+        gender=rng.choice(GENDERS),
+    ) for i in range(args.speakers)]
+    speaker = zipf(rng, speakers, 1.2)
+
+    # Sessions
+    session_types = [models.TypeOfSession(number)
+                     for number in sorted(models.TypeOfSession.numbers())]
+    session_choice = {}
+    session_count = 0
+    for conf in conferences:
+        sessions = []
+        rows = []
+        days = (conf.endDate - conf.startDate).days + 1
+        for j in range(args.sessions):
+            spk = speaker()
+            sessions.append(models.Session(
+                key=ndb.Key(models.Session, j + 1, parent=conf.key),
+                name='Session %d.%d' % (conf.key.id(), j),
+                highlights='Synthetic session',
+                speakerId=spk.key.id(),
+                duration=rng.choice([30, 45, 60, 90, 120]),
+                typeOfSession=[rng.choice(session_types)],
+                date=conf.startDate + timedelta(days=rng.randrange(days)),
+                startTime=dtime(rng.randint(8, 20), rng.choice([0, 15, 30, 45])),
+            ))
+            rows.append(models.SpeakerSession.forSession(sessions[-1], spk.email))
+        session_choice[conf.key] = zipf(rng, sessions)
+        putBatched(ndb, sessions)
+        putBatched(ndb, rows)
+        session_count += len(sessions)
+    counts['Session'] = session_count
+
+    # Registrations & wishlists follow conference popularity
+    popular = zipf(rng, conferences, 1.0)
+    for prof in profiles:
+        attending = [conf for conf in popular.sample(rng.randint(0, args.max_registrations))
+                     if conf.seatsAvailable > 0]
+        for conf in attending:
+            conf.seatsAvailable -= 1
+            prof.conferenceKeysToAttend.append(conf.key.urlsafe())
+            wished = session_choice[conf.key].sample(
+                rng.randint(0, args.max_wishlist))
+            for sesh in wished:
+                prof.sessionKeysWishlist.append(sesh.key.urlsafe())
+
+    # facet counts for getConferenceFacets, one shard per value
+    facet_counts = {}
+    for conf in conferences:
+        for facet_value in conferenceFacets(conf):
+            facet_counts[facet_value] = facet_counts.get(facet_value, 0) + 1
+    shards = [models.FacetCounterShard(
+        key=ndb.Key(models.FacetCounterShard, u'%s:%s:0' % facet_value),
+        facet=facet_value[0], value=facet_value[1], count=count,
+    ) for facet_value, count in facet_counts.items()]
+
+    putBatched(ndb, profiles)
+    putBatched(ndb, conferences)
+    putBatched(ndb, speakers)
+    putBatched(ndb, shards)
+    counts.update({'Profile': len(profiles), 'Conference': len(conferences),
+                   'Speaker': len(speakers), 'FacetCounterShard': len(shards)})
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    addStubArguments(parser)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--profiles', type=int, default=2000)
+    parser.add_argument('--conferences', type=int, default=100)
+    parser.add_argument('--sessions', type=int, default=1000,
+                        help='sessions per conference')
+    parser.add_argument('--speakers', type=int, default=3000)
+    parser.add_argument('--max-registrations', type=int, default=5)
+    parser.add_argument('--max-wishlist', type=int, default=10,
+                        help='max wishlisted sessions per registration')
+    parser.add_argument('--year', type=int, default=date.today().year + 1)
+    args = parser.parse_args()
+
+    tb = activateStubs(args)
+    started = time.time()
+    try:
+        counts = generate(args)
+    finally:
+        tb.deactivate()
+    for kind, count in sorted(counts.items()):
+        print '%-18s %8d' % (kind, count)
+    print 'wrote %s in %.1fs' % (args.datastore_path, time.time() - started)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+"""
+gen_indexes.py -- derive the minimal index.yaml & report index write cost
+
+queryConferences (ConferenceApi._getQuery) accepts equality filters on any
+subset of FIELDS, at most one inequality field, and always sorts on the
+inequality field (if any) then name. Rather than one composite index per
+combination of filters, the datastore can zigzag merge join indexes that
+share a sort suffix, so it is enough to have:
+
+    (field, name)                for every field in FIELDS
+    (eq_field, ineq_field, name) for every ordered pair of distinct fields
+
+The indexes above the AUTOGENERATED marker in index.yaml are kept as is.
+Run from the app root:
+
+    python tools/gen_indexes.py --sdk ~/google-cloud-sdk/platform/google_appengine [--write]
+
+"""
+
+import argparse
+import os
+import sys
+
+from profile_imports import setupPaths
+
+AUTOGENERATED = '# AUTOGENERATED'
+
+# entity path length of each kind, i.e. the rows an ancestor index writes
+KIND_DEPTH = {
+    'Profile': 1,
+    'Conference': 2,
+    'Session': 3,
+    'Speaker': 1,
+    'FeaturedSpeaker': 3,
+    'SpeakerSession': 2,
+}
+
+
+def queryIndexes(fields):
+    """Return the (kind, ancestor, properties) indexes _getQuery needs."""
+    indexes = [('Conference', False, (field, 'name')) for field in fields]
+    for ineq in fields:
+        for eq in fields:
+            if eq != ineq:
+                indexes.append(('Conference', False, (eq, ineq, 'name')))
+    return indexes
+
+
+def readIndexYaml(path):
+    """Return (manual text, manual indexes, autogenerated indexes)."""
+    import yaml
+    text = open(path).read()
+    manual_text, _, auto_text = text.partition(AUTOGENERATED)
+
+    def parse(chunk):
+        doc = yaml.safe_load(chunk) or {}
+        if isinstance(doc, list):
+            doc = {'indexes': doc}
+        return [(index['kind'], index.get('ancestor') in (True, 'yes'),
+                 tuple(prop['name'] for prop in index['properties']))
+                for index in doc.get('indexes') or []]
+
+    return manual_text, parse(manual_text), parse(auto_text.split('\n', 1)[-1])
+
+
+def formatIndexes(indexes):
+    """Format indexes as index.yaml entries."""
+    lines = []
+    for kind, ancestor, props in indexes:
+        lines.append('- kind: %s' % kind)
+        if ancestor:
+            lines.append('  ancestor: yes')
+        lines.append('  properties:')
+        lines.extend('  - name: %s' % prop for prop in props)
+        lines.append('')
+    return '\n'.join(lines)
+
+
+def indexRowsPerPut(model, indexes, repeated_values, all_indexed=False):
+    """Return the index rows written by putting one new entity of model."""
+    kind = model._get_kind()
+    props = model._properties
+
+    def values(name):
+        prop = props.get(name)
+        return repeated_values if prop is not None and prop._repeated else 1
+
+    rows = 1  # EntitiesByKind
+    for name, prop in props.items():
+        if all_indexed or prop._indexed:
+            rows += 2 * values(name)  # built-in ascending & descending
+    for index_kind, ancestor, index_props in indexes:
+        if index_kind != kind:
+            continue
+        combos = 1
+        for name in index_props:
+            combos *= values(name)
+        rows += combos * (KIND_DEPTH.get(kind, 1) if ancestor else 1)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--sdk', help='path to the google_appengine SDK')
+    parser.add_argument('--index-yaml', default='index.yaml')
+    parser.add_argument('--repeated-values', type=int, default=2,
+                        help='assumed number of values per repeated property')
+    parser.add_argument('--write', action='store_true',
+                        help='rewrite index.yaml with the generated set')
+    args = parser.parse_args()
+
+    setupPaths(args.sdk)
+    import models
+    from conference import FIELDS
+
+    manual_text, manual, current_auto = readIndexYaml(args.index_yaml)
+    generated = [index for index in queryIndexes(sorted(FIELDS.values()))
+                 if index not in manual]
+
+    print 'Index write amplification (index rows per new entity put):'
+    print '%-16s %8s %8s' % ('kind', 'before', 'after')
+    for model in (models.Profile, models.Conference, models.Session,
+                  models.Speaker, models.FeaturedSpeaker,
+                  models.SpeakerSession):
+        before = indexRowsPerPut(model, manual + current_auto,
+                                 args.repeated_values, all_indexed=True)
+        after = indexRowsPerPut(model, manual + generated,
+                                args.repeated_values)
+        print '%-16s %8d %8d' % (model._get_kind(), before, after)
+    print '%d composite indexes before, %d after' % (
+        len(manual + current_auto), len(manual + generated))
+
+    text = (manual_text.rstrip('\n') + '\n\n' + formatIndexes(generated) +
+            '\n' + AUTOGENERATED + '\n')
+    if args.write:
+        open(args.index_yaml, 'w').write(text)
+        print 'wrote %s' % args.index_yaml
+    else:
+        sys.stdout.write('\n' + text)
+
+
+if __name__ == '__main__':
+    main()
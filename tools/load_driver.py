@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+
+"""
+load_driver.py -- replay mixed ConferenceApi traffic against the local stubs
+
+Worker threads call the ConferenceApi methods in-process as randomly
+chosen users (Zipf-skewed towards popular conferences, so hot entity
+groups see contention) with a configurable read/write ratio, then print
+per-method latency percentiles & error counts. Point it at a datastore
+written by gen_dataset.py. Run from the app root:
+
+    python tools/load_driver.py --sdk ~/google-cloud-sdk/platform/google_appengine \\
+        --datastore-path conference.sqlite --threads 8 --requests 5000 --read-ratio 0.9
+
+"""
+
+import argparse
+import bisect
+import random
+import threading
+import time
+
+from local_stubs import activateStubs
+from local_stubs import addStubArguments
+
+
+def percentile(sorted_values, pct):
+    """Return the pct percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100.0))
+    return sorted_values[index]
+
+
+class LoadDriver(object):
+    """Issue weighted random ConferenceApi calls from worker threads."""
+
+    def __init__(self, args):
+        from google.appengine.api import users
+        from google.appengine.ext import ndb
+        from protorpc import message_types
+        import endpoints
+        import conference
+        import models
+
+        self.args = args
+        self.users = users
+        self.conference = conference
+        self.models = models
+        self.void = message_types.VoidMessage
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.issued = 0
+        self.results = {}
+
+        # endpoints reads the user from the request's auth token; the
+        # driver has no HTTP layer, so each worker thread supplies its own
+        endpoints.get_current_user = lambda: self.local.user
+
+        self.emails = [key.id() for key in
+                       models.Profile.query().fetch(keys_only=True)]
+        self.conf_keys = [key.urlsafe() for key in
+                          models.Conference.query().fetch(keys_only=True)]
+        self.session_keys = [key.urlsafe() for key in
+                             models.Session.query().fetch(
+                                 args.max_sessions, keys_only=True)]
+        if not (self.emails and self.conf_keys):
+            raise SystemExit('No data in %s; run gen_dataset.py first'
+                             % args.datastore_path)
+        self.conf_totals = []
+        total = 0.0
+        for rank in range(len(self.conf_keys)):
+            total += 1.0 / (rank + 1)
+            self.conf_totals.append(total)
+        self.cities = sorted(set(
+            conf.city for conf in ndb.get_multi(
+                [ndb.Key(urlsafe=wsck) for wsck in self.conf_keys[:50]])))
+
+        self.reads = [
+            (30, self.getConference),
+            (15, self.getConferenceDetail),
+            (15, self.queryConferences),
+            (10, self.getConferenceSessions),
+            (10, self.getProfile),
+            (8, self.getConferencesToAttend),
+            (5, self.getSeatAvailability),
+            (4, self.getConferenceFacets),
+            (3, self.getWishlistAgenda),
+        ]
+        self.writes = [
+            (35, self.registerForConference),
+            (15, self.unregisterFromConference),
+            (25, self.addSessionToWishlist),
+            (15, self.removeSessionFromWishlist),
+            (10, self.saveProfile),
+        ]
+
+    # - - - request helpers - - - - - - - - - - - - - - - - - - -
+
+    def rng(self):
+        return self.local.rng
+
+    def popularConference(self):
+        r = self.rng().random() * self.conf_totals[-1]
+        return self.conf_keys[bisect.bisect(self.conf_totals, r)]
+
+    def call(self, method, container=None, **fields):
+        """Call an API method the way the Endpoints SPI would."""
+        message_class = (container.combined_message_class
+                         if container is not None else self.void)
+        return getattr(self.local.api, method)(message_class(**fields))
+
+    # - - - reads - - - - - - - - - - - - - - - - - - - - - - -
+
+    def getConference(self):
+        self.call('getConference', self.conference.CONF_ETAG_GET_REQUEST,
+                  websafeConferenceKey=self.popularConference())
+
+    def getConferenceDetail(self):
+        self.call('getConferenceDetail', self.conference.CONF_GET_REQUEST,
+                  websafeConferenceKey=self.popularConference())
+
+    def queryConferences(self):
+        filters = []
+        if self.rng().random() < 0.7:
+            filters.append(self.models.ConferenceQueryForm(
+                field='CITY', operator='EQ', value=self.rng().choice(self.cities)))
+        if self.rng().random() < 0.3:
+            filters.append(self.models.ConferenceQueryForm(
+                field='MONTH', operator='GT', value=str(self.rng().randint(1, 11))))
+        self.local.api.queryConferences(
+            self.models.ConferenceQueryForms(filters=filters))
+
+    def getConferenceSessions(self):
+        self.call('getConferenceSessions',
+                  self.conference.SESH_ETAG_GET_REQUEST,
+                  websafeConferenceKey=self.popularConference())
+
+    def getProfile(self):
+        self.call('getProfile', self.conference.ETAG_GET_REQUEST)
+
+    def getConferencesToAttend(self):
+        self.call('getConferencesToAttend', self.conference.ETAG_GET_REQUEST)
+
+    def getSeatAvailability(self):
+        self.call('getSeatAvailability', self.conference.CONF_KEYS_GET_REQUEST,
+                  websafeConferenceKey=[self.popularConference()
+                                        for _ in range(10)])
+
+    def getConferenceFacets(self):
+        self.call('getConferenceFacets')
+
+    def getWishlistAgenda(self):
+        self.call('getWishlistAgenda')
+
+    # - - - writes - - - - - - - - - - - - - - - - - - - - - - -
+
+    def registerForConference(self):
+        self.call('registerForConference', self.conference.CONF_GET_REQUEST,
+                  websafeConferenceKey=self.popularConference())
+
+    def unregisterFromConference(self):
+        self.call('unregisterFromConference', self.conference.CONF_GET_REQUEST,
+                  websafeConferenceKey=self.popularConference())
+
+    def addSessionToWishlist(self):
+        self.call('addSessionToWishlist', self.conference.WISHLIST_REQUEST,
+                  websafeSessionKey=self.rng().choice(self.session_keys))
+
+    def removeSessionFromWishlist(self):
+        self.call('removeSessionFromWishlist', self.conference.WISHLIST_REQUEST,
+                  websafeSessionKey=self.rng().choice(self.session_keys))
+
+    def saveProfile(self):
+        self.local.api.saveProfile(self.models.ProfileMiniForm(
+            displayName='Load %d' % self.rng().randint(0, 1000)))
+
+    # - - - driver - - - - - - - - - - - - - - - - - - - - - - -
+
+    def pick(self, weighted):
+        total = sum(weight for weight, _ in weighted)
+        r = self.rng().random() * total
+        for weight, op in weighted:
+            r -= weight
+            if r < 0:
+                return op
+        return weighted[-1][1]
+
+    def record(self, name, elapsed, error):
+        with self.lock:
+            latencies, errors = self.results.setdefault(name, ([], {}))
+            latencies.append(elapsed)
+            if error:
+                errors[error] = errors.get(error, 0) + 1
+
+    def worker(self, seed):
+        from protorpc import remote
+        self.local.rng = random.Random(seed)
+        self.local.api = self.conference.ConferenceApi()
+        self.local.api.initialize_request_state(
+            remote.HttpRequestState(http_method='POST', headers={}))
+        while True:
+            with self.lock:
+                if self.issued >= self.args.requests:
+                    return
+                self.issued += 1
+            self.local.user = self.users.User(
+                self.rng().choice(self.emails), _auth_domain='gmail.com')
+            reads = self.rng().random() < self.args.read_ratio
+            op = self.pick(self.reads if reads else self.writes)
+            error = None
+            started = time.time()
+            try:
+                op()
+            except Exception as e:
+                error = e.__class__.__name__
+            self.record(op.__name__, (time.time() - started) * 1000, error)
+
+    def run(self):
+        threads = [threading.Thread(target=self.worker,
+                                    args=(self.args.seed + i,))
+                   for i in range(self.args.threads)]
+        started = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.time() - started
+
+    def report(self, elapsed):
+        print '%-28s %7s %8s %8s %8s  %s' % (
+            'method', 'calls', 'p50 ms', 'p95 ms', 'p99 ms', 'errors')
+        for name in sorted(self.results):
+            latencies, errors = self.results[name]
+            latencies.sort()
+            print '%-28s %7d %8.1f %8.1f %8.1f  %s' % (
+                name, len(latencies), percentile(latencies, 50),
+                percentile(latencies, 95), percentile(latencies, 99),
+                ', '.join('%s=%d' % item for item in sorted(errors.items())))
+        print '%d calls in %.1fs (%.1f calls/s)' % (
+            self.issued, elapsed, self.issued / elapsed if elapsed else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    addStubArguments(parser)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--read-ratio', type=float, default=0.9)
+    parser.add_argument('--max-sessions', type=int, default=20000,
+                        help='max session keys loaded to pick wishlists from')
+    args = parser.parse_args()
+
+    tb = activateStubs(args)
+    try:
+        driver = LoadDriver(args)
+        driver.report(driver.run())
+    finally:
+        tb.deactivate()
+
+
+if __name__ == '__main__':
+    main()
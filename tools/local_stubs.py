@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+"""
+local_stubs.py -- activate the App Engine service stubs for the tools
+
+Shared by gen_dataset.py & load_driver.py: the datastore stub is backed by
+a sqlite file, the same format dev_appserver.py reads with
+--datastore_path, so generated data can be browsed in the dev server too.
+
+"""
+
+import os
+
+from profile_imports import setupPaths
+
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_APP_ID = 'dev~conference-central-jc'
+
+
+def addStubArguments(parser):
+    """Add the --sdk, --datastore-path & --app-id options to parser."""
+    parser.add_argument('--sdk', help='path to the google_appengine SDK')
+    parser.add_argument('--datastore-path', default='conference.sqlite',
+                        help='sqlite datastore file (dev_appserver format)')
+    parser.add_argument('--app-id', default=DEFAULT_APP_ID,
+                        help='app ID the keys are created under')
+
+
+def activateStubs(args):
+    """Put the SDK on sys.path and activate the service stubs, returning
+    the Testbed (call deactivate() when done)."""
+    setupPaths(args.sdk)
+    from google.appengine.ext import ndb
+    from google.appengine.ext import testbed
+
+    tb = testbed.Testbed()
+    tb.activate()
+    # endpoints.api_server reads the version when conference is imported,
+    # and fails on the testbed default
+    tb.setup_env(app_id=args.app_id, auth_domain='gmail.com',
+                 current_version_id='1.1', overwrite=True)
+    tb.init_datastore_v3_stub(datastore_file=args.datastore_path,
+                              use_sqlite=True)
+    tb.init_memcache_stub()
+    tb.init_taskqueue_stub(root_path=APP_ROOT)
+    tb.init_mail_stub()
+    tb.init_app_identity_stub()
+    tb.init_user_stub()
+    tb.init_urlfetch_stub()
+    ndb.get_context().set_cache_policy(False)
+    return tb
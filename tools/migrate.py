@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+"""
+migrate.py -- run a migration (see migrations.py) against the local stubs
+
+Runs the batches in-process instead of on the task queue, with the same
+checkpointing & throttling as in production, printing progress after
+each batch. Point it at a datastore written by gen_dataset.py. Run from
+the app root:
+
+    python tools/migrate.py --sdk ~/google-cloud-sdk/platform/google_appengine \\
+        --datastore-path conference.sqlite conference_month --write-rate 500
+
+"""
+
+import argparse
+import time
+
+from local_stubs import activateStubs
+from local_stubs import addStubArguments
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    addStubArguments(parser)
+    parser.add_argument('name', nargs='?',
+                        help='migration to run; lists them if left out')
+    parser.add_argument('--batch-size', type=int)
+    parser.add_argument('--write-rate', type=float,
+                        help='entities put per second')
+    args = parser.parse_args()
+
+    tb = activateStubs(args)
+    try:
+        import migrations
+        if args.name not in migrations.MIGRATIONS:
+            for name, mig in sorted(migrations.MIGRATIONS.items()):
+                print '%-22s %-16s %s' % (name, mig.model._get_kind(),
+                                          mig.description)
+            return
+
+        def progress(run):
+            print '%6d batches %8d read %8d written' % (
+                run.batches, run.read, run.written)
+
+        started = time.time()
+        run = migrations.runToCompletion(
+            args.name,
+            args.batch_size or migrations.DEFAULT_BATCH_SIZE,
+            args.write_rate or migrations.DEFAULT_WRITE_RATE,
+            progress)
+        print '%s %s in %.1fs' % (args.name, run.status, time.time() - started)
+    finally:
+        tb.deactivate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+"""
+profile_imports.py -- report the import-time cost of the app's modules
+
+Times every import made while loading the given app modules (by default
+main and conference, the two scripts in app.yaml) and prints the
+cumulative and self time of each, slowest first. Run from the app root:
+
+    python tools/profile_imports.py --sdk ~/google-cloud-sdk/platform/google_appengine
+
+"""
+
+import __builtin__
+import argparse
+import os
+import sys
+import time
+
+
+def setupPaths(sdk):
+    """Put the App Engine SDK and the app root on sys.path."""
+    app_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, app_root)
+    if sdk:
+        sys.path.insert(0, sdk)
+        import dev_appserver
+        dev_appserver.fix_sys_path()
+
+
+def profileImports(modules):
+    """Import modules, returning {module: [cumulative secs, self secs]}."""
+    timings = {}
+    stack = []
+    real_import = __builtin__.__import__
+
+    def timed_import(name, *args, **kwargs):
+        if name in sys.modules:
+            return real_import(name, *args, **kwargs)
+        stack.append(0.0)
+        start = time.time()
+        try:
+            return real_import(name, *args, **kwargs)
+        finally:
+            elapsed = time.time() - start
+            children = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            if name in sys.modules and name not in timings:
+                timings[name] = [elapsed, elapsed - children]
+
+    __builtin__.__import__ = timed_import
+    try:
+        for module in modules:
+            timed_import(module)
+    finally:
+        __builtin__.__import__ = real_import
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('modules', nargs='*', default=['main', 'conference'])
+    parser.add_argument('--sdk', help='path to the google_appengine SDK')
+    parser.add_argument('--top', type=int, default=30,
+                        help='number of modules to list')
+    args = parser.parse_args()
+
+    setupPaths(args.sdk)
+    timings = profileImports(args.modules)
+
+    print '%10s %10s  %s' % ('cumul ms', 'self ms', 'module')
+    ranked = sorted(timings.items(), key=lambda item: -item[1][0])
+    for name, (cumulative, own) in ranked[:args.top]:
+        print '%10.1f %10.1f  %s' % (cumulative * 1000, own * 1000, name)
+    print '%d modules imported' % len(timings)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+"""
+versions.py -- Udacity conference server-side Python App Engine
+    memcache version tokens the ConferenceApi ETags are built from
+
+Writes replace the version of what they change with a fresh token, so
+the next read gets a new ETag; kept apart from conference.py so
+background tasks can invalidate ETags too. Each token carries the time
+it was made, so reads from eventually consistent queries can hold back
+their ETag until the write has had time to show up in them.
+
+"""
+
+import hashlib
+import time
+import uuid
+
+from google.appengine.api import memcache
+
+# values are (token, time made)
+MEMCACHE_VERSION_KEY = "VERSION_"  # + one of the version names below
+
+# version names for ETags; writes replace the version of what they change
+VERSION_CONFERENCES = "conferences"         # any Conference listing
+VERSION_CONFERENCE = "conference:%s"        # % websafeConferenceKey
+VERSION_PROFILE = "profile:%s"              # % user ID
+VERSION_SESSIONS = "sessions:%s"            # % websafeConferenceKey
+VERSION_SPEAKERS = "speakers"               # speaker details on sessions
+
+
+def _newVersion():
+    """Return a fresh (token, time made) version."""
+    return (uuid.uuid4().hex, time.time())
+
+
+def versionTag(names, salt='', settle_seconds=0):
+    """Return an ETag built from the current tokens of the version names,
+    or None if one of them was made less than settle_seconds ago.
+
+    Versions live only in memcache, so this never touches the
+    datastore; an evicted version just gets a fresh token (which, not
+    knowing when the last write was, counts as new).
+    """
+    versions = memcache.get_multi(names, key_prefix=MEMCACHE_VERSION_KEY)
+    missing = dict((name, _newVersion())
+                   for name in names if name not in versions)
+    if missing:
+        memcache.add_multi(missing, key_prefix=MEMCACHE_VERSION_KEY)
+        # another request may have added its token first; use that one
+        versions.update(memcache.get_multi(
+            missing.keys(), key_prefix=MEMCACHE_VERSION_KEY))
+        for name in missing:
+            versions.setdefault(name, missing[name])
+    if settle_seconds and max(versions[name][1] for name in names) > (
+            time.time() - settle_seconds):
+        return None
+    return '"%s"' % hashlib.md5('|'.join(
+        [versions[name][0] for name in names] + [salt])).hexdigest()
+
+
+def bumpVersions(*names):
+    """Invalidate every ETag built from the given version names."""
+    memcache.set_multi(dict((name, _newVersion()) for name in names),
+                       key_prefix=MEMCACHE_VERSION_KEY)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+"""
+waitlist.py -- Udacity conference server-side Python App Engine
+    FIFO waitlists for sold out conferences & seat promotion
+
+Registering for a full conference puts the user on the conference's
+Waitlist, a root entity of its own so joining never writes to the
+conference's (hot) entity group. Seats freed by unregistration, or added
+by raising maxAttendees, are handed out by a promotion task that
+registers waitlisted users in seq order in batched cross-group
+transactions, re-reading seatsAvailable in each so it never oversells.
+The conference's waitlisted count is kept in step by joining, leaving &
+promotion; registrations treat the conference as full while it is
+non-zero, so a freed seat can't be taken from under the waitlist.
+
+"""
+
+import hashlib
+import time
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import Profile
+from models import Waitlist
+from models import WaitlistEntry
+from versions import VERSION_CONFERENCE
+from versions import VERSION_CONFERENCES
+from versions import VERSION_PROFILE
+from versions import bumpVersions
+
+MEMCACHE_SEATS_KEY = "SEATS_"  # + websafeConferenceKey
+# seat counters expire so drift from lost updates is reconciled with the
+# datastore at least this often
+SEATS_CACHE_SECONDS = 300
+
+PROMOTE_URL = '/tasks/promote_waitlist'
+# a cross-group transaction spans at most 25 entity groups: the
+# Conference, the Waitlist and one Profile per promoted user
+PROMOTE_BATCH_SIZE = 20
+# promotion requests within this window share one named task
+PROMOTE_DELAY_SECONDS = 5
+
+
+def waitlistKey(wsck):
+    """Return the key of a conference's Waitlist."""
+    return ndb.Key(Waitlist, wsck)
+
+
+@ndb.transactional(xg=True)
+def joinWaitlist(wsck, user_id):
+    """Put the user at the end of the conference's waitlist (unless they
+    are on it already)."""
+    wl_key = waitlistKey(wsck)
+    conf, waitlist, entry = ndb.get_multi(
+        [ndb.Key(urlsafe=wsck), wl_key,
+         ndb.Key(WaitlistEntry, user_id, parent=wl_key)])
+    if not entry:
+        waitlist = waitlist or Waitlist(key=wl_key)
+        entry = WaitlistEntry(parent=wl_key, id=user_id, seq=waitlist.nextSeq)
+        waitlist.nextSeq += 1
+        puts = [waitlist, entry]
+        if conf:
+            conf.waitlisted += 1
+            puts.append(conf)
+        ndb.put_multi(puts)
+
+
+@ndb.transactional(xg=True)
+def leaveWaitlist(wsck, user_id):
+    """Take the user off the waitlist, returning whether they were on it."""
+    entry_key = ndb.Key(WaitlistEntry, user_id, parent=waitlistKey(wsck))
+    conf, entry = ndb.get_multi([ndb.Key(urlsafe=wsck), entry_key])
+    if not entry:
+        return False
+    entry_key.delete()
+    if conf and conf.waitlisted > 0:
+        conf.waitlisted -= 1
+        conf.put()
+    return True
+
+
+def waitlistPosition(wsck, user_id):
+    """Return the user's 1-based place on the waitlist, or None."""
+    wl_key = waitlistKey(wsck)
+    entry = ndb.Key(WaitlistEntry, user_id, parent=wl_key).get()
+    if not entry:
+        return None
+    # an ancestor keys-only count, so strongly consistent and cheap
+    return WaitlistEntry.query(WaitlistEntry.seq < entry.seq,
+                               ancestor=wl_key).count() + 1
+
+
+def queuePromotion(wsck):
+    """Make sure a promotion task runs for the conference after now.
+
+    Calls within the same PROMOTE_DELAY_SECONDS window share a task that
+    runs at the end of the window, so bursts of unregistrations cost one
+    task.
+    """
+    window = int(time.time() / PROMOTE_DELAY_SECONDS)
+    try:
+        taskqueue.add(
+            name='promote-%s-%d' % (hashlib.md5(wsck).hexdigest(), window),
+            params={'websafeConferenceKey': wsck}, url=PROMOTE_URL,
+            countdown=max(0, (window + 1) * PROMOTE_DELAY_SECONDS - time.time()))
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+@ndb.transactional(xg=True)
+def _promoteBatch(wsck):
+    """Register the first waitlisted users while seats last, returning
+    (promoted user IDs, whether more may be promotable)."""
+    conf_key = ndb.Key(urlsafe=wsck)
+    wl_key = waitlistKey(wsck)
+    conf = conf_key.get()
+    if not conf or conf.seatsAvailable <= 0:
+        return [], False
+    limit = min(PROMOTE_BATCH_SIZE, conf.seatsAvailable)
+    entries = WaitlistEntry.query(ancestor=wl_key).order(
+        WaitlistEntry.seq).fetch(limit)
+    profs = ndb.get_multi([ndb.Key(Profile, entry.key.id())
+                           for entry in entries])
+    promoted = []
+    for prof in profs:
+        # users who registered directly meanwhile just leave the list
+        if prof and wsck not in prof.conferenceKeysToAttend:
+            prof.conferenceKeysToAttend.append(wsck)
+            conf.seatsAvailable -= 1
+            promoted.append(prof)
+    # a short batch empties the list, whatever the count said
+    waitlisted = (max(0, conf.waitlisted - len(entries))
+                  if len(entries) == limit else 0)
+    if promoted or waitlisted != conf.waitlisted:
+        conf.waitlisted = waitlisted
+        ndb.put_multi([conf] + promoted)
+    ndb.delete_multi([entry.key for entry in entries])
+    return [prof.key.id() for prof in promoted], len(entries) == limit
+
+
+def promote(wsck):
+    """Fill the conference's free seats from its waitlist, returning the
+    number of users registered."""
+    total = 0
+    more = True
+    while more:
+        promoted, more = _promoteBatch(wsck)
+        if promoted:
+            memcache.decr(MEMCACHE_SEATS_KEY + wsck, len(promoted))
+            bumpVersions(VERSION_CONFERENCES, VERSION_CONFERENCE % wsck,
+                         *[VERSION_PROFILE % user_id for user_id in promoted])
+            total += len(promoted)
+    return total